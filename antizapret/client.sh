@@ -123,20 +123,13 @@ addOpenVPN(){
 		cp ./pki/private/$CLIENT_NAME.key /etc/openvpn/client/keys/$CLIENT_NAME.key
 	fi
 
-	CA_CERT="$(grep -A 999 'BEGIN CERTIFICATE' -- "/etc/openvpn/server/keys/ca.crt")"
-	CLIENT_CERT="$(grep -A 999 'BEGIN CERTIFICATE' -- "/etc/openvpn/client/keys/$CLIENT_NAME.crt")"
-	CLIENT_KEY="$(cat -- "/etc/openvpn/client/keys/$CLIENT_NAME.key")"
-	if [[ ! "$CA_CERT" ]] || [[ ! "$CLIENT_CERT" ]] || [[ ! "$CLIENT_KEY" ]]; then
+	# CA, ключи клиента и все шесть профилей — за один запуск render.py
+	if ! python3 /root/render.py openvpn; then
 		echo "Can't load client keys!"
 		exit 11
 	fi
 
-	render "/etc/openvpn/client/templates/antizapret-udp.conf" > "/root/antizapret/client/openvpn/antizapret-udp/antizapret-$FILE_NAME-udp.ovpn"
-	render "/etc/openvpn/client/templates/antizapret-tcp.conf" > "/root/antizapret/client/openvpn/antizapret-tcp/antizapret-$FILE_NAME-tcp.ovpn"
-	render "/etc/openvpn/client/templates/antizapret.conf" > "/root/antizapret/client/openvpn/antizapret/$FILEVPN_NAME - ${FILE_NAME}.ovpn"
-	render "/etc/openvpn/client/templates/vpn-udp.conf" > "/root/antizapret/client/openvpn/vpn-udp/vpn-$FILE_NAME-udp.ovpn"
-	render "/etc/openvpn/client/templates/vpn-tcp.conf" > "/root/antizapret/client/openvpn/vpn-tcp/vpn-$FILE_NAME-tcp.ovpn"
-	render "/etc/openvpn/client/templates/vpn.conf" > "/root/antizapret/client/openvpn/vpn/$FILEVPN_NAME - Обычный VPN - ${FILE_NAME}.ovpn"
+	python3 /root/artifacts.py sync "$CLIENT_NAME"
 
 	echo "OpenVPN profile files (re)created for client '$CLIENT_NAME' at /root/antizapret/client/openvpn"
 }
@@ -151,12 +144,8 @@ deleteOpenVPN(){
 	cp ./pki/crl.pem /etc/openvpn/server/keys/crl.pem
 	chmod 644 /etc/openvpn/server/keys/crl.pem
 
-	rm -f //root/antizapret/client/openvpn/vpn/$FILEVPN_NAME - ${FILE_NAME}.ovpn
-	rm -f /root/antizapret/client/openvpn/antizapret-udp/antizapret-$FILE_NAME-udp.ovpn
-	rm -f /root/antizapret/client/openvpn/antizapret-tcp/antizapret-$FILE_NAME-tcp.ovpn
-	rm -f /root/antizapret/client/openvpn/vpn/$FILEVPN_NAME - Обычный VPN - ${FILE_NAME}.ovpn
-	rm -f /root/antizapret/client/openvpn/vpn-udp/vpn-$FILE_NAME-udp.ovpn
-	rm -f /root/antizapret/client/openvpn/vpn-tcp/vpn-$FILE_NAME-tcp.ovpn
+	# профили клиента — по реестру файлов (root/artifacts.py), с точными именами
+	python3 /root/artifacts.py remove "$CLIENT_NAME" openvpn
 	rm -f /etc/openvpn/client/keys/$CLIENT_NAME.crt
 	rm -f /etc/openvpn/client/keys/$CLIENT_NAME.key
 
@@ -180,6 +169,7 @@ initWireGuard(){
 PUBLIC_KEY=${PUBLIC_KEY}" > /etc/wireguard/key
 		render "/etc/wireguard/templates/antizapret.conf" > "/etc/wireguard/antizapret.conf"
 		render "/etc/wireguard/templates/vpn.conf" > "/etc/wireguard/vpn.conf"
+		python3 /root/wgpool.py rebuild >/dev/null
 	fi
 }
 
@@ -189,90 +179,49 @@ addWireGuard(){
 
 	source /etc/wireguard/key
 	IPS="$(cat /etc/wireguard/ips)"
-	CLIENT_BLOCK_ANTIZAPRET="$(sed -n "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/ {p; /^AllowedIPs/q}" /etc/wireguard/antizapret.conf)"
-	CLIENT_BLOCK_VPN="$(sed -n "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/ {p; /^AllowedIPs/q}" /etc/wireguard/vpn.conf)"
-
-	if [[ -n "$CLIENT_BLOCK_ANTIZAPRET" ]]; then
-		CLIENT_PRIVATE_KEY="$(echo "$CLIENT_BLOCK_ANTIZAPRET" | grep '# PrivateKey =' | cut -d '=' -f 2- | sed 's/ //g')"
-		CLIENT_PUBLIC_KEY="$(echo "$CLIENT_BLOCK_ANTIZAPRET" | grep 'PublicKey =' | cut -d '=' -f 2- | sed 's/ //g')"
-		CLIENT_PRESHARED_KEY="$(echo "$CLIENT_BLOCK_ANTIZAPRET" | grep 'PresharedKey =' | cut -d '=' -f 2- | sed 's/ //g')"
-		echo "Client with that name already exists! Please enter a different name"
-	elif [[ -n "$CLIENT_BLOCK_VPN" ]]; then
-		CLIENT_PRIVATE_KEY="$(echo "$CLIENT_BLOCK_VPN" | grep '# PrivateKey =' | cut -d '=' -f 2- | sed 's/ //g')"
-		CLIENT_PUBLIC_KEY="$(echo "$CLIENT_BLOCK_VPN" | grep 'PublicKey =' | cut -d '=' -f 2- | sed 's/ //g')"
-		CLIENT_PRESHARED_KEY="$(echo "$CLIENT_BLOCK_VPN" | grep 'PresharedKey =' | cut -d '=' -f 2- | sed 's/ //g')"
+	# серверные конфиги читает и пишет root/wgconf.py: блок клиента меняется на месте,
+	# одна атомарная запись под блокировкой вместо нескольких sed -i
+	if CLIENT_KEYS="$(python3 /root/wgconf.py get "$CLIENT_NAME")"; then
+		eval "$CLIENT_KEYS"
 		echo "Client with that name already exists! Please enter a different name"
 	else
 		CLIENT_PRIVATE_KEY="$(wg genkey)"
 		CLIENT_PUBLIC_KEY="$(echo "${CLIENT_PRIVATE_KEY}" | wg pubkey)"
 		CLIENT_PRESHARED_KEY="$(wg genpsk)"
 	fi
-
-	sed -i "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/d" /etc/wireguard/antizapret.conf
-	sed -i "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/d" /etc/wireguard/vpn.conf
-
-	sed -i '/^$/N;/^\n$/D' /etc/wireguard/antizapret.conf
-	sed -i '/^$/N;/^\n$/D' /etc/wireguard/vpn.conf
+	export CLIENT_PRIVATE_KEY CLIENT_PUBLIC_KEY CLIENT_PRESHARED_KEY
 
 	# AntiZapret
 
-	BASE_CLIENT_IP="$(grep "^Address" /etc/wireguard/antizapret.conf | sed 's/.*= *//' | cut -d'.' -f1-3 | head -n 1)"
-
-	for i in {2..255}; do
-		CLIENT_IP="${BASE_CLIENT_IP}.$i"
-		if ! grep -q "$CLIENT_IP" /etc/wireguard/antizapret.conf; then
-			break
-		fi
-		if [[ $i == 255 ]]; then
-			echo "The WireGuard/AmneziaWG subnet can support only 253 clients!"
-			exit 21
-		fi
-	done
+	# свободный адрес из битовой карты подсетей (root/wgpool.py), без перебора конфига
+	if ! CLIENT_IP="$(python3 /root/wgpool.py allocate antizapret "$CLIENT_NAME")"; then
+		echo "The WireGuard/AmneziaWG address pool is full! Add a subnet: python3 /root/wgpool.py extend antizapret <subnet>"
+		exit 21
+	fi
 
-	render "/etc/wireguard/templates/antizapret-client-wg.conf" > "/root/antizapret/client/wireguard/antizapret/$FILEVPN_NAME -$FILE_NAME.conf"
-	render "/etc/wireguard/templates/antizapret-client-am.conf" > "/root/antizapret/client/amneziawg/antizapret/$FILEVPN_NAME -$FILE_NAME.conf"
+	python3 /root/render.py wireguard antizapret
 
-	echo "# Client = ${CLIENT_NAME}
-# PrivateKey = ${CLIENT_PRIVATE_KEY}
-[Peer]
-PublicKey = ${CLIENT_PUBLIC_KEY}
-PresharedKey = ${CLIENT_PRESHARED_KEY}
-AllowedIPs = ${CLIENT_IP}/32
-" >> "/etc/wireguard/antizapret.conf"
+	python3 /root/wgconf.py add antizapret "$CLIENT_NAME" "${CLIENT_IP}/32"
 
-	if systemctl is-active --quiet wg-quick@antizapret; then
-		wg syncconf antizapret <(wg-quick strip antizapret 2>/dev/null)
-	fi
+	# peer сразу на интерфейс, полный syncconf — один раз после серии изменений (root/wgsync.py)
+	echo "${CLIENT_PRESHARED_KEY}" | python3 /root/wgsync.py add antizapret "${CLIENT_PUBLIC_KEY}" "${CLIENT_IP}/32"
 
 	# VPN
 
-	BASE_CLIENT_IP="$(grep "^Address" /etc/wireguard/vpn.conf | sed 's/.*= *//' | cut -d'.' -f1-3 | head -n 1)"
-
-	for i in {2..255}; do
-		CLIENT_IP="${BASE_CLIENT_IP}.$i"
-		if ! grep -q "$CLIENT_IP" /etc/wireguard/vpn.conf; then
-			break
-		fi
-		if [[ $i == 255 ]]; then
-			echo "The WireGuard/AmneziaWG subnet can support only 253 clients!"
-			exit 22
-		fi
-	done
+	# свободный адрес из битовой карты подсетей (root/wgpool.py), без перебора конфига
+	if ! CLIENT_IP="$(python3 /root/wgpool.py allocate vpn "$CLIENT_NAME")"; then
+		echo "The WireGuard/AmneziaWG address pool is full! Add a subnet: python3 /root/wgpool.py extend vpn <subnet>"
+		exit 22
+	fi
 
-	render "/etc/wireguard/templates/vpn-client-wg.conf" > "/root/antizapret/client/wireguard/vpn/$FILEVPN_NAME - Обычный VPN -$FILE_NAME.conf"
-	render "/etc/wireguard/templates/vpn-client-am.conf" > "/root/antizapret/client/amneziawg/vpn/$FILEVPN_NAME - Обычный VPN -$FILE_NAME.conf"
+	python3 /root/render.py wireguard vpn
 
-	echo "# Client = ${CLIENT_NAME}
-# PrivateKey = ${CLIENT_PRIVATE_KEY}
-[Peer]
-PublicKey = ${CLIENT_PUBLIC_KEY}
-PresharedKey = ${CLIENT_PRESHARED_KEY}
-AllowedIPs = ${CLIENT_IP}/32
-" >> "/etc/wireguard/vpn.conf"
+	python3 /root/wgconf.py add vpn "$CLIENT_NAME" "${CLIENT_IP}/32"
 
-	if systemctl is-active --quiet wg-quick@vpn; then
-		wg syncconf vpn <(wg-quick strip vpn 2>/dev/null)
-	fi
+	# peer сразу на интерфейс, полный syncconf — один раз после серии изменений (root/wgsync.py)
+	echo "${CLIENT_PRESHARED_KEY}" | python3 /root/wgsync.py add vpn "${CLIENT_PUBLIC_KEY}" "${CLIENT_IP}/32"
+
+	python3 /root/artifacts.py sync "$CLIENT_NAME"
 
 	echo "WireGuard/AmneziaWG profile files (re)created for client '$CLIENT_NAME' at /root/antizapret/client/wireguard and /root/antizapret/client/amneziawg"
 	echo ""
@@ -283,27 +232,21 @@ deleteWireGuard(){
 	setServerHost_FileName "$WIREGUARD_HOST"
 	echo ""
 
-	if ! grep -q "# Client = ${CLIENT_NAME}" "/etc/wireguard/antizapret.conf" && ! grep -q "# Client = ${CLIENT_NAME}" "/etc/wireguard/vpn.conf"; then
+	if ! python3 /root/wgconf.py get "$CLIENT_NAME" >/dev/null; then
 		echo "Failed to delete client '$CLIENT_NAME'! Please check if the client exists"
 		exit 23
 	fi
 
-	sed -i "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/d" /etc/wireguard/antizapret.conf
-	sed -i "/^# Client = ${CLIENT_NAME}\$/,/^AllowedIPs/d" /etc/wireguard/vpn.conf
+	# снять peer'ы с интерфейсов сразу, пока блоки клиента ещё в конфигах
+	python3 /root/wgsync.py remove "$CLIENT_NAME"
 
-	sed -i '/^$/N;/^\n$/D' /etc/wireguard/antizapret.conf
-	sed -i '/^$/N;/^\n$/D' /etc/wireguard/vpn.conf
+	python3 /root/wgconf.py remove "$CLIENT_NAME"
 
-	rm -f /root/antizapret/client/{wireguard,amneziawg}/antizapret/antizapret-$FILE_NAME-*.conf
-	rm -f /root/antizapret/client/{wireguard,amneziawg}/vpn/vpn-$FILE_NAME-*.conf
+	python3 /root/wgpool.py release "$CLIENT_NAME"
 
-	if systemctl is-active --quiet wg-quick@antizapret; then
-		wg syncconf antizapret <(wg-quick strip antizapret 2>/dev/null)
-	fi
+	python3 /root/artifacts.py remove "$CLIENT_NAME" wireguard
 
-	if systemctl is-active --quiet wg-quick@vpn; then
-		wg syncconf vpn <(wg-quick strip vpn 2>/dev/null)
-	fi
+	python3 /root/wgsync.py sync
 
 	echo "WireGuard/AmneziaWG client '$CLIENT_NAME' successfully deleted"
 }
@@ -318,19 +261,9 @@ listWireGuard(){
 recreate(){
 	echo ""
 
-	find /root/antizapret/client -type f -delete
-
 	# OpenVPN
 	if [[ -d "/etc/openvpn/easyrsa3/pki/issued" ]]; then
 		initOpenVPN
-		LC_ALL=C ls /etc/openvpn/easyrsa3/pki/issued | sed 's/\.crt$//' | grep -v "^antizapret-server$" | sort | while read -r CLIENT_NAME; do
-			if [[ "$CLIENT_NAME" =~ ^[a-zA-Z0-9_-]{1,32}$ ]]; then
-				addOpenVPN >/dev/null
-				echo "OpenVPN profile files recreated for client '$CLIENT_NAME'"
-			else
-				echo "OpenVPN client name '$CLIENT_NAME' is invalid! No profile files recreated"
-			fi
-		done
 	else
 		CLIENT_NAME="antizapret-client"
 		CLIENT_CERT_EXPIRE=3650
@@ -340,21 +273,18 @@ recreate(){
 	fi
 
 	# WireGuard/AmneziaWG
-	if [[ -f /etc/wireguard/key && -f /etc/wireguard/antizapret.conf && -f /etc/wireguard/vpn.conf ]]; then
-		LC_ALL=C cat /etc/wireguard/antizapret.conf /etc/wireguard/vpn.conf | grep -E "^# Client" | cut -d '=' -f 2 | sed 's/ //g' | sort -u | while read -r CLIENT_NAME; do
-			if [[ "$CLIENT_NAME" =~ ^[a-zA-Z0-9_-]{1,32}$ ]]; then
-				addWireGuard >/dev/null
-				echo "WireGuard/AmneziaWG profile files recreated for client '$CLIENT_NAME'"
-			else
-				echo "WireGuard/AmneziaWG client name '$CLIENT_NAME' is invalid! No profile files recreated"
-			fi
-		done
-	else
+	if [[ ! -f /etc/wireguard/key || ! -f /etc/wireguard/antizapret.conf || ! -f /etc/wireguard/vpn.conf ]]; then
 		CLIENT_NAME="antizapret-client"
 		echo "Creating WireGuard/AmneziaWG server keys and first WireGuard/AmneziaWG client: '$CLIENT_NAME'"
 		initWireGuard
 		addWireGuard >/dev/null
 	fi
+
+	# профили всех клиентов рендерятся параллельно во временный каталог, который затем
+	# атомарно подменяет /root/antizapret/client (root/recreate.py)
+	source /etc/wireguard/key
+	IPS="$(cat /etc/wireguard/ips)"
+	SERVER_IP="$SERVER_IP" OPENVPN_HOST="$OPENVPN_HOST" WIREGUARD_HOST="$WIREGUARD_HOST" python3 /root/recreate.py
 }
 	# Изменение срока действия
 	if [[ "$1" == "9" ]]; then
@@ -390,6 +320,21 @@ source /root/antizapret/setup
 umask 022
 setServerIP
 
+# название VPN в именах файлов профилей: install.sh подставляет его в этот файл,
+# иначе берётся из /root/.env; render.py, recreate.py и artifacts.py читают его из окружения
+FILEVPN_NAME="$FILEVPN_NAME"
+[[ -z "$FILEVPN_NAME" ]] && FILEVPN_NAME="$(sed -n 's/^FILEVPN_NAME=//p' /root/.env 2>/dev/null | tail -1)"
+if [[ -z "$FILEVPN_NAME" ]]; then
+	echo "FILEVPN_NAME is not set! Add it to /root/.env"
+	exit 2
+fi
+export FILEVPN_NAME
+
+# профили клиентов рендерит render.py: переменные шаблонов экспортируются заранее,
+# так что значения, присвоенные им ниже, попадают в его окружение
+RENDER_VARS="$(python3 /root/render.py vars)"
+[[ -n "$RENDER_VARS" ]] && export $RENDER_VARS
+
 OPTION=$1
 CLIENT_NAME=$2
 CLIENT_CERT_EXPIRE=$3
@@ -410,6 +355,13 @@ if ! [[ "$OPTION" =~ ^[1-8]$ ]]; then
 	done
 fi
 
+# опции, меняющие клиентов и их профили, — по одному client.sh за раз: профиль, созданный
+# во время пересоздания, не пропадёт при подмене каталога. Списки клиентов идут без блокировки
+if ! [[ "$OPTION" =~ ^[36]$ ]]; then
+	exec 9>/run/antizapret-client.lock
+	flock 9
+fi
+
 case "$OPTION" in
 	1)
 		echo "OpenVPN - Add client $CLIENT_NAME $CLIENT_CERT_EXPIRE"
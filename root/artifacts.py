@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import sqlite3
+
+from db import init_db, get_db, DEFAULT_DB_PATH
+from render import CLIENT_DIR, OPENVPN_PROFILES, WIREGUARD_PROFILES, substitute
+
+# Реестр файлов профилей: для каждого клиента в clients.artifacts — JSON
+#   {"openvpn/vpn-udp": "openvpn/vpn-udp/vpn-anna-udp.ovpn", "wireguard/vpn": ..., ...}
+# Вариант — каталог профиля (протокол/интерфейс[-транспорт]), путь — относительно
+# /root/antizapret/client. Выдача и удаление файлов — поиск по (клиент, вариант),
+# без обхода каталогов и без поиска подстроки в именах (anna не найдётся по ann).
+#
+# Реестр пишут: recreate.py (целиком, после подмены каталога), client.sh после
+# создания и удаления профилей (sync <клиент>) и бот при удалении файлов.
+# Фоновая сверка в боте (run_artifact_sweeper) сравнивает реестр с файлами на диске,
+# если их меняли в обход.
+#
+# Соединение с базой в боте одно на всех (db.py), транзакция держит его блокировку:
+# проверка и удаление файлов идут вне транзакции, а в ней — только короткая запись итога.
+# Из event loop функции этого модуля вызываются через asyncio.to_thread.
+#
+# Из client.sh:
+#   python3 /root/artifacts.py sync <клиент> ...   — реестр клиентов по файлам на диске
+#   python3 /root/artifacts.py remove <клиент> [openvpn|wireguard]
+
+SQL_ALL_ARTIFACTS = "SELECT common_name, artifacts FROM clients WHERE artifacts IS NOT NULL"
+ARTIFACT_COLUMNS = ("client_name", "common_name", "artifacts")
+SQL_CLEAR_ARTIFACTS = "UPDATE clients SET artifacts = NULL WHERE common_name = ?"
+SQL_CLEAR_ALL_ARTIFACTS = "UPDATE clients SET artifacts = NULL WHERE artifacts IS NOT NULL"
+
+# протокол -> первые части вариантов
+PROTOCOLS = {
+    "openvpn": ("openvpn",),
+    "wireguard": ("wireguard", "amneziawg"),
+}
+SWEEP_INTERVAL = 600
+
+
+def variant_of(path):
+    """"openvpn/vpn-udp/vpn-anna-udp.ovpn" -> "openvpn/vpn-udp"."""
+    return os.path.dirname(path)
+
+
+def _in_protocol(variant, protocol):
+    return protocol is None or variant.split("/", 1)[0] in PROTOCOLS[protocol]
+
+
+def expected_artifacts(client_name, filevpn_name):
+    """{вариант: путь} всех профилей, которые генератор создаёт для клиента."""
+    context = {"FILE_NAME": client_name, "FILEVPN_NAME": filevpn_name or ""}
+    paths = {}
+    for profiles in (OPENVPN_PROFILES, *WIREGUARD_PROFILES.values()):
+        for _, target in profiles:
+            path = substitute(target, context)
+            paths[variant_of(path)] = path
+    return paths
+
+
+def _decode(text):
+    try:
+        artifacts = json.loads(text) if text else {}
+    except ValueError:
+        return {}
+    return artifacts if isinstance(artifacts, dict) else {}
+
+
+def _save(db, mapping):
+    """Записывает реестр клиентов пачкой: mapping — {клиент: {вариант: путь}}, пустой — очистить."""
+    db.upsert_clients([
+        (name, name, json.dumps(artifacts, ensure_ascii=False, sort_keys=True))
+        for name, artifacts in mapping.items() if artifacts
+    ], ARTIFACT_COLUMNS, update=("artifacts",))
+    db.executemany(SQL_CLEAR_ARTIFACTS, [(name,) for name, artifacts in mapping.items() if not artifacts])
+
+
+def _select(db, client_names):
+    """{клиент: {вариант: путь}} для перечисленных клиентов."""
+    found = {row[3]: _decode(row[6]) for row in db.select_clients(common_names=client_names)}
+    return {name: found.get(name, {}) for name in client_names}
+
+
+def get_artifacts(client_name):
+    """{вариант: путь относительно CLIENT_DIR} клиента."""
+    return _select(get_db(), [client_name])[client_name]
+
+
+def artifact_path(client_name, *variants, client_dir=CLIENT_DIR):
+    """Абсолютный путь первого существующего файла из перечисленных вариантов или None."""
+    artifacts = get_artifacts(client_name)
+    for variant in variants:
+        path = artifacts.get(variant)
+        if path and os.path.isfile(os.path.join(client_dir, path)):
+            return os.path.join(client_dir, path)
+    return None
+
+
+def artifact_paths(client_name, variants=None, protocol=None, client_dir=CLIENT_DIR):
+    """Абсолютные пути существующих файлов клиента: перечисленных вариантов или всего протокола."""
+    paths = []
+    for variant, path in sorted(get_artifacts(client_name).items()):
+        if variants is not None and variant not in variants:
+            continue
+        if not _in_protocol(variant, protocol):
+            continue
+        path = os.path.join(client_dir, path)
+        if os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+
+def replace_artifacts(mapping):
+    """Реестр целиком, одной транзакцией: mapping — {клиент: [пути]}."""
+    db = get_db()
+    with db.transaction():
+        db.execute(SQL_CLEAR_ALL_ARTIFACTS)
+        _save(db, {name: {variant_of(path): path for path in paths} for name, paths in mapping.items()})
+
+
+def remove_artifacts(client_name, protocol=None, filevpn_name=None, client_dir=CLIENT_DIR):
+    """
+    Удаляет файлы клиента (все или одного протокола) и их записи в реестре.
+    С filevpn_name удаляются и файлы с ожидаемыми именами, которых в реестре нет.
+    Возвращает удалённые пути.
+    """
+    db = get_db()
+    paths = {path for variant, path in get_artifacts(client_name).items() if _in_protocol(variant, protocol)}
+    if filevpn_name is not None:
+        paths.update(
+            path for variant, path in expected_artifacts(client_name, filevpn_name).items()
+            if _in_protocol(variant, protocol)
+        )
+    deleted = []
+    for path in sorted(paths):
+        path = os.path.join(client_dir, path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        deleted.append(path)
+    with db.transaction():
+        artifacts = get_artifacts(client_name)
+        _save(db, {client_name: {v: p for v, p in artifacts.items() if not _in_protocol(v, protocol)}})
+    return deleted
+
+
+def sync_artifacts(client_names, filevpn_name, include_registered=False, client_dir=CLIENT_DIR):
+    """
+    Сверяет реестр с диском для перечисленных клиентов (и всех, кто уже есть в реестре,
+    если include_registered): записи без файлов удаляются, существующие файлы
+    с ожидаемыми именами добавляются. Возвращает число клиентов, чья запись изменилась.
+    """
+    db = get_db()
+    if include_registered:
+        current = {name: _decode(text) for name, text in db.fetch_all(SQL_ALL_ARTIFACTS)}
+    else:
+        current = _select(db, client_names)
+    changed = {}
+    for client_name in set(client_names) | set(current):
+        artifacts = {
+            variant: path for variant, path in current.get(client_name, {}).items()
+            if os.path.isfile(os.path.join(client_dir, path))
+        }
+        for variant, path in expected_artifacts(client_name, filevpn_name).items():
+            if os.path.isfile(os.path.join(client_dir, path)):
+                artifacts[variant] = path
+        if artifacts != current.get(client_name, {}):
+            changed[client_name] = artifacts
+    if not changed:
+        return 0
+    with db.transaction():
+        # записи, которые успели поменять, пока шла проверка файлов, не затираем
+        now = _select(db, list(changed))
+        changed = {name: a for name, a in changed.items() if now[name] == current.get(name, {})}
+        _save(db, changed)
+    return len(changed)
+
+
+async def run_artifact_sweeper(known_clients, filevpn_name, interval=SWEEP_INTERVAL):
+    """Периодическая сверка реестра с диском; known_clients() — имена всех клиентов."""
+    while True:
+        try:
+            changed = await asyncio.to_thread(lambda: sync_artifacts(known_clients(), filevpn_name, True))
+            if changed:
+                logging.info(f"Artifact registry: {changed} client(s) resynced with disk")
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Artifact sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def main(argv):
+    command, args = (argv[1], argv[2:]) if len(argv) > 1 else (None, [])
+    filevpn_name = os.environ.get("FILEVPN_NAME", "")
+    if command in ("sync", "remove") and not filevpn_name:
+        print("FILEVPN_NAME is not set!", file=sys.stderr)
+        return 2
+    if command == "sync" and args:
+        init_db(DEFAULT_DB_PATH)
+        sync_artifacts(args, filevpn_name)
+        return 0
+    if command == "remove" and len(args) in (1, 2) and (len(args) == 1 or args[1] in PROTOCOLS):
+        init_db(DEFAULT_DB_PATH)
+        remove_artifacts(args[0], args[1] if len(args) == 2 else None, filevpn_name)
+        return 0
+    print(f"Usage: {argv[0]} sync <client> ... | remove <client> [openvpn|wireguard]", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
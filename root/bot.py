@@ -8,6 +8,7 @@ import os
 import re
 import sys
 import asyncio
+import math
 import hashlib
 
 
@@ -19,7 +20,6 @@ from aiogram import types
 from asyncio import sleep
 from aiogram.filters import StateFilter
 from aiogram.exceptions import TelegramBadRequest
-import sqlite3
 import uuid
 from aiogram.fsm.state import State, StatesGroup
 
@@ -47,10 +47,29 @@ import socket
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from db import init_db, get_profile_name, save_profile_name
-
-DB_PATH = "vpn.db"
-init_db(DB_PATH)
+from db import (
+    init_db, get_profile_name, save_profile_name, get_user_id_by_name, delete_user,
+    get_ids_for_names, get_names_for_ids,
+)
+from state import StateStore, AuthCache, MenuTracker
+from certs import get_expiry_info
+from pki import PkiIndex
+from scheduler import ExpiryScheduler
+from revocation import RevocationQueue
+from ovpn_mgmt import ManagementPool, soft_restart
+from presence import Presence
+from traffic import TrafficCollector, get_usage, human_bytes
+from artifacts import artifact_path, artifact_paths, remove_artifacts, run_artifact_sweeper
+from wgconf import wg_index
+from wgstats import wg_telemetry
+from quota import QuotaEngine, PERIOD_MONTH, PERIOD_ROLLING, MAX_LIMIT_GB
+
+DB_PATH = "/root/vpn.db"
+db = init_db(DB_PATH)  # одно соединение (WAL) на весь процесс
+
+# Одобренные, заявки, пользователи, смайлы и меню — в памяти, с отложенной записью в vpn.db
+store = StateStore(db)
+auth_cache = AuthCache(store)
 
 cancel_markup = ReplyKeyboardMarkup(
     keyboard=[[KeyboardButton(text="❌ Отмена")]],
@@ -65,31 +84,9 @@ LAST_MENU_FILE = "last_menu.json"
 class SetEmojiState(StatesGroup):
     waiting_for_emoji = State()
     
-# для SQLite
-def save_profile_name(user_id, new_profile_name, db_path="/root/vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE id=?", (user_id,))
-    res = cur.fetchone()
-    if res:
-        cur.execute("UPDATE users SET profile_name=? WHERE id=?", (new_profile_name, user_id))
-    else:
-        cur.execute("INSERT INTO users (id, profile_name) VALUES (?, ?)", (user_id, new_profile_name))
-    conn.commit()
-    conn.close()
-
-
 def save_user_id(user_id):
     try:
-        user_id = str(user_id)
-        if not os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "w") as f:
-                f.write(f"{user_id}\n")
-        else:
-            with open(USERS_FILE, "r+") as f:
-                users = set(line.strip() for line in f)
-                if user_id not in users:
-                    f.write(f"{user_id}\n")
+        store.add_user(user_id)
     except Exception as e:
         print(f"[save_user_id] Ошибка при сохранении user_id: {e}")
 
@@ -102,6 +99,9 @@ PENDING_FILE = "pending_users.json"
 
 class AdminAnnounce(StatesGroup):
     waiting_for_text = State()
+
+class SetQuotaState(StatesGroup):
+    waiting_for_quota = State()
     
 async def safe_send_message(chat_id, text, **kwargs):
     print(f"[SAFE_SEND] chat_id={chat_id}, text={text[:50]}, kwargs={kwargs}")
@@ -113,69 +113,29 @@ async def safe_send_message(chat_id, text, **kwargs):
 
 
 def get_last_menu_ids(user_id):
-    if not os.path.exists(LAST_MENUS_FILE):
-        return []
-    try:
-        with open(LAST_MENUS_FILE, "r") as f:
-            data = json.load(f)
-        return data.get(str(user_id), [])
-    except Exception:
-        return []
+    return menus.get(user_id)
 
 async def delete_last_menus(user_id):
-    if not os.path.exists(LAST_MENUS_FILE):
-        return
-    with open(LAST_MENUS_FILE, "r") as f:
-        data = json.load(f)
-    ids = data.get(str(user_id), [])
+    ids = menus.pop(user_id)
     for mid in ids:
         try:
             await bot.delete_message(user_id, mid)
         except Exception:
             pass
-    data[str(user_id)] = []
-    with open(LAST_MENUS_FILE, "w") as f:
-        json.dump(data, f)
 
 def set_last_menu_id(user_id, msg_id):
-    data = {}
-    if os.path.exists(LAST_MENUS_FILE):
-        with open(LAST_MENUS_FILE, "r") as f:
-            data = json.load(f)
-    user_id = str(user_id)
-    data[user_id] = [msg_id]
-    with open(LAST_MENUS_FILE, "w") as f:
-        json.dump(data, f)
+    menus.track(user_id, msg_id)
 
    
 
 def add_pending(user_id, username, fullname):
-    pending = {}
-    if os.path.exists(PENDING_FILE):
-        with open(PENDING_FILE, "r") as f:
-            pending = json.load(f)
-    pending[str(user_id)] = {"username": username, "fullname": fullname}
-    with open(PENDING_FILE, "w") as f:
-        json.dump(pending, f)
+    store.add_pending(user_id, username, fullname)
 
 def remove_pending(user_id):
-    if not os.path.exists(PENDING_FILE):
-        return
-    with open(PENDING_FILE, "r") as f:
-        pending = json.load(f)
-    pending.pop(str(user_id), None)
-    with open(PENDING_FILE, "w") as f:
-        json.dump(pending, f)
+    store.remove_pending(user_id)
 
 def is_pending(user_id):
-    if not os.path.exists(PENDING_FILE):
-        return False
-    try:
-        with open(PENDING_FILE, "r") as f:
-            pending = json.load(f)
-    except Exception:
-        pending = {}
-    return str(user_id) in pending
+    return store.is_pending(user_id)
 
 
 load_dotenv()
@@ -195,6 +155,22 @@ ADMIN_ID = int(ADMIN_ID)
 EMOJI_FILE = "user_emojis.json"
 LAST_MENUS_FILE = "last_menus.json"
 MAX_MENUS_PER_USER = 3  # или сколько надо, обычно 3-5
+menus = MenuTracker(store, MAX_MENUS_PER_USER)  # id последних меню по чатам, в памяти
+pki_index = PkiIndex()  # сроки и статусы всех сертификатов из pki/index.txt
+openvpn_mgmt = ManagementPool()  # management-сокеты всех экземпляров OpenVPN
+presence = Presence(openvpn_mgmt)  # кто онлайн: опрос status 2, без I/O в обработчиках
+traffic_collector = TrafficCollector(presence)  # трафик OpenVPN и WireGuard → свёртки в vpn.db
+
+
+async def disconnect_openvpn_clients(common_names):
+    """Отключает сессии отозванных CN через management; недоступным экземплярам — SIGUSR1."""
+    killed, unreachable = await openvpn_mgmt.kill(common_names)
+    for instance in unreachable:
+        await asyncio.to_thread(soft_restart, instance)
+    return killed
+
+
+revocation_queue = RevocationQueue(disconnect=disconnect_openvpn_clients)  # отзыв пачками: один gen-crl на пачку
 
 # === Параметры 3x-UI для VLESS === 
 #Если хотите чтоб у вас появилась отдельная кнопка VLESS онлайн то раскомментируйте параметры (просто уберите знак"#". Предварительно должна быть установлена панель 3X-UI
@@ -323,34 +299,16 @@ async def set_user_emoji(message: types.Message, state: FSMContext):
     await state.clear()
 
 def is_approved_user(user_id):
-    user_id = str(user_id)
-    if not os.path.exists(APPROVED_FILE):
-        return False
-    with open(APPROVED_FILE, "r") as f:
-        approved = [line.strip() for line in f]
-    return user_id in approved
+    return store.is_approved(user_id)
 
 def approve_user(user_id):
-    user_id = str(user_id)
-    if not is_approved_user(user_id):
-        with open(APPROVED_FILE, "a") as f:
-            f.write(user_id + "\n")
+    store.approve(user_id)
 
 def set_user_emoji(user_id, emoji):
-    data = {}
-    if os.path.exists(EMOJI_FILE):
-        with open(EMOJI_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    data[str(user_id)] = emoji
-    with open(EMOJI_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False)
+    store.set_emoji(user_id, emoji)
 
 def get_user_emoji(user_id):
-    if not os.path.exists(EMOJI_FILE):
-        return ""
-    with open(EMOJI_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get(str(user_id), "")
+    return store.get_emoji(user_id)
 
 async def switch_menu(callback: types.CallbackQuery, text: str, reply_markup=None, parse_mode="HTML"):
     try:
@@ -371,10 +329,14 @@ async def set_bot_commands():
         await bot.set_my_commands(commands)
 
 
-@dp.callback_query(lambda c: c.from_user.id != ADMIN_ID
-                          and c.data != "send_request"
-                          and not is_approved_user(c.from_user.id)
-                          and not is_pending(c.from_user.id))
+def _is_unauthorized_callback(c: types.CallbackQuery) -> bool:
+    # Самый горячий путь: стоит перед каждой кнопкой, поэтому только O(1) кэш
+    return (c.from_user.id != ADMIN_ID
+            and c.data != "send_request"
+            and not auth_cache.is_allowed(c.from_user.id))
+
+
+@dp.callback_query(_is_unauthorized_callback)
 async def _deny_unapproved_callback(callback: types.CallbackQuery):
     await callback.answer(
         "❌ У вас нет доступа. Чтобы получить VPN, сначала отправьте заявку через /start.",
@@ -401,32 +363,18 @@ async def process_application_rename(callback: types.CallbackQuery, state: FSMCo
     await callback.answer()
 
 def remove_user_id(user_id):
-    """Удаляет строку с данным user_id из файла users.txt."""
-    if not os.path.exists(USERS_FILE):
-        return
+    """Убирает user_id из списка пользователей (бывший users.txt)."""
     try:
-        with open(USERS_FILE, "r") as f:
-            lines = [line.strip() for line in f if line.strip().isdigit()]
-        updated = [line for line in lines if line != str(user_id)]
-        with open(USERS_FILE, "w") as f:
-            for uid in updated:
-                f.write(f"{uid}\n")
+        store.remove_user(user_id)
     except Exception as e:
-        print(f"[remove_user_id] Не удалось обновить {USERS_FILE}: {e}")
+        print(f"[remove_user_id] Не удалось удалить {user_id}: {e}")
 
 def remove_approved_user(user_id):
-    """Удаляет строку с данным user_id из файла approved_users.txt."""
-    if not os.path.exists(APPROVED_FILE):
-        return
+    """Снимает одобрение с user_id (бывший approved_users.txt)."""
     try:
-        with open(APPROVED_FILE, "r") as f:
-            lines = [line.strip() for line in f]
-        updated = [line for line in lines if line != str(user_id)]
-        with open(APPROVED_FILE, "w") as f:
-            for uid in updated:
-                f.write(f"{uid}\n")
+        store.disapprove(user_id)
     except Exception as e:
-        print(f"[remove_approved_user] Не удалось обновить {APPROVED_FILE}: {e}")
+        print(f"[remove_approved_user] Не удалось удалить {user_id}: {e}")
 
 
 @dp.message(RenameProfile.waiting_for_rename_approve)
@@ -464,7 +412,7 @@ async def process_rename_new_name(message: types.Message, state: FSMContext):
 
     result = await execute_script("1", new_name, "30")
     if result["returncode"] == 0:
-        save_profile_name(user_id, new_name)
+        await save_profile_name(user_id, new_name)
         approve_user(user_id)
         remove_pending(user_id)
         save_user_id(user_id)  # ВАЖНО! — сразу в users.txt
@@ -823,29 +771,8 @@ async def show_pending_list(callback: types.CallbackQuery):
         await callback.answer("Нет прав!", show_alert=True)
         return
 
-    # Нет файла с заявками
-    if not os.path.exists(PENDING_FILE):
-        await callback.message.delete()
-        msg = await bot.send_message(callback.from_user.id, "Нет заявок.")
-        await asyncio.sleep(1)
-        try:
-            await bot.delete_message(callback.from_user.id, msg.message_id)
-        except Exception:
-            pass
-        # Показываем главное меню!
-        stats = get_server_info()
-        menu = await bot.send_message(
-            callback.from_user.id,
-            stats + "\n<b>Главное меню:</b>",
-            reply_markup=create_main_menu(),
-            parse_mode="HTML"
-        )
-        set_last_menu_id(callback.from_user.id, menu.message_id)
-        return
-
-    # Файл есть, но заявок нет
-    with open(PENDING_FILE) as f:
-        pending = json.load(f)
+    # Заявок нет
+    pending = dict(store.pending)
     if not pending:
         await callback.message.delete()
         msg = await bot.send_message(callback.from_user.id, "Нет заявок.")
@@ -1019,7 +946,7 @@ async def process_manual_client_name(message: types.Message, state: FSMContext):
         return
 
     # 5) Сохраняем (ID ↔ profile_name) в SQLite
-    save_profile_name(manual_user_id, client_name)
+    await save_profile_name(manual_user_id, client_name)
 
     # 6) Добавляем пользователя в approved_users.txt и users.txt
     approve_user(manual_user_id)
@@ -1092,9 +1019,12 @@ async def show_users_tab(chat_id: int, tab: str):
 
     # 2) строим множество онлайн-клиентов
     open_online = set(get_online_users_from_log().keys())
-    wg_online   = set(get_online_wg_peers().keys())
+    wg_online   = set((await get_online_wg_peers()).keys())
     online_all  = open_online | wg_online
 
+    # одним пакетным запросом: имя профиля -> Telegram-ID
+    ids_by_name = get_ids_for_names(all_clients)
+
     # 3) в зависимости от таба выбираем подмножество
     if tab == "users_tab_all":
         clients = all_clients
@@ -1104,21 +1034,26 @@ async def show_users_tab(chat_id: int, tab: str):
         header  = "🟢 <b>Сейчас онлайн:</b>"
     else:  # users_tab_expiring
         clients = []
+        if pki_index.available:
+            days_by_name = pki_index.expiring(7)
+        else:
+            days_by_name = {}
+            for c in all_clients:
+                info = get_cert_expiry_info(c) if ids_by_name.get(c) else None
+                if info and 0 <= info["days_left"] <= 7:
+                    days_by_name[c] = info["days_left"]
         for c in all_clients:
-            uid = get_user_id_by_name(c)
-            info = get_cert_expiry_info(c) if uid else None
-            if info and 0 <= info["days_left"] <= 7:
+            if ids_by_name.get(c) and c in days_by_name:
                 clients.append(c)
         header = "⏳ <b>Истекают (≤7д):</b>"
 
     # 2) строим список рядов кнопок
     rows = []
     for c in clients:
-        uid   = get_user_id_by_name(c)
+        uid   = ids_by_name.get(c)
         emoji = get_user_emoji(uid) if uid else ""
         if tab == "users_tab_expiring":
-            days   = get_cert_expiry_info(c)["days_left"]
-            status = f"⏳{days}д"
+            status = f"⏳{days_by_name[c]}д"
         else:
             status = "🟢" if c in online_all else "🔴"
         label = f"{emoji+' ' if emoji else ''}{status} {c}"
@@ -1461,14 +1396,121 @@ async def set_emoji_process(message: types.Message, state: FSMContext):
     )
     await state.clear()
 
+
+# ==== Админ: квота трафика ====
+@dp.callback_query(lambda c: c.data.startswith("set_quota_"))
+async def set_quota_start(callback: types.CallbackQuery, state: FSMContext):
+    client_name = callback.data[len("set_quota_"):]
+    user_id = callback.from_user.id
+    if user_id != ADMIN_ID:
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    await state.set_state(SetQuotaState.waiting_for_quota)
+    await state.update_data(client_name=client_name)
+
+    quota = quota_engine.get(client_name)
+    current = format_quota(quota) if quota else "не задана"
+    markup = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_set_quota")]
+        ]
+    )
+    msg = await bot.send_message(
+        user_id,
+        f"Квота <b>{client_name}</b>: {current}\n\n"
+        "Введи лимит в ГБ:\n"
+        "• <code>50</code> — на календарный месяц\n"
+        "• <code>50 7</code> — на скользящие 7 дней\n"
+        "• <code>0</code> — снять квоту",
+        reply_markup=markup,
+        parse_mode="HTML"
+    )
+    await state.update_data(input_message_id=msg.message_id)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data == "cancel_set_quota")
+async def cancel_set_quota(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    client_name = data.get("client_name")
+    try:
+        await callback.bot.delete_message(callback.from_user.id, data.get("input_message_id"))
+    except:
+        pass
+    await callback.answer("Отменено")
+    await state.clear()
+    await show_menu(
+        callback.from_user.id,
+        f"Меню пользователя <b>{client_name}</b>:",
+        create_user_menu(client_name, back_callback="users_menu", is_admin=True, user_id=get_user_id_by_name(client_name))
+    )
+
+
+@dp.message(SetQuotaState.waiting_for_quota)
+async def set_quota_process(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    client_name = data.get("client_name")
+
+    parts = (message.text or "").replace(",", ".").split()
+    try:
+        limit_gb = float(parts[0])
+        window_days = int(parts[1]) if len(parts) > 1 else None
+        # nan/inf и слишком большие лимиты не переводятся в байты или не помещаются в базу
+        if len(parts) > 2 or not math.isfinite(limit_gb) or not 0 <= limit_gb <= MAX_LIMIT_GB:
+            raise ValueError
+        if window_days is not None and not 1 <= window_days <= 365:
+            raise ValueError
+        limit_bytes = int(limit_gb * 1024 ** 3)
+    except (IndexError, ValueError):
+        warn_msg = await message.answer(
+            f"❌ Формат: <code>50</code> или <code>50 7</code> (ГБ от 0 до {MAX_LIMIT_GB}, дней от 1 до 365)",
+            parse_mode="HTML"
+        )
+        await asyncio.sleep(2)
+        await warn_msg.delete()
+        return
+
+    try:
+        await message.bot.delete_message(message.from_user.id, data.get("input_message_id"))
+    except:
+        pass
+    await state.clear()
+
+    if limit_bytes == 0:
+        await quota_engine.remove_quota(client_name)
+        text = "Квота снята."
+    else:
+        if window_days:
+            await quota_engine.set_quota(client_name, limit_bytes, PERIOD_ROLLING, window_days)
+        else:
+            await quota_engine.set_quota(client_name, limit_bytes, PERIOD_MONTH)
+        quota = quota_engine.get(client_name)
+        text = f"Квота: {format_quota(quota)}" if quota else "Квота установлена."
+
+    notif = await message.answer(text)
+    await asyncio.sleep(2)
+    try:
+        await notif.delete()
+    except:
+        pass
+
+    await show_menu(
+        message.from_user.id,
+        f"Меню пользователя <b>{client_name}</b>:",
+        create_user_menu(client_name, back_callback="users_menu", is_admin=True, user_id=get_user_id_by_name(client_name))
+    )
+
     
 # ==== Выдача WireGuard ====
 @dp.callback_query(lambda c: c.data.startswith("get_wg_"))
 async def send_wg_config(callback: types.CallbackQuery):
     client_name = callback.data[len("get_wg_"):]
     user_id = callback.from_user.id
-    await execute_script("4", client_name)
-    file_path = find_conf("/root/antizapret/client/wireguard", client_name)
+    # готовый профиль отдаётся как есть: client.sh (и ожидание идущего пересоздания) —
+    # только если файла ещё нет
+    file_path = await asyncio.to_thread(find_conf, "wireguard", client_name)
+    if not file_path:
+        await execute_script("4", client_name)
+        file_path = await asyncio.to_thread(find_conf, "wireguard", client_name)
     if not file_path:
         await callback.answer("❌ Файл WG не найден", show_alert=True)
         return
@@ -1480,29 +1522,13 @@ async def send_wg_config(callback: types.CallbackQuery):
     await callback.answer("✅ WireGuard-конфиг отправлен.")
 
     
-def find_conf(base_dir, client_name):
-    # Ищет во всех подпапках и по всем шаблонам
-    patterns = [
-        f"{base_dir}/*/*{client_name}*.conf",
-        f"{base_dir}/*{client_name}*.conf",
-    ]
-    for pattern in patterns:
-        files = glob.glob(pattern)
-        if files:
-            return files[0]
-    return None    
+def find_conf(kind, client_name):
+    # Профиль клиента из реестра файлов (wireguard/amneziawg): сначала AntiZapret, затем VPN
+    return artifact_path(client_name, f"{kind}/antizapret", f"{kind}/vpn")
 
 
 def find_wg_conf(client_name):
-    patterns = [
-        f"/root/antizapret/client/wireguard/*/*{client_name}*.conf",
-        f"/root/antizapret/client/wireguard/*{client_name}*.conf",
-    ]
-    for pattern in patterns:
-        files = glob.glob(pattern)
-        if files:
-            return files[0]
-    return None
+    return find_conf("wireguard", client_name)
 
    
 
@@ -1541,19 +1567,10 @@ async def manage_user(callback: types.CallbackQuery):
     await callback.answer()
 
 
-def get_user_id_by_name(profile_name):
-    conn = sqlite3.connect("/root/vpn.db")
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE profile_name=?", (profile_name,))
-    res = cur.fetchone()
-    conn.close()
-    return res[0] if res else None
-
-
-
 @dp.callback_query(lambda c: c.data == "7")
 async def recreate_files(callback: types.CallbackQuery, state: FSMContext):
-    result = await execute_script("7")
+    await callback.message.edit_text("⏳ Идет пересоздание файлов...")
+    result = await recreate_with_progress(callback.message)
     if result["returncode"] == 0:
         await callback.message.edit_text("✅ Файлы успешно пересозданы!")
         await asyncio.sleep(1)
@@ -1646,12 +1663,11 @@ async def process_announce_text(message: types.Message, state: FSMContext):
 
 
 async def announce_all(text):
-    if not os.path.exists(USERS_FILE):
+    users = sorted(store.users)
+    if not users:
         return 0, 0
 
     sent, failed = 0, 0
-    with open(USERS_FILE) as f:
-        users = [line.strip() for line in f if line.strip().isdigit()]
     for uid in users:
         try:
             await bot.send_message(uid, f"📢 <b>Объявление:</b>\n\n{text}", parse_mode="HTML")
@@ -1732,8 +1748,9 @@ async def confirm_delete_user(callback: types.CallbackQuery):
     # 1) Узнаём user_id по имени клиента
     target_user_id = get_user_id_by_name(client_name)
 
-    # 2) Выполняем удаление сертификата
-    result = await execute_script("2", client_name)
+    # 2) Отзываем сертификат и WireGuard-peer (через общую очередь отзыва)
+    revoked = await revocation_queue.revoke(client_name)
+    result = {"returncode": 0 if revoked["ok"] else 1, "stderr": revoked["error"] or ""}
 
     # 3) Убираем сообщение с подтверждением
     try:
@@ -1741,17 +1758,15 @@ async def confirm_delete_user(callback: types.CallbackQuery):
     except Exception:
         pass
 
-    # 4) Если скрипт удалил клиента без ошибок, чистим файлы с ID
+    # 4) Если клиент отозван без ошибок, чистим конфиги и файлы с ID
     if result["returncode"] == 0:
+        await cleanup_configs_for_client(client_name)
+        expiry_scheduler.reschedule()
         if target_user_id is not None:
             remove_approved_user(target_user_id)
             remove_user_id(target_user_id)
             # Опционально: удаляем профиль из БД
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            cur.execute("DELETE FROM users WHERE id=?", (target_user_id,))
-            conn.commit()
-            conn.close()
+            await delete_user(target_user_id)
 
         stats = get_server_info()
         await show_menu(
@@ -1772,20 +1787,10 @@ async def confirm_delete_user(callback: types.CallbackQuery):
 
 
 def get_cert_expiry_days(cert_path):
-    try:
-        result = subprocess.run(
-            ["openssl", "x509", "-in", cert_path, "-noout", "-enddate"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        if result.returncode != 0:
-            return 30  # fallback, если не нашли сертификат
-        not_after = result.stdout.strip().replace("notAfter=", "")
-        dt = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z').replace(tzinfo=timezone.utc)
-        days_left = (dt - datetime.now(timezone.utc)).days
-        return max(days_left, 1)
-    except Exception as e:
-        print(f"Ошибка чтения срока сертификата: {e}")
-        return 30  # fallback
+    info = get_expiry_info(cert_path)
+    if info is None:
+        return 30  # fallback, если не нашли сертификат
+    return max(info["days_left"], 1)
 
 def create_openvpn_menu():
     """Создает меню OpenVPN в виде InlineKeyboardMarkup."""
@@ -1868,9 +1873,11 @@ async def show_menu(user_id, text, reply_markup, parse_mode="HTML"):
 async def send_amnezia_config(callback: types.CallbackQuery):
     client_name = callback.data[len("get_amnezia_"):]
     user_id = callback.from_user.id
-    # Всегда создавать/пересоздавать перед выдачей!
-    await execute_script("4", client_name)
-    file_path = find_conf("/root/antizapret/client/amneziawg", client_name)
+    # Создаём профиль, только если его ещё нет — как в send_wg_config
+    file_path = await asyncio.to_thread(find_conf, "amneziawg", client_name)
+    if not file_path:
+        await execute_script("4", client_name)
+        file_path = await asyncio.to_thread(find_conf, "amneziawg", client_name)
     if not file_path:
         await callback.answer("❌ Файл Amnezia не найден", show_alert=True)
         return
@@ -2020,31 +2027,8 @@ def create_confirmation_keyboard(client_name, vpn_type):
     )
 
 def get_user_traffic(client_name):
-    log_files = [
-        "/etc/openvpn/server/logs/antizapret-tcp-status.log",
-        "/etc/openvpn/server/logs/antizapret-udp-status.log",
-        "/etc/openvpn/server/logs/vpn-tcp-status.log",
-        "/etc/openvpn/server/logs/vpn-udp-status.log",
-    ]
-    total_received = 0
-    total_sent = 0
-    for log_path in log_files:
-        try:
-            if os.path.exists(log_path):
-                with open(log_path) as f:
-                    for line in f:
-                        if line.startswith("CLIENT_LIST"):
-                            parts = line.strip().split(",")
-                            if len(parts) > 4 and parts[1] == client_name:
-                                # parts[3]: Bytes received
-                                # parts[4]: Bytes sent
-                                try:
-                                    total_received += int(parts[3])
-                                    total_sent += int(parts[4])
-                                except Exception:
-                                    continue
-        except Exception:
-            continue
+    # Счётчики текущих сессий клиента из таблицы presence (Bytes Received/Sent по HEADER)
+    total_received, total_sent = presence.traffic(client_name)
     # Переводим в Гб (1 Гб = 1024^3 байт)
     gb_received = total_received / (1024**3)
     gb_sent = total_sent / (1024**3)
@@ -2095,35 +2079,8 @@ async def renew_user_start(callback: types.CallbackQuery, state: FSMContext):
 from datetime import datetime, timezone
 
 def get_cert_expiry_info(client_name):
-    cert_path = f"/etc/openvpn/easyrsa3/pki/issued/{client_name}.crt"
-    try:
-        result = subprocess.run(
-            ["openssl", "x509", "-in", cert_path, "-noout", "-enddate"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        if result.returncode != 0:
-            return None
-        not_after = result.stdout.strip().replace("notAfter=", "")
-        date_to = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z').replace(tzinfo=timezone.utc)
-        now = datetime.now(timezone.utc)
-        days_left = (date_to - now).days
-
-        # Теперь узнаём дату выпуска (startdate)
-        result2 = subprocess.run(
-            ["openssl", "x509", "-in", cert_path, "-noout", "-startdate"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        not_before = result2.stdout.strip().replace("notBefore=", "")
-        date_from = datetime.strptime(not_before, '%b %d %H:%M:%S %Y %Z').replace(tzinfo=timezone.utc)
-
-        return {
-            "date_from": date_from,
-            "date_to": date_to,
-            "days_left": days_left
-        }
-    except Exception as e:
-        print(f"Ошибка чтения срока сертификата: {e}")
-        return None
+    # Сертификат разбирается в процессе (certs.py), результат кэшируется по mtime файла
+    return get_expiry_info(f"/etc/openvpn/easyrsa3/pki/issued/{client_name}.crt")
 
 
 @dp.message(VPNSetup.entering_days)
@@ -2280,6 +2237,12 @@ def create_user_menu(
                 callback_data=f"set_emoji_{client_name}"
             )
         ])
+        keyboard.append([
+            InlineKeyboardButton(
+                text="📶 Квота трафика",
+                callback_data=f"set_quota_{client_name}"
+            )
+        ])
         keyboard.append([
             InlineKeyboardButton(
                 text="✏️ Установить срок действия",
@@ -2352,14 +2315,7 @@ async def handle_new_username(message: types.Message, state: FSMContext):
         return
 
     # Получить user_id по старому имени
-    user_id = None
-    conn = sqlite3.connect("/root/vpn.db")
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE profile_name=?", (old_username,))
-    res = cur.fetchone()
-    if res:
-        user_id = res[0]
-    conn.close()
+    user_id = get_user_id_by_name(old_username)
     if not user_id:
         await message.answer("❌ Пользователь по старому имени не найден!")
         await state.clear()
@@ -2385,7 +2341,7 @@ async def handle_new_username(message: types.Message, state: FSMContext):
         return
 
     # Универсально обновляем имя в базе
-    save_profile_name(user_id, new_username)
+    await save_profile_name(user_id, new_username)
 
     await delete_last_menus(message.from_user.id)
     await show_menu(
@@ -2437,7 +2393,17 @@ async def user_stats(callback: types.CallbackQuery):
         )
     else:
         cert_block = "<b>Срок действия:</b> неизвестно\n"
-    text = cert_block
+
+    # Трафик из свёрток в vpn.db (↓ — скачано клиентом, ↑ — отдано)
+    usage = await get_usage(client_name)
+    traffic_lines = ["\n<b>Трафик:</b>"]
+    for label, key in (("Сегодня", "today"), ("За месяц", "month"), ("Всего", "total")):
+        rx, tx = usage[key]
+        traffic_lines.append(f"• {label}: ↓ {human_bytes(tx)} / ↑ {human_bytes(rx)}")
+    quota = quota_engine.get(client_name)
+    if quota:
+        traffic_lines.append(f"\n<b>Квота:</b> {format_quota(quota)}")
+    text = cert_block + "\n".join(traffic_lines) + "\n"
 
     # 1) Удаляем текущее сообщение (например, окно «Выберите тип» или старый stats-экран)
     await delete_last_menus(user_id)
@@ -2492,6 +2458,9 @@ async def execute_script(option: str, client_name: str = None, days: str = None)
             env=env,
         )
         stdout, stderr = await process.communicate()
+        if process.returncode == 0 and option in ("1", "2", "9"):
+            # выпуск/удаление/продление сертификата меняет сроки — пересобрать расписание
+            expiry_scheduler.reschedule()
         # Добавь эти строки для дебага!
         print("==[DEBUG EXEC]==")
         print("COMMAND:", command)
@@ -2512,6 +2481,50 @@ async def execute_script(option: str, client_name: str = None, days: str = None)
         }
 
 
+RECREATE_PROGRESS_RE = re.compile(r"^\[(\d+)/(\d+)\]")
+
+
+async def recreate_with_progress(message: types.Message, interval: float = 3.0):
+    """
+    client.sh 7 (пересоздание файлов) с прогрессом в message: recreate.py печатает
+    строки `[готово/всего] ...`, сообщение правится не чаще раза в interval секунд.
+    """
+    script_path = "/root/antizapret/client.sh"
+    if not os.path.exists(script_path):
+        return {"returncode": 1, "stdout": "", "stderr": f"❌ Файл {script_path} не найден!"}
+    env = os.environ.copy()
+    env["PATH"] = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+    try:
+        process = await asyncio.create_subprocess_exec(
+            script_path, "7",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        stderr_task = asyncio.create_task(process.stderr.read())
+        lines = []
+        edited_at = 0.0
+        async for raw in process.stdout:
+            line = raw.decode(errors="replace").rstrip()
+            lines.append(line)
+            match = RECREATE_PROGRESS_RE.match(line)
+            if match and time.monotonic() - edited_at >= interval:
+                edited_at = time.monotonic()
+                try:
+                    await message.edit_text(f"⏳ Пересоздание файлов: {match[1]} из {match[2]}")
+                except Exception:
+                    pass
+        stderr = await stderr_task
+        await process.wait()
+    except Exception as e:
+        return {"returncode": 1, "stdout": "", "stderr": f"❌ Ошибка при выполнении скрипта: {str(e)}"}
+    return {
+        "returncode": process.returncode,
+        "stdout": "\n".join(lines).strip(),
+        "stderr": stderr.decode(errors="replace").strip(),
+    }
+
+
 async def send_single_config(chat_id: int, path: str, caption: str):
     if os.path.exists(path):
         await bot.send_document(
@@ -2524,78 +2537,22 @@ async def send_single_config(chat_id: int, path: str, caption: str):
 #Кто онлайн
 def get_online_users_from_log():
     """
-    Собирает CLIENT_LIST из всех четырёх status-файлов OpenVPN
-    и возвращает всех реально подключённых клиентов.
+    Все реально подключённые клиенты OpenVPN: {client_name: "OpenVPN"}.
+    Берётся из живой таблицы сессий (presence.py) — без чтения файлов.
     """
-    status_files = [
-        "/etc/openvpn/server/logs/antizapret-tcp-status.log",
-        "/etc/openvpn/server/logs/antizapret-udp-status.log",
-        "/etc/openvpn/server/logs/vpn-tcp-status.log",
-        "/etc/openvpn/server/logs/vpn-udp-status.log",
-    ]
-    users = {}  # client_name -> "OpenVPN"
+    return presence.online()
 
-    for path in status_files:
-        if not os.path.exists(path):
-            continue
-        with open(path) as f:
-            for line in f:
-                # CLIENT_LIST — это все живые сессии в момент снимка
-                if not line.startswith("CLIENT_LIST,"):
-                    continue
-                parts = line.strip().split(",")
-                if len(parts) >= 2 and parts[1]:
-                    users[parts[1]] = "OpenVPN"
-
-    return users
-
-def get_online_wg_peers():
+async def get_online_wg_peers():
     """
     Возвращает всех реально подключённых WireGuard/Amnezia-клиентов:
-    берём только те строки wg show all latest-handshakes, где
-    ts != 0, и сопоставляем pubkey→client по .conf-файлам.
+    peer'ы из общего снимка `wg show all dump`, чьё последнее рукопожатие
+    не старше окна онлайна, с именами по индексу серверных конфигов.
     """
-    peers = {}
     try:
-        out = subprocess.run(
-            ["wg", "show", "all", "latest-handshakes"],
-            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
-        ).stdout
-        for line in out.splitlines():
-            parts = line.split()
-            # пропускаем всё, что не “<pubkey> <timestamp>”
-            if len(parts) != 2:
-                continue
-            pubkey, ts = parts
-            if ts == "0":
-                continue
-
-            # ищем, в каком .conf встречается этот pubkey
-            for base_dir, label in [
-                ("/root/antizapret/client/amneziawg", "Amnezia"),
-                ("/root/antizapret/client/wireguard", "WG")
-            ]:
-                found = False
-                for root, _, files in os.walk(base_dir):
-                    for fn in files:
-                        if not fn.endswith(".conf"):
-                            continue
-                        try:
-                            with open(os.path.join(root, fn), encoding="utf-8", errors="ignore") as cf:
-                                if pubkey in cf.read():
-                                    client = fn.rsplit("-", 1)[-1].rsplit(".", 1)[0]
-                                    peers[client] = label
-                                    found = True
-                                    break
-                        except Exception:
-                            pass
-                    if found:
-                        break
-                if found:
-                    break
+        return await wg_telemetry.online()
     except Exception as e:
         print(f"[ERROR] wg show: {e}")
-    return peers
+        return {}
 
 @dp.callback_query(lambda c: c.data == "who_online")
 async def who_online(callback: types.CallbackQuery):
@@ -2603,7 +2560,7 @@ async def who_online(callback: types.CallbackQuery):
 
     # Получаем OpenVPN и WG/Amnezia
     openvpn_map = get_online_users_from_log()  # {client_name: "OpenVPN"}
-    wg_map      = get_online_wg_peers()       # {client_name: "WG" или "Amnezia"}
+    wg_map      = await get_online_wg_peers()       # {client_name: "WG"}
 
     # Объединяем OpenVPN и WG-клиентов
     merged = dict(openvpn_map)
@@ -2645,9 +2602,10 @@ async def who_online(callback: types.CallbackQuery):
     # Строим новое с кнопками и смайликами пользователей
     buttons = []
     text_lines = ["🟢 <b>Кто в сети:</b>"]
+    # Telegram-ID всех онлайн-профилей одним пакетным запросом
+    ids_by_name = get_ids_for_names(merged.keys())
     for client in merged.keys():
-        # Получаем Telegram-ID пользователя по имени профиля
-        uid = get_user_id_by_name(client)
+        uid = ids_by_name.get(client)
         # Подтягиваем смайлик (или пустую строку, если не задан)
         emoji = get_user_emoji(uid) if uid else ""
         # Склеиваем метку кнопки
@@ -2703,14 +2661,7 @@ async def manage_online_user(callback: types.CallbackQuery):
 @dp.message(Command("start"))
 async def start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    await delete_last_menus(user_id)  # ← в самом начале
-
-    # Удаляем ВСЕ последние свои меню (N штук)
-    for mid in get_last_menu_ids(user_id):
-        try:
-            await bot.delete_message(user_id, mid)
-        except Exception:
-            pass
+    await delete_last_menus(user_id)  # ← в самом начале: удаляет ВСЕ последние свои меню (N штук)
 
     # Дальше как обычно:
     if user_id == ADMIN_ID:
@@ -3042,20 +2993,9 @@ async def handle_protocol_selection(callback: types.CallbackQuery, state: FSMCon
 
     if callback.data.startswith("send_ovpn_"):
         _, _, interface, proto, _ = callback.data.split("_", 4)
-        name_core = client_name.replace("antizapret-", "").replace("vpn-", "")
 
-        if proto == "default":
-            dir_path = f"/root/antizapret/client/openvpn/{interface}/"
-        else:
-            dir_path = f"/root/antizapret/client/openvpn/{interface}-{proto}/"
-
-        matched_file = None
-        if os.path.exists(dir_path):
-            for file in os.listdir(dir_path):
-                # Исправлено: ищем по вхождению name_core, не по паттерну!
-                if name_core in file and file.endswith(".ovpn"):
-                    matched_file = os.path.join(dir_path, file)
-                    break
+        variant = f"openvpn/{interface}" if proto == "default" else f"openvpn/{interface}-{proto}"
+        matched_file = await asyncio.to_thread(artifact_path, client_name, variant)
 
         if matched_file and await send_single_config(
             callback.from_user.id, matched_file, os.path.basename(matched_file)
@@ -3086,15 +3026,9 @@ async def handle_wg_type_selection(callback: types.CallbackQuery, state: FSMCont
         _, _, interface, wg_type, _ = callback.data.split("_", 4)
 
         name_core = client_name.replace("antizapret-", "").replace("vpn-", "")
-        dir_path = f"/root/antizapret/client/{'wireguard' if wg_type == 'wg' else 'amneziawg'}/{interface}/"
-
-        matched_file = None
-        if os.path.exists(dir_path):
-            for file in os.listdir(dir_path):
-                # Исправлено: ищем по вхождению name_core и типу wg/am, не по паттерну!
-                if name_core in file and wg_type in file and file.endswith(".conf"):
-                    matched_file = os.path.join(dir_path, file)
-                    break
+        matched_file = await asyncio.to_thread(
+            artifact_path, client_name, f"{'wireguard' if wg_type == 'wg' else 'amneziawg'}/{interface}"
+        )
 
         if not matched_file:
             await callback.answer("❌ Файл конфигурации не найден", show_alert=True)
@@ -3232,39 +3166,56 @@ async def announce_command(message: types.Message):
     await bot.send_message(message.chat.id, f"✅ Отправлено: {sent}, не доставлено: {failed}")
 
 
+@dp.message(Command("revoke"))
+async def revoke_command(message: types.Message):
+    """/revoke имя1 имя2 ... — отозвать несколько клиентов одной пачкой."""
+    if message.from_user.id != ADMIN_ID:
+        await bot.send_message(message.chat.id, "⛔ Нет доступа!")
+        return
 
-async def cleanup_openvpn_files(client_name: str):
-    """Дополнительная очистка файлов OpenVPN после основного скрипта"""
-    # Получаем имя файла без префиксов
-    clean_name = client_name.replace("antizapret-", "").replace("vpn-", "")
-
-    # Директории для проверки
-    dirs_to_check = [
-        "/root/antizapret/client/openvpn/antizapret/",
-        "/root/antizapret/client/openvpn/antizapret-tcp/",
-        "/root/antizapret/client/openvpn/antizapret-udp/",
-        "/root/antizapret/client/openvpn/vpn/",
-        "/root/antizapret/client/openvpn/vpn-tcp/",
-        "/root/antizapret/client/openvpn/vpn-udp/",
-    ]
+    names = [n for n in message.text.split()[1:] if re.match(r"^[a-zA-Z0-9_-]{1,32}$", n)]
+    if not names:
+        await bot.send_message(message.chat.id, "Перечисли имена клиентов через пробел после /revoke!")
+        return
 
-    deleted_files = []
+    progress = await bot.send_message(message.chat.id, f"⏳ Отзываю {len(names)} клиент(ов)...")
+    results = await revocation_queue.revoke_many(names)
+    expiry_scheduler.reschedule()
 
-    for dir_path in dirs_to_check:
-        if not os.path.exists(dir_path):
+    lines = []
+    for name in names:
+        result = results[name]
+        if not result["ok"]:
+            lines.append(f"❌ <code>{name}</code>: {result['error']}")
             continue
+        lines.append(f"✅ <code>{name}</code>")
+        user_id_int = get_user_id_by_name(name)
+        if user_id_int:
+            await finish_revocation(
+                name, user_id_int,
+                "⛔ Доступ к VPN отозван администратором.\n\n"
+                "Чтобы получить доступ снова, отправьте новую заявку:"
+            )
+        else:
+            await cleanup_configs_for_client(name)
+
+    ok = sum(1 for r in results.values() if r["ok"])
+    try:
+        await progress.delete()
+    except Exception:
+        pass
+    await bot.send_message(
+        message.chat.id,
+        f"<b>Отзыв: {ok} из {len(names)}</b>\n" + "\n".join(lines),
+        parse_mode="HTML"
+    )
 
-        for filename in os.listdir(dir_path):
-            # Удаляем все файлы, содержащие имя клиента
-            if clean_name in filename:
-                try:
-                    file_path = os.path.join(dir_path, filename)
-                    os.remove(file_path)
-                    deleted_files.append(file_path)
-                except Exception as e:
-                    print(f"Ошибка удаления {file_path}: {e}")
 
-    return deleted_files
+
+async def cleanup_openvpn_files(client_name: str):
+    """Дополнительная очистка файлов OpenVPN после основного скрипта"""
+    # Файлы клиента — по реестру и точным именам, без поиска подстроки (ann ≠ anna)
+    return await asyncio.to_thread(remove_artifacts, client_name, "openvpn", FILEVPN_NAME)
 
 @dp.callback_query(lambda c: c.data.startswith("select_openvpn_"))
 async def select_openvpn_config(callback: types.CallbackQuery):
@@ -3403,7 +3354,7 @@ async def handle_client_name(message: types.Message, state: FSMContext):
         user_id = data["approve_user_id"]
         result = await execute_script("1", client_name, "30")
         if result["returncode"] == 0:
-            save_profile_name(user_id, client_name)
+            await save_profile_name(user_id, client_name)
             remove_pending(user_id)
             await safe_send_message(
                 user_id,
@@ -3468,6 +3419,10 @@ async def handle_delete_client(message: types.Message, state: FSMContext):
 
 
 async def get_clients(vpn_type: str):
+    if vpn_type == "openvpn" and pki_index.available:
+        # Действующие сертификаты из pki/index.txt — без запуска client.sh и `ls pki/issued`
+        return pki_index.valid()
+
     option = "3" if vpn_type == "openvpn" else "6"
     result = await execute_script(option)
 
@@ -3492,31 +3447,21 @@ async def get_clients(vpn_type: str):
     return []
 
 
+SEND_CONFIG_VARIANTS = {
+    "1": ("openvpn/antizapret-udp", "openvpn/antizapret-tcp", "openvpn/vpn-udp", "openvpn/vpn-tcp"),
+    "4": ("amneziawg/antizapret", "amneziawg/vpn"),
+}
+
+
 async def send_config(chat_id: int, client_name: str, option: str) -> bool:
     try:
-        files_found = []
-        # Для WireGuard/AmneziaWG
+        # Файлы клиента — из реестра (artifacts.py)
         if option == "4":
-            base_dir = "/root/antizapret/client/amneziawg/"
-            ext = ".conf"
-            prefix = f"amneziawg-{client_name}-"
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    if file.startswith(prefix) and file.endswith(ext):
-                        files_found.append(os.path.join(root, file))
-        # Для OpenVPN — ищем по обоим вариантам
+            # WireGuard/AmneziaWG
+            files_found = await asyncio.to_thread(artifact_paths, client_name, SEND_CONFIG_VARIANTS["4"])
         else:
-            base_dir = "/root/antizapret/client/openvpn/"
-            ext = ".ovpn"
-            prefix_vpn = f"vpn-{client_name}-"
-            prefix_antizapret = f"antizapret-{client_name}-"
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    if (
-                        (file.startswith(prefix_vpn) or file.startswith(prefix_antizapret))
-                        and file.endswith(ext)
-                    ):
-                        files_found.append(os.path.join(root, file))
+            # OpenVPN — udp/tcp для AntiZapret и VPN
+            files_found = await asyncio.to_thread(artifact_paths, client_name, SEND_CONFIG_VARIANTS["1"])
 
         for file_path in files_found:
             await bot.send_document(
@@ -3681,7 +3626,7 @@ async def handle_callback_query(callback: types.CallbackQuery, state: FSMContext
         # Пересоздание файлов
         if data == "7":
             await callback.message.edit_text("⏳ Идет пересоздание файлов...")
-            result = await execute_script("7")
+            result = await recreate_with_progress(callback.message)
             if result["returncode"] == 0:
                 await callback.message.edit_text("✅ Файлы успешно пересозданы!")
                 await callback.message.answer("Главное меню:", reply_markup=create_main_menu())
@@ -3745,7 +3690,7 @@ async def process_application(callback: types.CallbackQuery, state: FSMContext):
 
         result = await execute_script("1", client_name, "30")
         if result["returncode"] == 0:
-            save_profile_name(user_id, client_name)
+            await save_profile_name(user_id, client_name)
             approve_user(user_id)
             remove_pending(user_id)
             save_user_id(user_id)
@@ -3797,182 +3742,256 @@ async def process_application(callback: types.CallbackQuery, state: FSMContext):
 
 
 
-async def notify_expiring_users():
-    while True:
+def current_cert_expiry():
+    """{CN: notAfter} для планировщика: из pki/index.txt, а без него — по .crt одобренных пользователей."""
+    if pki_index.available:
+        pki_index.refresh(force=True)  # сразу после client.sh, не дожидаясь check_interval
+        return pki_index.expiry_dates()
+    approved = list(store.approved)  # снимок: вызывается из потока, а множество меняет цикл событий
+    names_by_id = get_names_for_ids(sorted(approved))
+    expiry = {}
+    for client_name in names_by_id.values():
+        info = get_cert_expiry_info(client_name) if client_name else None
+        if info:
+            expiry[client_name] = info["date_to"]
+    return expiry
+
+
+async def notify_expiring_user(client_name: str, days_left: int) -> bool:
+    """Напоминание за days_left дней: пользователю и администратору."""
+    user_id_int = get_user_id_by_name(client_name)
+    if not user_id_int or not is_approved_user(user_id_int):
+        return False
+    # 1) отправляем пользователю
+    try:
+        await bot.send_message(
+            user_id_int,
+            f"⚠️ Осталось {days_left} дн. до окончания VPN-сертификата.",
+            parse_mode="HTML"
+        )
+    except:
+        pass
+    # 2) администратору
+    try:
+        await bot.send_message(
+            ADMIN_ID,
+            f"⚠️ Пользователю <code>{user_id_int}</code> ({client_name}) осталось {days_left} дн.",
+            parse_mode="HTML"
+        )
+    except:
+        pass
+    return True
+
+
+async def revoke_expired_user(client_name: str) -> bool:
+    """Срок сертификата вышел — отзываем (только у одобренных пользователей бота). False — повторить позже."""
+    user_id_int = get_user_id_by_name(client_name)
+    if user_id_int and is_approved_user(user_id_int):
+        return await revoke_and_cleanup(client_name, user_id_int)
+    return True
+
+
+# Напоминания за 5..1 день и отзыв ровно в notAfter; состояние напоминаний — в vpn.db
+expiry_scheduler = ExpiryScheduler(current_cert_expiry, notify_expiring_user, revoke_expired_user)
+
+
+def format_quota(quota: dict) -> str:
+    """«12.3 ГБ из 50.0 ГБ за месяц (24%)» по словарю QuotaEngine.get()."""
+    if quota["period"] == PERIOD_ROLLING:
+        period = f"за {quota['window_days']} дн."
+    else:
+        period = "за месяц"
+    percent = quota["used"] * 100 // quota["limit"] if quota["limit"] else 100
+    text = f"{human_bytes(quota['used'])} из {human_bytes(quota['limit'])} {period} ({percent}%)"
+    if quota["suspended"]:
+        text += " — доступ приостановлен"
+    return text
+
+
+async def warn_quota_user(client_name: str, used: int, limit: int) -> bool:
+    """Израсходовано 80% квоты: предупреждаем пользователя и администратора."""
+    user_id_int = get_user_id_by_name(client_name)
+    if user_id_int:
         try:
-            if not os.path.exists(APPROVED_FILE):
-                await asyncio.sleep(12 * 3600)
-                continue
-
-            with open(APPROVED_FILE, "r") as f:
-                approved_users = [line.strip() for line in f if line.strip().isdigit()]
-
-            for user_id in approved_users:
-                user_id_int = int(user_id)
-                client_name = get_profile_name(user_id_int)
-                if not client_name:
-                    continue
-
-                cert_info = get_cert_expiry_info(client_name)
-                if not cert_info:
-                    continue
-
-                days_left = cert_info["days_left"]
-                # флаг для конкретного дня, чтобы не спамить
-                flag_file = f".notified_{user_id}_{days_left}.flag"
-
-                # Напоминания за 5,4,3,2,1 день
-                if 1 <= days_left <= 5:
-                    if not os.path.exists(flag_file):
-                        # 1) отправляем пользователю
-                        try:
-                            await bot.send_message(
-                                user_id_int,
-                                f"⚠️ Осталось {days_left} дн. до окончания VPN-сертификата.",
-                                parse_mode="HTML"
-                            )
-                        except:
-                            pass
-                        # 2) администратору
-                        try:
-                            await bot.send_message(
-                                ADMIN_ID,
-                                f"⚠️ Пользователю <code>{user_id_int}</code> ({client_name}) осталось {days_left} дн.",
-                                parse_mode="HTML"
-                            )
-                        except:
-                            pass
-                        # 3) флаг, чтобы не повторять за этот день
-                        with open(flag_file, "w") as f_flag:
-                            f_flag.write("notified")
-
-                # После истечения срока
-                elif days_left < 0:
-                    await revoke_and_cleanup(client_name, user_id_int)
-
-                # Если более 5 дней — сбросить все флаги
-                elif days_left > 5:
-                    for fn in os.listdir():
-                        if fn.startswith(f".notified_{user_id}_") and fn.endswith(".flag"):
-                            try:
-                                os.remove(fn)
-                            except:
-                                pass
+            await bot.send_message(
+                user_id_int,
+                f"⚠️ Израсходовано {human_bytes(used)} из {human_bytes(limit)} трафика.\n"
+                f"При исчерпании квоты доступ к VPN будет приостановлен.",
+                parse_mode="HTML"
+            )
+        except:
+            pass
+    try:
+        await bot.send_message(
+            ADMIN_ID,
+            f"⚠️ <code>{client_name}</code> израсходовал {human_bytes(used)} из {human_bytes(limit)} квоты.",
+            parse_mode="HTML"
+        )
+    except:
+        pass
+    return True
+
+
+async def suspend_quota_user(client_name: str, used: int, limit: int) -> bool:
+    """Квота исчерпана: отзываем OpenVPN и WireGuard тем же путём, что и по истечении срока."""
+    result = await revocation_queue.revoke(client_name)
+    if not result["ok"]:
+        try:
+            await bot.send_message(
+                ADMIN_ID,
+                f"❌ Не удалось приостановить <code>{client_name}</code> по квоте: {result['error']}",
+                parse_mode="HTML"
+            )
+        except:
+            pass
+        return False
+    expiry_scheduler.reschedule()
+
+    admin_text = (
+        f"⛔ <code>{client_name}</code> исчерпал квоту трафика "
+        f"({human_bytes(used)} из {human_bytes(limit)}), доступ снят."
+    )
+    user_id_int = get_user_id_by_name(client_name)
+    if user_id_int:
+        await finish_revocation(
+            client_name, user_id_int,
+            f"⛔ Квота трафика исчерпана ({human_bytes(used)} из {human_bytes(limit)}).\n\n"
+            "Доступ к VPN приостановлен. Для восстановления отправьте новую заявку:",
+            admin_text
+        )
+    else:
+        await cleanup_configs_for_client(client_name)
+        try:
+            await bot.send_message(ADMIN_ID, admin_text, parse_mode="HTML")
+        except:
+            pass
+    return True
+
+
+# Квоты трафика: проверяются по приращениям каждого снимка traffic_collector
+quota_engine = QuotaEngine(warn_quota_user, suspend_quota_user)
+traffic_collector.listeners.append(quota_engine.on_traffic)
 
-        except Exception as e:
-            print(f"[notify_expiring_users] Ошибка: {e}")
 
-        await asyncio.sleep(12 * 3600)
+def known_profile_clients():
+    """Все клиенты, у которых могут быть файлы профилей: сертификаты OpenVPN и peer'ы WireGuard."""
+    wg_index.refresh()
+    return set(pki_index.valid()) | set(wg_index.by_client)
 
 
-async def revoke_and_cleanup(client_name: str, user_id_int: int):
+def remove_legacy_notify_flags():
+    # раньше отправленные напоминания отмечались файлами .notified_<id>_<дни>.flag
+    for fn in glob.glob(".notified_*.flag"):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
+
+
+async def revoke_and_cleanup(client_name: str, user_id_int: int) -> bool:
     """
-    Отзывает сертификат client_name, обновляет CRL,
-    обновляет OpenVPN, удаляет WireGuard-peer,
+    Отзывает сертификат client_name и WireGuard-peer (через общую очередь:
+    истёкшие одновременно клиенты отзываются одной пачкой с одним CRL),
     чистит конфиги, переводит пользователя в pending
-    и уведомляет его и администратора.
+    и уведомляет его и администратора. False, если отозвать не удалось.
     """
-    # 1) revoke + gen-crl через Easy-RSA
-    easyrsa = "/etc/openvpn/easyrsa3/easyrsa"
-    subprocess.run([easyrsa, "--batch", "revoke", client_name], check=True)
-    subprocess.run([easyrsa, "gen-crl"],                    check=True)
-
-    # 2) скопировать новый CRL в место, где его ждёт OpenVPN
-    src_crl = "/etc/openvpn/easyrsa3/pki/crl.pem"
-    dst_crl = "/etc/openvpn/server/keys/crl.pem"
-    shutil.copy(src_crl, dst_crl)
-    os.chmod(dst_crl, 0o644)
+    result = await revocation_queue.revoke(client_name)
+    if not result["ok"]:
+        try:
+            await bot.send_message(
+                ADMIN_ID,
+                f"❌ Не удалось отозвать <code>{client_name}</code>: {result['error']}",
+                parse_mode="HTML"
+            )
+        except:
+            pass
+        return False
 
-    # 3) мягко перечитать CRL – SIGUSR1 всем openvpn-процессам
-    subprocess.run(["pkill", "-USR1", "openvpn"], check=True)
+    await finish_revocation(
+        client_name, user_id_int,
+        "⛔ Срок действия вашего VPN-сертификата истёк.\n\n"
+        "Для восстановления доступа отправьте новую заявку:",
+        f"⚠️ Доступ пользователя <code>{user_id_int}</code> ({client_name}) снят по истечении срока."
+    )
+    return True
 
-    # 4) удалить WireGuard-peer
-    pubkey = get_pubkey_for_client(client_name)
-    if pubkey:
-        subprocess.run(["wg", "set", "wg0", "peer", pubkey, "remove"], check=True)
 
-    # 5) очистить все клиентские конфиги (OpenVPN, WireGuard, VLESS)
-    cleanup_configs_for_client(client_name)
+async def finish_revocation(client_name: str, user_id_int: int, user_text: str, admin_text: str = None):
+    """Всё, что делается после успешного отзыва: конфиги, pending, меню, уведомления."""
+    # 1) очистить все клиентские конфиги (OpenVPN, WireGuard, VLESS)
+    await cleanup_configs_for_client(client_name)
 
-    # 6) снять одобрение и перевести в pending
+    # 2) снять одобрение и перевести в pending
     remove_approved_user(user_id_int)
     add_pending(user_id_int, "", "")
 
-    # 7) удалить все открытые меню у пользователя
+    # 3) удалить все открытые меню у пользователя
     await delete_last_menus(user_id_int)
 
-    # 8) уведомить пользователя
+    # 4) уведомить пользователя
     markup = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🚀 Отправить заявку на доступ", callback_data="send_request")]
     ])
     try:
         await bot.send_message(
             user_id_int,
-            "⛔ Срок действия вашего VPN-сертификата истёк.\n\n"
-            "Для восстановления доступа отправьте новую заявку:",
+            user_text,
             parse_mode="HTML",
             reply_markup=markup
         )
     except:
         pass
 
-    # 9) уведомить администратора
-    try:
-        await bot.send_message(
-            ADMIN_ID,
-            f"⚠️ Доступ пользователя <code>{user_id_int}</code> ({client_name}) снят по истечении срока.",
-            parse_mode="HTML"
-        )
-    except:
-        pass
+    # 5) уведомить администратора
+    if admin_text:
+        try:
+            await bot.send_message(ADMIN_ID, admin_text, parse_mode="HTML")
+        except:
+            pass
 
 
-def get_pubkey_for_client(client_name: str) -> str | None:
-    """
-    Ищет публичный ключ клиента client_name
-    в конфиге WireGuard/AmneziaWG и возвращает его.
-    """
-    for base in ["/root/antizapret/client/wireguard",
-                 "/root/antizapret/client/amneziawg"]:
-        for root, _, files in os.walk(base):
-            for fname in files:
-                if client_name in fname and fname.endswith(".conf"):
-                    path = os.path.join(root, fname)
-                    try:
-                        with open(path, encoding="utf-8") as cf:
-                            for line in cf:
-                                if line.strip().startswith("PublicKey"):
-                                    return line.split("=", 1)[1].strip()
-                    except:
-                        continue
-    return None
-
-
-def cleanup_configs_for_client(client_name: str):
+async def cleanup_configs_for_client(client_name: str):
     """
     Удаляет все конфиги OpenVPN, WireGuard и VLESS,
-    связанные с client_name.
+    связанные с client_name (профили — по реестру файлов, с точными именами).
     """
-    patterns = [
-        "/root/antizapret/client/openvpn/**/*{cn}*.ovpn",
-        "/root/antizapret/client/wireguard/**/*{cn}*.conf",
-        "/root/antizapret/client/amneziawg/**/*{cn}*.conf",
-        "/root/vless-configs/{cn}.txt",
-    ]
-    for pat in patterns:
-        for path in glob.glob(pat.format(cn=client_name), recursive=True):
-            try:
-                os.remove(path)
-            except:
-                pass
+    try:
+        await asyncio.to_thread(remove_artifacts, client_name, None, FILEVPN_NAME)
+    except Exception as e:
+        print(f"Ошибка удаления конфигов {client_name}: {e}")
+    try:
+        os.remove(f"/root/vless-configs/{client_name}.txt")
+    except OSError:
+        pass
 
 
 # ==== Старт бота ====
 async def main():
+    store.load(legacy_files={
+        "approved": APPROVED_FILE,
+        "pending": PENDING_FILE,
+        "users": USERS_FILE,
+        "emojis": EMOJI_FILE,
+        "menus": LAST_MENUS_FILE,
+    })
+    menus.trim()
     print("✅ Бот успешно запущен!")
-    asyncio.create_task(notify_expiring_users())
+    asyncio.create_task(store.run())
+    remove_legacy_notify_flags()
+    asyncio.create_task(expiry_scheduler.run())
+    asyncio.create_task(openvpn_mgmt.run())
+    asyncio.create_task(presence.run())
+    await asyncio.to_thread(quota_engine.load)
+    asyncio.create_task(run_artifact_sweeper(known_profile_clients, FILEVPN_NAME))
+    asyncio.create_task(traffic_collector.run())
     await set_bot_commands()
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await openvpn_mgmt.close()
+        store.close()
+        db.close()
+        logging.info(f"Auth cache stats: {auth_cache.stats()}")
 
 
 
@@ -0,0 +1,151 @@
+import os
+import base64
+import logging
+import threading
+from datetime import datetime, timezone
+
+# Сроки действия сертификатов читаем сами, без openssl: из DER берём только
+# tbsCertificate.validity (notBefore и notAfter) за один проход.
+# Результат кэшируется по пути и (mtime, size) файла — после renew_cert.sh
+# файл перезаписывается, и следующая проверка прочитает его заново.
+
+PEM_BEGIN = b"-----BEGIN CERTIFICATE-----"
+PEM_END = b"-----END CERTIFICATE-----"
+
+TAG_SEQUENCE = 0x30
+TAG_INTEGER = 0x02
+TAG_UTC_TIME = 0x17
+TAG_GENERALIZED_TIME = 0x18
+TAG_EXPLICIT_VERSION = 0xA0
+
+
+class CertError(ValueError):
+    pass
+
+
+def _read_tlv(data, pos):
+    """Возвращает (tag, начало значения, конец значения) для элемента DER по смещению pos."""
+    if pos + 2 > len(data):
+        raise CertError("truncated DER")
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        if n == 0 or n > 4 or pos + n > len(data):
+            raise CertError("bad DER length")
+        length = int.from_bytes(data[pos:pos + n], "big")
+        pos += n
+    end = pos + length
+    if end > len(data):
+        raise CertError("truncated DER")
+    return tag, pos, end
+
+
+def _parse_time(tag, raw):
+    text = raw.decode("ascii")
+    if not text.endswith("Z"):
+        raise CertError(f"unsupported time format: {text}")
+    if tag == TAG_UTC_TIME:
+        # RFC 5280: YY >= 50 — 19YY, иначе 20YY
+        year = int(text[:2])
+        text = ("19" if year >= 50 else "20") + text
+    elif tag != TAG_GENERALIZED_TIME:
+        raise CertError(f"unexpected time tag 0x{tag:02x}")
+    return datetime.strptime(text, "%Y%m%d%H%M%SZ").replace(tzinfo=timezone.utc)
+
+
+def parse_validity(der):
+    """(notBefore, notAfter) из DER-сертификата, datetime в UTC."""
+    tag, pos, _ = _read_tlv(der, 0)            # Certificate
+    if tag != TAG_SEQUENCE:
+        raise CertError("not a certificate")
+    tag, pos, _ = _read_tlv(der, pos)          # tbsCertificate
+    if tag != TAG_SEQUENCE:
+        raise CertError("not a certificate")
+    tag, start, end = _read_tlv(der, pos)
+    if tag == TAG_EXPLICIT_VERSION:            # [0] version — необязательное поле
+        tag, start, end = _read_tlv(der, end)
+    if tag != TAG_INTEGER:                     # serialNumber
+        raise CertError("serial number expected")
+    _, _, end = _read_tlv(der, end)            # signature AlgorithmIdentifier
+    _, _, end = _read_tlv(der, end)            # issuer
+    tag, pos, _ = _read_tlv(der, end)          # validity
+    if tag != TAG_SEQUENCE:
+        raise CertError("validity expected")
+    tag, start, end = _read_tlv(der, pos)
+    not_before = _parse_time(tag, der[start:end])
+    tag, start, end = _read_tlv(der, end)
+    not_after = _parse_time(tag, der[start:end])
+    return not_before, not_after
+
+
+def pem_to_der(data):
+    """DER первого сертификата в файле (PEM может быть окружён текстом, как в выводе easyrsa)."""
+    begin = data.find(PEM_BEGIN)
+    if begin < 0:
+        return data  # уже DER
+    begin += len(PEM_BEGIN)
+    end = data.find(PEM_END, begin)
+    if end < 0:
+        raise CertError("unterminated PEM block")
+    return base64.b64decode(b"".join(data[begin:end].split()))
+
+
+class ValidityCache:
+    """Кэш сроков сертификатов: путь -> ((mtime_ns, size), (notBefore, notAfter) или None)."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._entries.get(path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+        try:
+            with open(path, "rb") as f:
+                validity = parse_validity(pem_to_der(f.read()))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cannot read certificate {path}: {e}")
+            validity = None
+        with self._lock:
+            self._entries[path] = (sig, validity)
+        return validity
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+
+validity_cache = ValidityCache()
+
+
+def get_validity(path):
+    """(notBefore, notAfter) сертификата по пути или None, если файла нет или он не читается."""
+    return validity_cache.get(path)
+
+
+def get_expiry_info(path, now=None):
+    """{"date_from", "date_to", "days_left"} для сертификата или None."""
+    validity = validity_cache.get(path)
+    if validity is None:
+        return None
+    date_from, date_to = validity
+    now = now or datetime.now(timezone.utc)
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "days_left": (date_to - now).days,
+    }
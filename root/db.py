@@ -1,192 +1,523 @@
 import sqlite3
+import asyncio
 import logging
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = "/root/vpn.db"
+
+# SQLite до 3.32 ограничивает число параметров в запросе 999 — большие IN (...) режем на куски
+MAX_SQL_PARAMS = 500
+
+# Запросы держим константами: одинаковый текст — один подготовленный statement в кэше sqlite3
+SQL_SAVE_PROFILE_NAME = (
+    "INSERT INTO users (id, profile_name) VALUES (?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET profile_name = excluded.profile_name"
+)
+SQL_DELETE_USER = "DELETE FROM users WHERE id = ?"
+SQL_UPSERT_USER = (
+    "INSERT INTO users (id, username, profile_name) VALUES (?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    "username = COALESCE(excluded.username, users.username), "
+    "profile_name = COALESCE(excluded.profile_name, users.profile_name)"
+)
+SQL_ALL_USERS = "SELECT id, username, profile_name FROM users ORDER BY id"
+SQL_SELECT_USERS = "SELECT id, username, profile_name FROM users WHERE id IN ({})"
+SQL_SELECT_CLIENTS_BY_CN = (
+    "SELECT id, user_id, client_name, common_name, is_active, created_at, artifacts FROM clients "
+    "WHERE common_name IN ({})"
+)
+SQL_SELECT_CLIENTS_BY_USER = (
+    "SELECT id, user_id, client_name, common_name, is_active, created_at, artifacts FROM clients "
+    "WHERE user_id IN ({})"
+)
+CLIENT_COLUMNS = ("user_id", "client_name", "common_name", "is_active")
+
+
+# ---------- миграции ----------
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется в своей
+# транзакции вместе с повышением версии, поэтому база никогда не остаётся «между» версиями.
+# Новые изменения схемы — только новой функцией в конце MIGRATIONS, старые не трогаем.
+
+def _migration_base_schema(db):
+    # Таблица пользователей: id — Telegram ID, profile_name — имя профиля (CN сертификата)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            profile_name TEXT,
+            is_admin BOOLEAN DEFAULT FALSE,
+            subscribed BOOLEAN DEFAULT TRUE,
+            subscription_end_date TEXT
+        )
+    ''')
+    # Старые базы создавались без profile_name
+    columns = {row[1] for row in db.fetch_all("PRAGMA table_info(users)")}
+    if "profile_name" not in columns:
+        db.execute("ALTER TABLE users ADD COLUMN profile_name TEXT")
+    # Таблица клиентов (конфигураций)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            client_name TEXT UNIQUE,
+            common_name TEXT UNIQUE,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+
+def _migration_indexes(db):
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_profile_name ON users(profile_name)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_clients_user_id ON clients(user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_clients_common_name ON clients(common_name)")
+
+
+def _migration_state_tables(db):
+    # Состояние бота, раньше жившее в txt/json (см. state.py)
+    db.execute("CREATE TABLE IF NOT EXISTS approved_users (user_id INTEGER PRIMARY KEY)")
+    db.execute("CREATE TABLE IF NOT EXISTS pending_users (user_id INTEGER PRIMARY KEY, username TEXT, fullname TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS known_users (user_id INTEGER PRIMARY KEY)")
+    db.execute("CREATE TABLE IF NOT EXISTS user_emojis (user_id INTEGER PRIMARY KEY, emoji TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS last_menus (chat_id INTEGER PRIMARY KEY, message_ids TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS state_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _migration_expiry_reminders(db):
+    # Отправленные напоминания об окончании сертификата (вместо .notified_*.flag)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS expiry_reminders (
+            cn TEXT NOT NULL,
+            not_after TEXT NOT NULL,
+            days INTEGER NOT NULL,
+            sent_at TEXT,
+            PRIMARY KEY (cn, not_after, days)
+        )
+    ''')
+
+
+def _migration_traffic(db):
+    # Учёт трафика (traffic.py): свёртки по часам/дням/месяцам, итог за всё время
+    # и последние значения счётчиков сессий для подсчёта приращений
+    for table in ("traffic_hourly", "traffic_daily", "traffic_monthly"):
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                cn TEXT NOT NULL,
+                period TEXT NOT NULL,
+                rx INTEGER NOT NULL DEFAULT 0,
+                tx INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (cn, period)
+            ) WITHOUT ROWID
+        ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_total (
+            cn TEXT PRIMARY KEY,
+            rx INTEGER NOT NULL DEFAULT 0,
+            tx INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_counters (
+            key TEXT PRIMARY KEY,
+            rx INTEGER NOT NULL,
+            tx INTEGER NOT NULL
+        )
+    ''')
+
+
+def _migration_quotas(db):
+    # Квоты трафика (quota.py): лимит в байтах за календарный месяц или за скользящее
+    # окно в window_days дней; warned_at/suspended_at — уже отправленное предупреждение
+    # и приостановка, чтобы после перезапуска бота они не повторялись
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS quotas (
+            cn TEXT PRIMARY KEY,
+            limit_bytes INTEGER NOT NULL,
+            period TEXT NOT NULL DEFAULT 'month',
+            window_days INTEGER NOT NULL DEFAULT 30,
+            warned_at TEXT,
+            suspended_at TEXT
+        )
+    ''')
+
+
+def _migration_wg_pools(db):
+    # Адреса клиентов WireGuard (wgpool.py): битовая карта занятых адресов подсети
+    # интерфейса и выданные клиентам адреса (номер хоста в подсети)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS wg_pools (
+            interface TEXT PRIMARY KEY,
+            network TEXT NOT NULL,
+            used BLOB NOT NULL
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS wg_leases (
+            interface TEXT NOT NULL,
+            client TEXT NOT NULL,
+            host INTEGER NOT NULL,
+            PRIMARY KEY (interface, client)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migration_client_artifacts(db):
+    # Файлы профилей клиента (artifacts.py): JSON {вариант: путь относительно
+    # /root/antizapret/client}, вариант — "openvpn/vpn-udp", "amneziawg/antizapret" и т. п.
+    columns = {row[1] for row in db.fetch_all("PRAGMA table_info(clients)")}
+    if "artifacts" not in columns:
+        db.execute("ALTER TABLE clients ADD COLUMN artifacts TEXT")
+
+
+MIGRATIONS = [
+    _migration_base_schema,   # 1
+    _migration_indexes,       # 2
+    _migration_state_tables,  # 3
+    _migration_expiry_reminders,  # 4
+    _migration_traffic,  # 5
+    _migration_quotas,  # 6
+    _migration_wg_pools,  # 7
+    _migration_client_artifacts,  # 8
+]
+
 
 class Database:
-    def __init__(self, db_file):
+    """
+    Одно долгоживущее соединение с vpn.db на весь процесс.
+    WAL-журнал, synchronous=NORMAL, кэш подготовленных запросов и явные транзакции.
+    Соединение общее для всех потоков, доступ к нему сериализуется блокировкой.
+    """
+
+    def __init__(self, db_file, cached_statements=256):
         self.db_file = db_file
+        self.cached_statements = cached_statements
         self.conn = None
-        self.cursor = None
+        self._lock = threading.RLock()
+        self._tx_depth = 0
         self.connect()
-        self.create_tables()
+        self.migrate()
 
     def connect(self):
-        try:
-            self.conn = sqlite3.connect(self.db_file)
-            self.cursor = self.conn.cursor()
-            logging.info("Connected to database.")
-        except sqlite3.Error as e:
-            logging.error(f"Database connection error: {e}")
+        # isolation_level=None — автокоммит; транзакции открываем сами через transaction()
+        self.conn = sqlite3.connect(
+            self.db_file,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=self.cached_statements,
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        logging.info(f"Connected to database {self.db_file} (WAL).")
 
     def close(self):
-        if self.conn:
-            self.conn.close()
-            logging.info("Database connection closed.")
-
-    def create_tables(self):
-        try:
-            # Таблица пользователей с полями для будущих подписок
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    subscribed BOOLEAN DEFAULT TRUE, -- По умолчанию все подписаны, пока нет оплаты
-                    subscription_end_date TEXT -- Дата окончания подписки, пока не используется активно
-                )
-            ''')
-            # Таблица клиентов (конфигураций)
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS clients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    client_name TEXT UNIQUE, -- Имя, которое вводит пользователь (например, "Мой телефон")
-                    common_name TEXT UNIQUE, -- Common Name OpenVPN (используется для OpenVPN)
-                    is_active BOOLEAN DEFAULT TRUE, -- Активен ли конфиг (можно удалить)
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP, -- Дата создания
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                )
-            ''')
-            self.conn.commit()
-            logging.info("Tables checked/created successfully.")
-        except sqlite3.Error as e:
-            logging.error(f"Error creating tables: {e}")
-
-    def add_user(self, user_id, username):
-        """Добавляет нового пользователя в базу данных или обновляет, если он уже существует."""
-        try:
-            self.cursor.execute("INSERT OR IGNORE INTO users (id, username, subscribed) VALUES (?, ?, ?)", (user_id, username, True))
-            self.conn.commit()
-            logging.info(f"User {user_id} added or already exists.")
-            return True
-        except sqlite3.Error as e:
-            logging.error(f"Error adding user {user_id}: {e}")
-            return False
-
-    def get_user(self, user_id):
-        """Получает информацию о пользователе по его ID."""
-        try:
-            self.cursor.execute("SELECT id, username, is_admin, subscribed, subscription_end_date FROM users WHERE id = ?", (user_id,))
-            user_data = self.cursor.fetchone()
-            if user_data:
-                return {
-                    'id': user_data[0],
-                    'username': user_data[1],
-                    'is_admin': bool(user_data[2]),
-                    'subscribed': bool(user_data[3]),
-                    'subscription_end_date': user_data[4]
-                }
-            return None
-        except sqlite3.Error as e:
-            logging.error(f"Error getting user {user_id}: {e}")
-            return None
-
-    def update_user_subscription(self, user_id, subscribed: bool, subscription_end_date: datetime = None):
-        """Обновляет статус подписки пользователя. Пока не используется активно."""
-        try:
-            end_date_str = subscription_end_date.isoformat() if subscription_end_date else None
-            self.cursor.execute(
-                "UPDATE users SET subscribed = ?, subscription_end_date = ? WHERE id = ?",
-                (subscribed, end_date_str, user_id)
-            )
-            self.conn.commit()
-            logging.info(f"Subscription updated for user {user_id} to {subscribed}, ends {end_date_str}.")
-            return True
-        except sqlite3.Error as e:
-            logging.error(f"Error updating user subscription for user {user_id}: {e}")
-            return False
-
-    def get_all_users(self):
-        """Получает список всех пользователей."""
-        try:
-            self.cursor.execute("SELECT id, username, is_admin, subscribed, subscription_end_date FROM users")
-            users = self.cursor.fetchall()
-            return [{
-                'id': u[0], 'username': u[1], 'is_admin': bool(u[2]),
-                'subscribed': bool(u[3]), 'subscription_end_date': u[4]
-            } for u in users]
-        except sqlite3.Error as e:
-            logging.error(f"Error getting all users: {e}")
-            return []
-
-    def add_client(self, user_id, client_name, common_name): # Изменено для common_name OpenVPN
-        """Добавляет новую VPN-конфигурацию для пользователя."""
-        try:
-            self.cursor.execute(
-                "INSERT INTO clients (user_id, client_name, common_name, is_active) VALUES (?, ?, ?, ?)",
-                (user_id, client_name, common_name, True) # По умолчанию активен
-            )
-            self.conn.commit()
-            logging.info(f"Client {client_name} (CN: {common_name}) added for user {user_id}.")
-            return True
-        except sqlite3.Error as e:
-            logging.error(f"Error adding client {client_name} for user {user_id}: {e}")
-            return False
-
-    def get_user_configs_count(self, user_id):
-        """Возвращает количество активных конфигураций для пользователя."""
-        try:
-            self.cursor.execute("SELECT COUNT(*) FROM clients WHERE user_id = ? AND is_active = TRUE", (user_id,))
-            count = self.cursor.fetchone()[0]
-            logging.debug(f"User {user_id} has {count} active configs.")
-            return count
-        except sqlite3.Error as e:
-            logging.error(f"Error getting user configs count for user {user_id}: {e}")
-            return 0
-
-    def get_user_clients(self, user_id):
-        """Возвращает список клиентов пользователя (конфигураций), включая неактивные."""
-        try:
-            self.cursor.execute("SELECT id, client_name, common_name, is_active FROM clients WHERE user_id = ?", (user_id,))
-            clients = self.cursor.fetchall()
-            return [{'id': c[0], 'client_name': c[1], 'common_name': c[2], 'is_active': bool(c[3])} for c in clients]
-        except sqlite3.Error as e:
-            logging.error(f"Error getting user clients for user {user_id}: {e}")
-            return []
-
-    def set_client_inactive(self, client_id):
-        """Деактивирует клиента (помечает как удаленный)."""
-        try:
-            self.cursor.execute("UPDATE clients SET is_active = FALSE WHERE id = ?", (client_id,))
-            self.conn.commit()
-            logging.info(f"Client {client_id} set to inactive.")
-            return True
-        except sqlite3.Error as e:
-            logging.error(f"Error setting client {client_id} inactive: {e}")
-            return False
-
-    def get_client_by_id(self, client_id):
-        """Получает данные клиента по его ID."""
-        try:
-            self.cursor.execute("SELECT id, user_id, client_name, common_name, is_active FROM clients WHERE id = ?", (client_id,))
-            client_data = self.cursor.fetchone()
-            if client_data:
-                return {
-                    'id': client_data[0],
-                    'user_id': client_data[1],
-                    'client_name': client_data[2],
-                    'common_name': client_data[3],
-                    'is_active': bool(client_data[4])
-                }
-            return None
-        except sqlite3.Error as e:
-            logging.error(f"Error getting client by ID {client_id}: {e}")
-            return None
-
-    def get_client_by_common_name(self, common_name): # Новый метод для OpenVPN
-        """Получает данные клиента по его Common Name."""
-        try:
-            self.cursor.execute("SELECT id, user_id, client_name, common_name, is_active FROM clients WHERE common_name = ?", (common_name,))
-            client_data = self.cursor.fetchone()
-            if client_data:
-                return {
-                    'id': client_data[0],
-                    'user_id': client_data[1],
-                    'client_name': client_data[2],
-                    'common_name': client_data[3],
-                    'is_active': bool(client_data[4])
-                }
-            return None
-        except sqlite3.Error as e:
-            logging.error(f"Error getting client by common name {common_name}: {e}")
-            return None
+        with self._lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+                logging.info("Database connection closed.")
+
+    @property
+    def schema_version(self):
+        return self.fetch_one("PRAGMA user_version")[0]
+
+    def migrate(self):
+        """Применяет недостающие миграции из MIGRATIONS по порядку."""
+        with self._lock:
+            version = self.schema_version
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                with self.transaction():
+                    migration(self)
+                    self.conn.execute(f"PRAGMA user_version = {number}")
+                logging.info(f"Database migrated to version {number} ({migration.__name__}).")
+
+    # ---------- запросы ----------
+
+    def execute(self, sql, params=()):
+        """Выполняет запрос; вне transaction() он сразу фиксируется. Возвращает rowcount."""
+        with self._lock:
+            return self.conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seq_of_params):
+        with self._lock:
+            return self.conn.executemany(sql, seq_of_params).rowcount
+
+    def fetch_one(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def fetch_all(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # ---------- асинхронные варианты: тот же запрос, но в рабочем потоке, не блокируя event loop ----------
+
+    async def run(self, func, *args):
+        """Выполняет func(*args) в рабочем потоке; удобно для нескольких запросов в одной транзакции."""
+        return await asyncio.to_thread(func, *args)
+
+    async def execute_async(self, sql, params=()):
+        return await self.run(self.execute, sql, params)
+
+    async def executemany_async(self, sql, seq_of_params):
+        return await self.run(self.executemany, sql, seq_of_params)
+
+    async def fetch_one_async(self, sql, params=()):
+        return await self.run(self.fetch_one, sql, params)
+
+    async def fetch_all_async(self, sql, params=()):
+        return await self.run(self.fetch_all, sql, params)
+
+    # ---------- пакетные запросы: одна транзакция (или SAVEPOINT внутри внешней) на все строки ----------
+
+    def fetch_in(self, sql_template, values):
+        """SELECT ... WHERE x IN ({}) для произвольно длинного списка: режет на куски по MAX_SQL_PARAMS."""
+        values = list(dict.fromkeys(values))
+        rows = []
+        with self._lock:
+            for i in range(0, len(values), MAX_SQL_PARAMS):
+                chunk = values[i:i + MAX_SQL_PARAMS]
+                sql = sql_template.format(",".join("?" * len(chunk)))
+                rows.extend(self.conn.execute(sql, chunk).fetchall())
+        return rows
+
+    def upsert_users(self, rows):
+        """rows — [(user_id, username, profile_name)]; None в поле не затирает сохранённое значение."""
+        with self.transaction():
+            return self.executemany(SQL_UPSERT_USER, rows)
+
+    def select_users(self, user_ids=None):
+        """{Telegram ID: (username, profile_name)} для найденных пользователей; без user_ids — для всех."""
+        if user_ids is None:
+            rows = self.fetch_all(SQL_ALL_USERS)
+        else:
+            rows = self.fetch_in(SQL_SELECT_USERS, user_ids)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def upsert_clients(self, rows, columns=CLIENT_COLUMNS, update=None):
+        """
+        rows — кортежи значений columns (по умолчанию user_id, client_name, common_name, is_active).
+        Ключ — common_name; у существующего клиента обновляются столбцы update
+        (по умолчанию — все перечисленные, кроме ключа).
+        """
+        update = [c for c in columns if c != "common_name"] if update is None else update
+        updates = ", ".join(f"{c} = excluded.{c}" for c in update)
+        sql = (
+            f"INSERT INTO clients ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(common_name) DO UPDATE SET {updates}"
+        )
+        with self.transaction():
+            return self.executemany(sql, rows)
+
+    def select_clients(self, common_names=None, user_ids=None):
+        """
+        Клиенты по списку CN или по списку Telegram ID.
+        Строки (id, user_id, client_name, common_name, is_active, created_at, artifacts).
+        """
+        if common_names is not None:
+            return self.fetch_in(SQL_SELECT_CLIENTS_BY_CN, common_names)
+        if user_ids is not None:
+            return self.fetch_in(SQL_SELECT_CLIENTS_BY_USER, user_ids)
+        return []
+
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция: with db.transaction(): ...
+        Всё внутри фиксируется одним COMMIT или откатывается целиком.
+        Вложенные вызовы становятся SAVEPOINT.
+        """
+        with self._lock:
+            depth = self._tx_depth
+            if depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+            else:
+                self.conn.execute(f"SAVEPOINT sp{depth}")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self.conn.execute("ROLLBACK")
+                else:
+                    self.conn.execute(f"ROLLBACK TO sp{depth}")
+                    self.conn.execute(f"RELEASE sp{depth}")
+                raise
+            else:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self.conn.execute("COMMIT")
+                else:
+                    self.conn.execute(f"RELEASE sp{depth}")
+
+
+class ProfileIndex:
+    """
+    Двусторонний индекс в памяти: Telegram ID ⇄ имя профиля.
+    Загружается из таблицы users при старте и обновляется при сохранении/переименовании/удалении.
+    """
+
+    def __init__(self):
+        self._name_by_id = {}
+        self._ids_by_name = {}    # имя -> {Telegram ID}: имя профиля в базе не уникально
+
+    def load(self, db):
+        self._name_by_id.clear()
+        self._ids_by_name.clear()
+        for user_id, (_, name) in db.select_users().items():
+            if name is None:
+                continue
+            self._name_by_id[user_id] = name
+            self._ids_by_name.setdefault(name, set()).add(user_id)
+        logging.info(f"Profile index loaded: {len(self._name_by_id)} profiles.")
+
+    def _discard(self, user_id, name):
+        ids = self._ids_by_name.get(name)
+        if ids is not None:
+            ids.discard(user_id)
+            if not ids:
+                del self._ids_by_name[name]
+
+    def set(self, user_id, name):
+        old_name = self._name_by_id.get(user_id)
+        if old_name is not None:
+            self._discard(user_id, old_name)
+        self._name_by_id[user_id] = name
+        self._ids_by_name.setdefault(name, set()).add(user_id)
+
+    def remove(self, user_id):
+        name = self._name_by_id.pop(user_id, None)
+        if name is not None:
+            self._discard(user_id, name)
+
+    def name_for(self, user_id):
+        return self._name_by_id.get(user_id)
+
+    def id_for(self, name):
+        # при дублях имени побеждает меньший id — как раньше у SELECT ... LIMIT 1
+        ids = self._ids_by_name.get(name)
+        return min(ids) if ids else None
+
+    def ids_for(self, names):
+        return {name: self.id_for(name) for name in names}
+
+    def names_for(self, user_ids):
+        get = self._name_by_id.get
+        return {user_id: get(user_id) for user_id in user_ids}
+
+
+_db = None
+profiles = ProfileIndex()
+
+
+def init_db(db_file=DEFAULT_DB_PATH):
+    """Открывает (один раз) общее соединение с базой, грузит индекс профилей и возвращает соединение."""
+    global _db
+    if _db is None or _db.db_file != db_file:
+        _db = Database(db_file)
+        profiles.load(_db)
+    return _db
+
+
+def get_db():
+    return _db if _db is not None else init_db()
+
+
+def get_profile_name(user_id):
+    """Имя профиля по Telegram ID или None (из индекса в памяти)."""
+    get_db()
+    return profiles.name_for(user_id)
+
+
+def get_user_id_by_name(profile_name):
+    """Telegram ID по имени профиля или None (из индекса в памяти)."""
+    get_db()
+    return profiles.id_for(profile_name)
+
+
+def get_ids_for_names(names):
+    """Пакетный поиск: {имя профиля: Telegram ID или None}."""
+    get_db()
+    return profiles.ids_for(names)
+
+
+def get_names_for_ids(user_ids):
+    """Пакетный поиск: {Telegram ID: имя профиля или None}."""
+    get_db()
+    return profiles.names_for(user_ids)
+
+
+# Запись идёт в рабочем потоке, а индекс в памяти обновляется уже в потоке event loop,
+# после успешного запроса — читатели индекса никогда не видят его наполовину изменённым.
+
+async def save_profile_name(user_id, profile_name):
+    """Создаёт пользователя или меняет ему имя профиля."""
+    try:
+        await get_db().execute_async(SQL_SAVE_PROFILE_NAME, (user_id, profile_name))
+    except sqlite3.Error as e:
+        logging.error(f"Error saving profile name {profile_name} for user {user_id}: {e}")
+        return False
+    profiles.set(user_id, profile_name)
+    return True
+
+
+async def delete_user(user_id):
+    """Удаляет пользователя (и его имя профиля) из базы."""
+    try:
+        await get_db().execute_async(SQL_DELETE_USER, (user_id,))
+    except sqlite3.Error as e:
+        logging.error(f"Error deleting user {user_id}: {e}")
+        return False
+    profiles.remove(user_id)
+    return True
+
+
+async def upsert_users(rows):
+    """
+    Пакетная вставка/обновление пользователей одной транзакцией.
+    rows — [(user_id, username, profile_name)]; None в поле не затирает сохранённое значение.
+    """
+    rows = list(rows)
+    try:
+        await get_db().run(get_db().upsert_users, rows)
+    except sqlite3.Error as e:
+        logging.error(f"Error upserting {len(rows)} users: {e}")
+        return False
+    for user_id, _username, profile_name in rows:
+        if profile_name is not None:
+            profiles.set(user_id, profile_name)
+    return True
+
+
+async def select_users(user_ids):
+    """{Telegram ID: (username, profile_name)} для найденных пользователей."""
+    try:
+        return await get_db().run(get_db().select_users, list(user_ids))
+    except sqlite3.Error as e:
+        logging.error(f"Error selecting users: {e}")
+        return {}
+
+
+async def upsert_clients(rows):
+    """Пакетная вставка/обновление клиентов: rows — [(user_id, client_name, common_name, is_active)]."""
+    rows = list(rows)
+    try:
+        await get_db().run(get_db().upsert_clients, rows)
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"Error upserting {len(rows)} clients: {e}")
+        return False
+
+
+async def select_clients(common_names=None, user_ids=None):
+    """Клиенты по списку CN или по списку Telegram ID — строки как у Database.select_clients."""
+    try:
+        return await get_db().run(get_db().select_clients, common_names, user_ids)
+    except sqlite3.Error as e:
+        logging.error(f"Error selecting clients: {e}")
+        return []
@@ -0,0 +1,224 @@
+import os
+import asyncio
+import logging
+import subprocess
+
+# Клиент management-интерфейса OpenVPN (директива `management logs/<имя>.sock unix`
+# в серверных конфигах). К экземпляру допускается только одно management-подключение,
+# поэтому сессия на экземпляр одна на весь бот: постоянное соединение, ответы на команды
+# идут по порядку, а асинхронные уведомления (строки с '>') раздаются подписчикам.
+#
+# CRL перечитывать сигналом не нужно: OpenVPN 2.4+ сам перечитывает crl-verify при
+# смене mtime/размера на каждом новом TLS-рукопожатии. Отозванного клиента достаточно
+# отключить командой `kill <CN>` — остальные пользователи не переподключаются.
+
+OPENVPN_SERVER_DIR = "/etc/openvpn/server"
+OPENVPN_INSTANCES = ("antizapret-udp", "antizapret-tcp", "vpn-udp", "vpn-tcp")
+
+
+def default_addresses():
+    return {name: os.path.join(OPENVPN_SERVER_DIR, "logs", f"{name}.sock") for name in OPENVPN_INSTANCES}
+
+
+def soft_restart(instance):
+    """Запасной путь, если management недоступен: SIGUSR1 только этому экземпляру."""
+    result = subprocess.run(
+        ["systemctl", "kill", "-s", "SIGUSR1", f"openvpn-server@{instance}"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    return result.returncode == 0
+
+
+class ManagementError(Exception):
+    pass
+
+
+class ManagementSession:
+    """
+    Одно постоянное подключение к management-интерфейсу.
+    address — путь к unix-сокету или кортеж (host, port) для TCP.
+    """
+
+    def __init__(self, name, address, timeout=5.0, reconnect_delay=5.0):
+        self.name = name
+        self.address = address
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.listeners = []       # вызываются с (name, строка уведомления без '>')
+        self.on_connect = []      # корутины (session), вызываются после каждого подключения
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._waiters = []        # [(future, multiline, lines)] — ответы приходят по порядку
+        self._lock = None
+        self._connecting = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        if self.connected:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self.connected:
+                return
+            if isinstance(self.address, tuple):
+                conn = asyncio.open_connection(*self.address)
+            else:
+                conn = asyncio.open_unix_connection(self.address)
+            self._reader, self._writer = await asyncio.wait_for(conn, self.timeout)
+            self._reader_task = asyncio.create_task(self._read_loop())
+            logging.info(f"OpenVPN management {self.name}: connected.")
+        for callback in self.on_connect:
+            try:
+                await callback(self)
+            except Exception as e:
+                logging.error(f"OpenVPN management {self.name}: on_connect failed: {e}")
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._drop(ManagementError("session closed"))
+
+    def _drop(self, error):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+        waiters, self._waiters = self._waiters, []
+        for future, _, _ in waiters:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                raw = await self._reader.readline()
+                if not raw:
+                    raise ManagementError("connection closed by OpenVPN")
+                self._dispatch(raw.decode("utf-8", errors="replace").rstrip("\r\n"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"OpenVPN management {self.name}: {e}")
+            self._drop(e if isinstance(e, ManagementError) else ManagementError(str(e)))
+
+    def _dispatch(self, line):
+        if line.startswith(">"):
+            for listener in self.listeners:
+                try:
+                    listener(self.name, line[1:])
+                except Exception as e:
+                    logging.error(f"OpenVPN management {self.name}: listener failed: {e}")
+            return
+        if not self._waiters:
+            return
+        future, multiline, lines = self._waiters[0]
+        if multiline:
+            if line == "END" or (not lines and line.startswith("ERROR:")):
+                self._waiters.pop(0)
+                if not future.done():
+                    if line.startswith("ERROR:"):
+                        future.set_exception(ManagementError(line[6:].strip()))
+                    else:
+                        future.set_result(lines)
+            else:
+                lines.append(line)
+            return
+        if line.startswith("SUCCESS:") or line.startswith("ERROR:"):
+            self._waiters.pop(0)
+            if not future.done():
+                future.set_result(line)
+
+    async def command(self, cmd, multiline=False):
+        """
+        Отправляет команду и ждёт ответ: строку SUCCESS:/ERROR: или,
+        для multiline-команд (status, state, version...), список строк до END.
+        """
+        await self.connect()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        future = asyncio.get_running_loop().create_future()
+        async with self._lock:
+            self._waiters.append((future, multiline, []))
+            try:
+                self._writer.write(f"{cmd}\n".encode())
+                await self._writer.drain()
+            except Exception as e:
+                self._drop(ManagementError(str(e)))
+                raise ManagementError(str(e))
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def kill(self, common_name):
+        """Отключает все сессии CN на этом экземпляре. Возвращает число отключённых клиентов."""
+        reply = await self.command(f"kill {common_name}")
+        if reply.startswith("SUCCESS:"):
+            # SUCCESS: common name 'x' found, 2 client(s) killed
+            for part in reply.split(","):
+                part = part.strip()
+                if part.endswith("client(s) killed"):
+                    return int(part.split()[0])
+            return 1
+        return 0  # ERROR: common name 'x' not found
+
+    async def keep_alive(self):
+        """Держит подключение: переподключается после обрыва или перезапуска OpenVPN."""
+        while True:
+            try:
+                await self.connect()
+            except (OSError, asyncio.TimeoutError, ManagementError):
+                pass
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class ManagementPool:
+    """Сессии со всеми экземплярами OpenVPN."""
+
+    def __init__(self, addresses=None, **session_kwargs):
+        addresses = default_addresses() if addresses is None else addresses
+        self.sessions = {
+            name: ManagementSession(name, address, **session_kwargs)
+            for name, address in addresses.items()
+        }
+
+    def add_listener(self, listener):
+        for session in self.sessions.values():
+            session.listeners.append(listener)
+
+    def add_on_connect(self, callback):
+        for session in self.sessions.values():
+            session.on_connect.append(callback)
+
+    async def run(self):
+        await asyncio.gather(*(session.keep_alive() for session in self.sessions.values()))
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+
+    async def kill(self, common_names):
+        """
+        Отключает CN на всех экземплярах.
+        Возвращает ({CN: сколько сессий отключено}, [экземпляры, до которых не достучались]).
+        """
+        common_names = list(common_names)
+        killed = {cn: 0 for cn in common_names}
+        unreachable = []
+
+        async def kill_on(session):
+            try:
+                for cn in common_names:
+                    count = await session.kill(cn)
+                    killed[cn] += count
+            except (OSError, asyncio.TimeoutError, ManagementError) as e:
+                logging.warning(f"OpenVPN management {session.name}: kill failed: {e}")
+                unreachable.append(session.name)
+
+        await asyncio.gather(*(kill_on(s) for s in self.sessions.values()))
+        return killed, unreachable
@@ -0,0 +1,100 @@
+import os
+import threading
+
+from ovpn_mgmt import OPENVPN_SERVER_DIR
+
+# Разбор status-файлов OpenVPN (и вывода `status 2`/`status 3` через management).
+# Колонки берутся из строки HEADER,CLIENT_LIST,... — а не по номерам, которые
+# отличаются между версиями OpenVPN. status-version 2 разделён запятыми, 3 — табуляцией.
+# Разобранный снимок файла кэшируется по (mtime, size): OpenVPN переписывает файл
+# раз в 30 секунд, и все просмотры между перезаписями получают готовый результат.
+
+
+def status_file(instance):
+    return os.path.join(OPENVPN_SERVER_DIR, "logs", f"{instance}-status.log")
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def session_from_row(row):
+    """Сессия в общем виде из строки CLIENT_LIST, разложенной по колонкам HEADER."""
+    return {
+        "cn": row.get("Common Name", ""),
+        "real_address": row.get("Real Address", ""),
+        "virtual_address": row.get("Virtual Address", ""),
+        "bytes_received": _int(row.get("Bytes Received")),
+        "bytes_sent": _int(row.get("Bytes Sent")),
+        "connected_since": _int(row.get("Connected Since (time_t)")),
+        "client_id": row.get("Client ID") or None,
+    }
+
+
+def parse_status(lines):
+    """Список сессий из строк status-version 2/3."""
+    columns = None
+    sessions = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        sep = "\t" if line.startswith(("HEADER\t", "CLIENT_LIST\t")) else ","
+        if line.startswith(f"HEADER{sep}CLIENT_LIST{sep}"):
+            columns = line.split(sep)[2:]
+        elif line.startswith(f"CLIENT_LIST{sep}") and columns:
+            row = dict(zip(columns, line.split(sep)[1:]))
+            sessions.append(session_from_row(row))
+    return sessions
+
+
+def sessions_by_client(snapshots):
+    """{CN: [сессии с полем instance]} из {экземпляр: [сессии]}."""
+    clients = {}
+    for instance, sessions in snapshots.items():
+        for session in sessions:
+            if session["cn"]:
+                clients.setdefault(session["cn"], []).append(dict(session, instance=instance))
+    return clients
+
+
+class StatusFileCache:
+    """Снимки status-файлов: путь -> ((mtime_ns, size), [сессии])."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        sessions = self.read(path)
+        return sessions if sessions is not None else []
+
+    def read(self, path):
+        """Сессии из status-файла или None, если файл не прочитан."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._entries.get(path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                sessions = parse_status(f)
+        except OSError:
+            return None
+        with self._lock:
+            self._entries[path] = (sig, sessions)
+        return sessions
+
+    def read_all(self, instances):
+        """{экземпляр: [сессии]} по status-файлам всех экземпляров."""
+        return {instance: self.get(status_file(instance)) for instance in instances}
+
+
+status_cache = StatusFileCache()
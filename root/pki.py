@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# Easy-RSA (через openssl ca) ведёт базу выданных сертификатов в pki/index.txt.
+# Строка — поля через TAB:
+#   статус (V/R/E)  срок действия  дата отзыва[,причина]  серийный номер  файл  субъект (/CN=...)
+# Одна строка на сертификат: renew_cert.sh дописывает новую строку для того же CN,
+# а revoke меняет статус существующей. Поэтому для CN действует последняя строка.
+
+PKI_INDEX_FILE = "/etc/openvpn/easyrsa3/pki/index.txt"
+SERVER_CN = "antizapret-server"
+
+CertEntry = namedtuple("CertEntry", "status not_after revoked_at serial")
+
+
+def _parse_time(text):
+    text = text.strip()
+    if not text:
+        return None
+    if len(text) == 13:  # UTCTime: YYMMDDHHMMSSZ
+        year = int(text[:2])
+        text = ("19" if year >= 50 else "20") + text
+    return datetime.strptime(text, "%Y%m%d%H%M%SZ").replace(tzinfo=timezone.utc)
+
+
+def _subject_cn(subject):
+    for part in subject.split("/"):
+        if part.startswith("CN="):
+            return part[3:]
+    return None
+
+
+def parse_index_line(line):
+    """(CN, CertEntry) для строки index.txt или None, если строка не разбирается."""
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) < 6 or fields[0] not in ("V", "R", "E"):
+        return None
+    cn = _subject_cn(fields[5])
+    if not cn:
+        return None
+    try:
+        not_after = _parse_time(fields[1])
+        revoked_at = _parse_time(fields[2].split(",", 1)[0]) if fields[0] == "R" else None
+    except ValueError:
+        return None
+    return cn, CertEntry(fields[0], not_after, revoked_at, fields[3])
+
+
+class PkiIndex:
+    """
+    Сроки и статусы всех сертификатов из одного чтения pki/index.txt.
+    Файл перечитывается только при смене (inode, mtime, size); уже разобранные
+    строки берутся из кэша, так что после выпуска/отзыва разбираются только новые.
+    """
+
+    def __init__(self, path=PKI_INDEX_FILE, check_interval=1.0, exclude=(SERVER_CN,)):
+        self.path = path
+        self.check_interval = check_interval
+        self.exclude = set(exclude)
+        self.entries = {}       # CN -> CertEntry (по последней строке)
+        self._lines = {}        # строка -> результат parse_index_line
+        self._sig = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return os.path.exists(self.path)
+
+    def refresh(self, force=False):
+        """
+        Перечитывает index.txt, если он изменился. Возвращает множество CN, у которых что-то поменялось.
+        Без force файл проверяется не чаще раза в check_interval.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.check_interval:
+                return set()
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                if self._sig is None:
+                    return set()
+                changed = set(self.entries)
+                self.entries, self._lines, self._sig = {}, {}, None
+                return changed
+            sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if sig == self._sig:
+                return set()
+            try:
+                with open(self.path, encoding="utf-8", errors="replace") as f:
+                    lines = f.readlines()
+            except OSError as e:
+                logging.warning(f"Cannot read {self.path}: {e}")
+                return set()
+
+            parsed_lines = {}
+            entries = {}
+            for line in lines:
+                parsed = self._lines.get(line)
+                if parsed is None and line not in self._lines:
+                    parsed = parse_index_line(line)
+                parsed_lines[line] = parsed
+                if parsed is not None and parsed[0] not in self.exclude:
+                    entries[parsed[0]] = parsed[1]
+
+            old = self.entries
+            changed = {cn for cn in old.keys() | entries.keys() if old.get(cn) != entries.get(cn)}
+            self.entries, self._lines, self._sig = entries, parsed_lines, sig
+            if changed:
+                logging.info(f"PKI index refreshed: {len(entries)} certificates, {len(changed)} changed.")
+            return changed
+
+    def _current(self):
+        self.refresh()
+        return self.entries
+
+    def get(self, cn):
+        return self._current().get(cn)
+
+    def valid(self):
+        """CN с действующей (не отозванной) записью, отсортированные как `LC_ALL=C sort`."""
+        return sorted(cn for cn, e in self._current().items() if e.status == "V")
+
+    def revoked(self):
+        return {cn for cn, e in self._current().items() if e.status == "R"}
+
+    def expiry_dates(self):
+        """{CN: notAfter} для всех действующих сертификатов."""
+        return {cn: e.not_after for cn, e in self._current().items() if e.status == "V" and e.not_after}
+
+    def all_days_left(self, now=None):
+        """{CN: дней до окончания} для всех действующих сертификатов."""
+        now = now or datetime.now(timezone.utc)
+        return {
+            cn: (e.not_after - now).days
+            for cn, e in self._current().items()
+            if e.status == "V" and e.not_after is not None
+        }
+
+    def expiring(self, within_days, now=None):
+        """{CN: дней до окончания} для действующих сертификатов, истекающих в ближайшие within_days дней."""
+        return {cn: d for cn, d in self.all_days_left(now).items() if 0 <= d <= within_days}
+
+    def expired(self, now=None):
+        """CN, срок которых уже вышел, но которые ещё не отозваны."""
+        return {cn for cn, d in self.all_days_left(now).items() if d < 0}
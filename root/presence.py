@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from ovpn_mgmt import ManagementError
+from ovpn_status import status_file, parse_status, sessions_by_client, status_cache
+
+# Кто сейчас подключён к OpenVPN — таблица сессий в памяти, обновляемая опросом:
+#   1) `status 2` по management-сокету — живой список, а не снимок раз в 30 с;
+#      им таблица заполняется при подключении и обновляется раз в poll_interval;
+#   2) status-файл экземпляра, если management-сокета нет.
+# События >CLIENT:CONNECT/DISCONNECT OpenVPN шлёт только с management-client-auth,
+# а тогда каждое подключение ждёт ответа бота — в конфигах серверов он не включён.
+# Обработчики бота читают только память и никакого I/O не делают.
+
+
+class Presence:
+    """
+    Живая таблица сессий OpenVPN: (экземпляр, ключ сессии) -> сессия.
+    Ключ — CID из management или «CN@адрес», если сессия взята из status-файла.
+    """
+
+    def __init__(self, pool, poll_interval=15.0):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.sessions = {}        # instance -> {key: session}
+        self.sources = {}         # instance -> "management" | "file" | None (последнее чтение не удалось)
+        pool.add_on_connect(self._bootstrap)
+
+    # ---------- чтение (без I/O) ----------
+
+    def online(self):
+        """{CN: "OpenVPN"} для всех подключённых клиентов."""
+        return {
+            s["cn"]: "OpenVPN"
+            for table in self.sessions.values()
+            for s in table.values()
+            if s["cn"]
+        }
+
+    def sessions_for(self, cn):
+        return [
+            dict(s, instance=instance)
+            for instance, table in self.sessions.items()
+            for s in table.values()
+            if s["cn"] == cn
+        ]
+
+    def all_sessions(self):
+        """{CN: [сессии]} сразу для всех клиентов."""
+        return sessions_by_client({instance: list(table.values()) for instance, table in self.sessions.items()})
+
+    def traffic(self, cn):
+        """(байт принято сервером, байт отправлено сервером) по текущим сессиям CN."""
+        received = sent = 0
+        for s in self.sessions_for(cn):
+            received += s["bytes_received"]
+            sent += s["bytes_sent"]
+        return received, sent
+
+    # ---------- полная сверка ----------
+
+    async def _bootstrap(self, session):
+        await self._refresh_instance(session.name, session)
+
+    async def _refresh_instance(self, instance, session):
+        if session is not None and session.connected:
+            try:
+                lines = await session.command("status 2", multiline=True)
+                self._replace(instance, parse_status(lines), "management")
+                return
+            except (OSError, asyncio.TimeoutError, ManagementError) as e:
+                logging.warning(f"Presence {instance}: status via management failed: {e}")
+        # снимок файла кэшируется по (mtime, size) — неизменный файл повторно не разбирается
+        sessions = await asyncio.to_thread(status_cache.read, status_file(instance))
+        self._replace(instance, sessions or [], "file" if sessions is not None else None)
+
+    def _replace(self, instance, sessions, source):
+        table = {}
+        for session in sessions:
+            key = session["client_id"] or f"{session['cn']}@{session['real_address']}"
+            table[key] = dict(session)
+        self.sessions[instance] = table
+        self.sources[instance] = source
+
+    async def refresh(self):
+        await asyncio.gather(*(
+            self._refresh_instance(name, session) for name, session in self.pool.sessions.items()
+        ))
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Presence refresh failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
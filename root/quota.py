@@ -0,0 +1,193 @@
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+
+from db import get_db
+
+# Квоты трафика на клиента: лимит байт (↓ + ↑) за календарный месяц
+# или за скользящее окно из window_days последних дней.
+# Использование держится в памяти и пополняется приращениями TrafficCollector
+# (listeners) — после старта ни свёртки, ни клиенты без трафика повторно не читаются.
+# Порог warn_ratio (80%) — предупреждение, 100% — приостановка (отзыв доступа).
+# Отметки о предупреждении/приостановке снимаются, когда использование опускается
+# ниже порога предупреждения (новый месяц, окно сдвинулось) или админ меняет квоту.
+
+PERIOD_MONTH = "month"
+PERIOD_ROLLING = "rolling"
+WARN_RATIO = 0.8
+MAX_LIMIT_GB = 1024 * 1024  # 1 ПБ: в байтах заведомо помещается в INTEGER SQLite
+
+SQL_ALL_QUOTAS = "SELECT cn, limit_bytes, period, window_days, warned_at, suspended_at FROM quotas"
+SQL_SAVE_QUOTA = (
+    "INSERT OR REPLACE INTO quotas (cn, limit_bytes, period, window_days, warned_at, suspended_at) "
+    "VALUES (?, ?, ?, ?, NULL, NULL)"
+)
+SQL_DELETE_QUOTA = "DELETE FROM quotas WHERE cn = ?"
+SQL_MONTH_USAGE = "SELECT rx + tx FROM traffic_monthly WHERE cn = ? AND period = ?"
+SQL_DAILY_USAGE = "SELECT period, rx + tx FROM traffic_daily WHERE cn = ? AND period >= ?"
+
+
+def _month_key(now):
+    return now.strftime("%Y-%m")
+
+
+def _day_key(now):
+    return now.strftime("%Y-%m-%d")
+
+
+def _window_start(now, window_days):
+    return _day_key(now - timedelta(days=window_days - 1))
+
+
+class QuotaEngine:
+    """
+    Квоты в памяти: CN -> {"limit", "period", "window_days", "warned", "suspended"}.
+    on_warn(cn, used, limit) и on_exceed(cn, used, limit) — корутины бота; возвращают True,
+    если предупреждение отправлено / доступ снят, — тогда это отмечается в таблице quotas.
+    При False событие повторится со следующим приращением трафика клиента.
+    """
+
+    def __init__(self, on_warn, on_exceed, warn_ratio=WARN_RATIO):
+        self.on_warn = on_warn
+        self.on_exceed = on_exceed
+        self.warn_ratio = warn_ratio
+        self.quotas = {}
+        self._month = {}          # CN -> [месяц, байт] для месячных квот
+        self._days = {}           # CN -> {день: байт} для скользящего окна
+
+    # ---------- загрузка ----------
+
+    def _load_usage(self, cn, quota, now):
+        db = get_db()
+        if quota["period"] == PERIOD_ROLLING:
+            rows = db.fetch_all(SQL_DAILY_USAGE, (cn, _window_start(now, quota["window_days"])))
+            self._days[cn] = {row[0]: row[1] for row in rows}
+            self._month.pop(cn, None)
+        else:
+            row = db.fetch_one(SQL_MONTH_USAGE, (cn, _month_key(now)))
+            self._month[cn] = [_month_key(now), row[0] if row else 0]
+            self._days.pop(cn, None)
+
+    def load(self, now=None):
+        now = now or datetime.now()
+        self.quotas = {}
+        for cn, limit_bytes, period, window_days, warned_at, suspended_at in get_db().fetch_all(SQL_ALL_QUOTAS):
+            self.quotas[cn] = {
+                "limit": limit_bytes,
+                "period": period,
+                "window_days": window_days,
+                "warned": warned_at is not None,
+                "suspended": suspended_at is not None,
+            }
+        for cn, quota in self.quotas.items():
+            self._load_usage(cn, quota, now)
+
+    # ---------- чтение (без I/O) ----------
+
+    def used(self, cn, now=None):
+        """Байт за текущий период квоты CN (0, если квоты нет)."""
+        quota = self.quotas.get(cn)
+        if quota is None:
+            return 0
+        now = now or datetime.now()
+        if quota["period"] == PERIOD_ROLLING:
+            start = _window_start(now, quota["window_days"])
+            days = self._days.setdefault(cn, {})
+            for day in [day for day in days if day < start]:
+                del days[day]
+            return sum(days.values())
+        month = self._month.setdefault(cn, [_month_key(now), 0])
+        if month[0] != _month_key(now):
+            month[:] = [_month_key(now), 0]
+        return month[1]
+
+    def get(self, cn):
+        """Квота CN с текущим использованием или None."""
+        quota = self.quotas.get(cn)
+        if quota is None:
+            return None
+        return dict(quota, used=self.used(cn))
+
+    # ---------- изменение администратором ----------
+
+    async def set_quota(self, cn, limit_bytes, period=PERIOD_MONTH, window_days=30):
+        """Ставит (или заменяет) квоту и сразу проверяет по уже накопленному трафику."""
+        quota = {
+            "limit": int(limit_bytes),
+            "period": period,
+            "window_days": int(window_days),
+            "warned": False,
+            "suspended": False,
+        }
+        db = get_db()
+        now = datetime.now()
+        await db.execute_async(SQL_SAVE_QUOTA, (cn, quota["limit"], period, quota["window_days"]))
+        await db.run(self._load_usage, cn, quota, now)
+        self.quotas[cn] = quota
+        await self._check(cn, now)
+
+    async def remove_quota(self, cn):
+        await get_db().execute_async(SQL_DELETE_QUOTA, (cn,))
+        self.quotas.pop(cn, None)
+        self._month.pop(cn, None)
+        self._days.pop(cn, None)
+
+    # ---------- приращения трафика ----------
+
+    async def on_traffic(self, deltas):
+        """Слушатель TrafficCollector: {CN: (rx, tx)} за последний снимок."""
+        now = datetime.now()
+        for cn, (rx, tx) in deltas.items():
+            if cn not in self.quotas:
+                continue
+            self.used(cn, now)  # сбросить месяц / сдвинуть окно
+            if self.quotas[cn]["period"] == PERIOD_ROLLING:
+                days = self._days[cn]
+                days[_day_key(now)] = days.get(_day_key(now), 0) + rx + tx
+            else:
+                self._month[cn][1] += rx + tx
+            await self._check(cn, now)
+
+    async def _mark(self, cn, column, value):
+        try:
+            await get_db().execute_async(f"UPDATE quotas SET {column} = ? WHERE cn = ?", (value, cn))
+        except sqlite3.Error as e:
+            logging.error(f"Quota: cannot save {column} for {cn}: {e}")
+
+    async def _check(self, cn, now):
+        quota = self.quotas.get(cn)
+        if quota is None:
+            return
+        used = self.used(cn, now)
+        limit = quota["limit"]
+
+        if used < limit * self.warn_ratio:
+            # новый период или окно сдвинулось — пороги снова действуют
+            if quota["warned"] or quota["suspended"]:
+                quota["warned"] = quota["suspended"] = False
+                await self._mark(cn, "warned_at", None)
+                await self._mark(cn, "suspended_at", None)
+            return
+
+        if used >= limit and not quota["suspended"]:
+            quota["suspended"] = True  # до await, чтобы следующий снимок не запустил отзыв повторно
+            try:
+                done = await self.on_exceed(cn, used, limit)
+            except Exception as e:
+                logging.error(f"Quota: suspending {cn} failed: {e}")
+                done = False
+            if done:
+                await self._mark(cn, "suspended_at", now.isoformat(timespec="seconds"))
+            elif cn in self.quotas:
+                quota["suspended"] = False
+        elif not quota["warned"] and not quota["suspended"]:
+            quota["warned"] = True
+            try:
+                done = await self.on_warn(cn, used, limit)
+            except Exception as e:
+                logging.error(f"Quota: warning {cn} failed: {e}")
+                done = False
+            if done:
+                await self._mark(cn, "warned_at", now.isoformat(timespec="seconds"))
+            elif cn in self.quotas:
+                quota["warned"] = False
@@ -0,0 +1,266 @@
+import os
+import re
+import sys
+import json
+import time
+import errno
+import ctypes
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from render import Renderer, RenderError, CLIENT_DIR, CLIENT_KEYS_DIR, OPENVPN_PROFILES, WIREGUARD_PROFILES
+from wgconf import WG_CONFIGS, WgServerConfig
+from db import init_db, DEFAULT_DB_PATH
+from artifacts import replace_artifacts
+
+# Пересоздание профилей всех клиентов (client.sh, пункт 7).
+# Профили рендерятся параллельно в пуле процессов (по умолчанию — по ядру на процесс)
+# в каталог рядом с рабочим, /root/antizapret/client.new. Когда отрендерены все
+# клиенты, каталоги меняются местами одним renameat2(RENAME_EXCHANGE), так что
+# профили можно скачивать всё время пересоздания: до обмена отдаются старые файлы,
+# после — новые. Если ядро или ФС обмен не умеют — два rename подряд.
+# Если хотя бы один клиент не отрендерился, рабочий каталог не трогается.
+#
+# Пересоздание инкрементальное: в .manifest.json каталога профилей для каждого файла
+# записан хэш его входов (шаблон, CA, сертификат и ключ клиента, ключи WireGuard,
+# FILEVPN_NAME, адрес сервера и прочие переменные шаблона). Файл, входы которого
+# не изменились, не рендерится, а переносится в новый каталог жёсткой ссылкой.
+# --full рендерит всё заново.
+# После подмены каталога реестр файлов клиентов (artifacts.py) записывается целиком.
+#
+# Прогресс — строки `[готово/всего] ...` в stdout, их читает бот.
+#
+# Из client.sh (после initOpenVPN/initWireGuard и с экспортированными переменными шаблонов):
+#   python3 /root/recreate.py [--full] [--jobs N]
+
+EASYRSA_PKI_DIR = "/etc/openvpn/easyrsa3/pki"
+SERVER_CN = "antizapret-server"
+CLIENT_NAME_RE = re.compile(r"[a-zA-Z0-9_-]{1,32}")
+
+MANIFEST_FILE = ".manifest.json"
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 1 << 1
+
+OPENVPN = "OpenVPN"
+WIREGUARD = "WireGuard/AmneziaWG"
+
+
+def exchange(a, b):
+    """Атомарно меняет местами два пути. False, если renameat2 с RENAME_EXCHANGE недоступен."""
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    if renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+        return False
+    raise OSError(err, os.strerror(err), a)
+
+
+def swap_in(staging, target):
+    """Ставит staging на место target; старое содержимое target удаляется."""
+    if not os.path.exists(target):
+        os.rename(staging, target)
+        return
+    if exchange(staging, target):
+        shutil.rmtree(staging)
+        return
+    old = f"{target}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    os.rename(target, old)
+    os.rename(staging, target)
+    shutil.rmtree(old)
+
+
+def prepare_staging(target, staging):
+    """Пустой каталог со структурой подкаталогов target и каталогами всех профилей."""
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    if os.path.isdir(target):
+        shutil.copymode(target, staging)
+    for root, dirs, _ in os.walk(target):
+        for name in dirs:
+            os.makedirs(os.path.join(staging, os.path.relpath(os.path.join(root, name), target)), exist_ok=True)
+    for profiles in (OPENVPN_PROFILES, *WIREGUARD_PROFILES.values()):
+        for _, path in profiles:
+            os.makedirs(os.path.join(staging, os.path.dirname(path)), exist_ok=True)
+
+
+def load_manifest(target):
+    """{путь профиля: digest} прошлого пересоздания; пустой, если манифеста нет или он битый."""
+    try:
+        with open(os.path.join(target, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(directory, manifest):
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=0, sort_keys=True)
+
+
+def tree_files(directory):
+    """Пути всех файлов каталога относительно него, кроме манифеста."""
+    files = set()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            files.add(os.path.relpath(os.path.join(root, name), directory))
+    files.discard(MANIFEST_FILE)
+    return files
+
+
+def openvpn_clients():
+    """Клиенты с сертификатом в pki/issued — как `ls pki/issued` в client.sh."""
+    try:
+        files = os.listdir(os.path.join(EASYRSA_PKI_DIR, "issued"))
+    except FileNotFoundError:
+        return []
+    names = (f[:-4] if f.endswith(".crt") else f for f in files)
+    return sorted(name for name in names if name != SERVER_CN)
+
+
+def wireguard_clients():
+    """{имя: {интерфейс: WgClient}} по серверным конфигам."""
+    clients = {}
+    for interface, path in WG_CONFIGS.items():
+        try:
+            config = WgServerConfig.load(path)
+        except FileNotFoundError:
+            continue
+        for name, client in config.clients.items():
+            clients.setdefault(name, {})[interface] = client
+    return dict(sorted(clients.items()))
+
+
+_renderer = None
+
+
+def _init_worker(environ, client_dir, previous_dir, manifest):
+    global _renderer
+    _renderer = Renderer(environ, client_dir, previous_dir, manifest)
+
+
+def _ensure_client_keys(name):
+    """Ключи клиента в /etc/openvpn/client/keys — как в addOpenVPN."""
+    crt = os.path.join(CLIENT_KEYS_DIR, f"{name}.crt")
+    key = os.path.join(CLIENT_KEYS_DIR, f"{name}.key")
+    if not (os.path.isfile(crt) and os.path.isfile(key)):
+        shutil.copyfile(os.path.join(EASYRSA_PKI_DIR, "issued", f"{name}.crt"), crt)
+        shutil.copyfile(os.path.join(EASYRSA_PKI_DIR, "private", f"{name}.key"), key)
+
+
+def render_openvpn(name, server_host):
+    _ensure_client_keys(name)
+    return _renderer.openvpn(name, SERVER_HOST=server_host)
+
+
+def render_wireguard(name, server_host, interfaces):
+    written = []
+    for interface, client in interfaces.items():
+        if not (client.private_key and client.allowed_ips):
+            raise RenderError(f"{WG_CONFIGS[interface]}: no PrivateKey/AllowedIPs for client '{name}'")
+        written += _renderer.wireguard(
+            interface, name,
+            SERVER_HOST=server_host,
+            CLIENT_IP=client.allowed_ips.split(",")[0].strip().split("/")[0],
+            CLIENT_PRIVATE_KEY=client.private_key,
+            CLIENT_PUBLIC_KEY=client.public_key,
+            CLIENT_PRESHARED_KEY=client.preshared_key or "",
+        )
+    return written
+
+
+def recreate(jobs=None, target=CLIENT_DIR, environ=None, out=sys.stdout, full=False):
+    """
+    Рендерит профили всех клиентов (с неизменившимися входами — только ссылки на старые
+    файлы) и подменяет ими target. Возвращает число ошибок.
+    """
+    environ = dict(os.environ if environ is None else environ)
+    if not environ.get("FILEVPN_NAME"):
+        print("FILEVPN_NAME is not set! No profile files recreated", file=sys.stderr, flush=True)
+        return 1
+    server_ip = environ.get("SERVER_IP", "")
+    openvpn_host = environ.get("OPENVPN_HOST") or server_ip
+    wireguard_host = environ.get("WIREGUARD_HOST") or server_ip
+
+    tasks = []
+    for name in openvpn_clients():
+        tasks.append((OPENVPN, name, render_openvpn, (name, openvpn_host)))
+    for name, interfaces in wireguard_clients().items():
+        tasks.append((WIREGUARD, name, render_wireguard, (name, wireguard_host, interfaces)))
+
+    valid = []
+    for kind, name, func, args in tasks:
+        if CLIENT_NAME_RE.fullmatch(name):
+            valid.append((kind, name, func, args))
+        else:
+            print(f"{kind} client name '{name}' is invalid! No profile files recreated", file=out, flush=True)
+
+    staging = f"{target}.new"
+    prepare_staging(target, staging)
+    started = time.monotonic()
+    jobs = jobs or os.cpu_count() or 1
+    manifest = {} if full else load_manifest(target)
+    new_manifest = {}
+    artifacts = {}
+    rebuilt = unchanged = failed = 0
+    initargs = (environ, staging, target, manifest)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as pool:
+        futures = {pool.submit(func, *args): (kind, name) for kind, name, func, args in valid}
+        for done, future in enumerate(as_completed(futures), 1):
+            kind, name = futures[future]
+            try:
+                written = future.result()
+            except (RenderError, OSError) as e:
+                failed += 1
+                print(f"[{done}/{len(valid)}] {kind} profile files NOT recreated for client '{name}': {e}",
+                      file=sys.stderr, flush=True)
+                continue
+            for path, digest, fresh in written:
+                new_manifest[path] = digest
+                artifacts.setdefault(name, []).append(path)
+                rebuilt += fresh
+                unchanged += not fresh
+            state = "recreated" if any(fresh for _, _, fresh in written) else "unchanged"
+            print(f"[{done}/{len(valid)}] {kind} profile files {state} for client '{name}'", file=out, flush=True)
+
+    if failed:
+        shutil.rmtree(staging, ignore_errors=True)
+        print(f"{failed} client(s) failed, profile files at {target} left unchanged", file=sys.stderr, flush=True)
+        return failed
+    removed = len(tree_files(target) - set(new_manifest)) if os.path.isdir(target) else 0
+    save_manifest(staging, new_manifest)
+    swap_in(staging, target)
+    try:
+        replace_artifacts(artifacts)
+    except sqlite3.Error as e:
+        print(f"Artifact registry not updated: {e}", file=sys.stderr, flush=True)
+    print(f"{len(valid)} clients: {rebuilt} profile files rebuilt, {unchanged} unchanged, {removed} removed "
+          f"in {time.monotonic() - started:.1f}s ({jobs} workers)", file=out, flush=True)
+    return 0
+
+
+def main(argv):
+    args = argv[1:]
+    full = "--full" in args
+    if full:
+        args.remove("--full")
+    jobs = None
+    if len(args) == 2 and args[0] == "--jobs" and args[1].isdigit() and int(args[1]) > 0:
+        jobs = int(args[1])
+    elif args:
+        print(f"Usage: {argv[0]} [--full] [--jobs N]", file=sys.stderr)
+        return 2
+    init_db(DEFAULT_DB_PATH)
+    return 1 if recreate(jobs, full=full) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import hashlib
+
+# Рендер шаблонов профилей — замена функции render() из client.sh с тем же результатом
+# байт в байт. Правила bash-версии:
+#   - шаблон читается `while read -r line`: последняя строка без перевода строки теряется;
+#   - в строке ищется первая ${VAR}, все её вхождения заменяются значением, поиск
+#     повторяется по уже заменённой строке (так подставляются и ${...} из значений);
+#   - значение — результат `$(eval echo "\"${VAR}\"")`: хвостовые переводы строк
+#     срезаются, неопределённая переменная — пустая строка;
+#   - строка выводится `echo "$line"`.
+# Значения с '&' и '\' подставляются буквально (как bash до 5.2 без patsub_replacement).
+#
+# Шаблоны разбираются один раз за запуск, CA — тоже, поэтому пересоздание всех
+# клиентов (recreate.py) и выдача профилей одному клиенту читают их по разу.
+#
+# Из client.sh:
+#   export $(python3 /root/render.py vars)     — переменные, которые нужны шаблонам
+#   python3 /root/render.py openvpn            — все шесть профилей OpenVPN клиента
+#   python3 /root/render.py wireguard <интерфейс>
+#   python3 /root/render.py file <шаблон>      — один шаблон в stdout, как render()
+
+VAR_RE = re.compile(r"\$\{([a-zA-Z_][a-zA-Z_0-9]*)\}")
+MAX_PASSES = 10000
+
+OPENVPN_TEMPLATES_DIR = "/etc/openvpn/client/templates"
+WIREGUARD_TEMPLATES_DIR = "/etc/wireguard/templates"
+CLIENT_DIR = "/root/antizapret/client"
+CA_CERT_FILE = "/etc/openvpn/server/keys/ca.crt"
+CLIENT_KEYS_DIR = "/etc/openvpn/client/keys"
+
+# (шаблон, файл профиля) — пути в тех же ${VAR}, что и в client.sh
+OPENVPN_PROFILES = (
+    ("antizapret-udp.conf", "openvpn/antizapret-udp/antizapret-${FILE_NAME}-udp.ovpn"),
+    ("antizapret-tcp.conf", "openvpn/antizapret-tcp/antizapret-${FILE_NAME}-tcp.ovpn"),
+    ("antizapret.conf", "openvpn/antizapret/${FILEVPN_NAME} - ${FILE_NAME}.ovpn"),
+    ("vpn-udp.conf", "openvpn/vpn-udp/vpn-${FILE_NAME}-udp.ovpn"),
+    ("vpn-tcp.conf", "openvpn/vpn-tcp/vpn-${FILE_NAME}-tcp.ovpn"),
+    ("vpn.conf", "openvpn/vpn/${FILEVPN_NAME} - Обычный VPN - ${FILE_NAME}.ovpn"),
+)
+WIREGUARD_PROFILES = {
+    "antizapret": (
+        ("antizapret-client-wg.conf", "wireguard/antizapret/${FILEVPN_NAME} -${FILE_NAME}.conf"),
+        ("antizapret-client-am.conf", "amneziawg/antizapret/${FILEVPN_NAME} -${FILE_NAME}.conf"),
+    ),
+    "vpn": (
+        ("vpn-client-wg.conf", "wireguard/vpn/${FILEVPN_NAME} - Обычный VPN -${FILE_NAME}.conf"),
+        ("vpn-client-am.conf", "amneziawg/vpn/${FILEVPN_NAME} - Обычный VPN -${FILE_NAME}.conf"),
+    ),
+}
+
+
+class RenderError(Exception):
+    pass
+
+
+def echo(text):
+    """Вывод `echo "$text"`: единственный аргумент вида -n/-e/-E bash считает опцией."""
+    if re.fullmatch(r"-[neE]+", text):
+        return "" if "n" in text else "\n"
+    return text + "\n"
+
+
+def substitute(line, context):
+    """Подстановки в одной строке шаблона — тем же циклом, что и в render()."""
+    passes = 0
+    while True:
+        match = VAR_RE.search(line)
+        if match is None:
+            return line
+        passes += 1
+        if passes > MAX_PASSES:
+            raise RenderError(f"recursive substitution of {match.group(0)}")
+        value = echo(context.get(match.group(1), "")).rstrip("\n")
+        line = line.replace(match.group(0), value)
+
+
+class Template:
+    """Шаблон, разобранный один раз: строки без переменных выводятся как есть."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, encoding="utf-8", errors="surrogateescape", newline="") as f:
+            text = f.read()
+        self.sha256 = hashlib.sha256(text.encode("utf-8", "surrogateescape")).digest()
+        lines = text.split("\n")
+        lines.pop()  # после последнего \n — хвост без перевода строки, read его не отдаёт
+        self.lines = [(line, VAR_RE.search(line) is not None) for line in lines]
+        self.variables = {name for line, _ in self.lines for name in VAR_RE.findall(line)}
+
+    def render(self, context):
+        return "".join(echo(substitute(line, context) if has_vars else line) for line, has_vars in self.lines)
+
+    def digest(self, context):
+        """
+        Хэш всего, от чего зависит вывод: текст шаблона и значения его переменных,
+        включая переменные, которые подставятся из самих значений.
+        """
+        names, pending = set(), list(self.variables)
+        while pending:
+            name = pending.pop()
+            if name not in names:
+                names.add(name)
+                pending.extend(VAR_RE.findall(context.get(name, "")))
+        h = hashlib.sha256(self.sha256)
+        for name in sorted(names):
+            h.update(f"{name}\0{context.get(name, '')}\0".encode("utf-8", "surrogateescape"))
+        return h.hexdigest()
+
+
+def grep_after(path, pattern, after=999):
+    """`grep -A <after> <pattern> -- path` в подстановке $(...) — с отрезанными хвостовыми \\n."""
+    with open(path, encoding="utf-8", errors="surrogateescape") as f:
+        lines = f.read().split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    out = []
+    last_match = None
+    last_printed = None
+    for i, line in enumerate(lines):
+        if pattern in line:
+            last_match = i
+        if last_match is not None and i - last_match <= after:
+            if last_printed is not None and last_printed != i - 1:
+                out.append("--")
+            out.append(line)
+            last_printed = i
+    return "\n".join(out).rstrip("\n")
+
+
+def read_stripped(path):
+    """`$(cat -- path)`."""
+    with open(path, encoding="utf-8", errors="surrogateescape") as f:
+        return f.read().rstrip("\n")
+
+
+class Renderer:
+    """
+    Шаблоны и CA на один запуск; контекст — переменные окружения плюс значения клиента.
+    Профили пишутся в client_dir (recreate.py рендерит во временный каталог).
+    Если заданы previous_dir и manifest ({путь профиля: digest входов}), профиль с теми же
+    входами не рендерится, а берётся из previous_dir жёсткой ссылкой.
+    """
+
+    def __init__(self, environ=None, client_dir=CLIENT_DIR, previous_dir=None, manifest=None):
+        self.environ = dict(os.environ if environ is None else environ)
+        self.client_dir = client_dir
+        self.previous_dir = previous_dir
+        self.manifest = manifest or {}
+        self._templates = {}
+        self._ca_cert = None
+
+    def template(self, path):
+        template = self._templates.get(path)
+        if template is None:
+            template = self._templates[path] = Template(path)
+        return template
+
+    def render(self, path, context):
+        return self.template(path).render(context)
+
+    @property
+    def ca_cert(self):
+        if self._ca_cert is None:
+            self._ca_cert = grep_after(CA_CERT_FILE, "BEGIN CERTIFICATE")
+        return self._ca_cert
+
+    def context(self, **values):
+        context = dict(self.environ)
+        context.update(values)
+        return context
+
+    def _reuse(self, name, digest, path):
+        if self.previous_dir is None or self.manifest.get(name) != digest:
+            return False
+        try:
+            os.link(os.path.join(self.previous_dir, name), path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, profiles, templates_dir, context):
+        """[(путь профиля относительно client_dir, digest, отрендерен ли заново)]."""
+        if not context.get("FILEVPN_NAME"):
+            raise RenderError("FILEVPN_NAME is not set!")
+        written = []
+        for template, target in profiles:
+            name = substitute(target, context)
+            path = os.path.join(self.client_dir, name)
+            template = self.template(os.path.join(templates_dir, template))
+            digest = template.digest(context)
+            if self._reuse(name, digest, path):
+                written.append((name, digest, False))
+                continue
+            with open(path, "w", encoding="utf-8", errors="surrogateescape", newline="") as f:
+                f.write(template.render(context))
+            written.append((name, digest, True))
+        return written
+
+    def openvpn(self, client_name, **values):
+        """Все профили OpenVPN клиента из одного контекста."""
+        context = self.context(CLIENT_NAME=client_name, FILE_NAME=client_name, **values)
+        try:
+            context["CA_CERT"] = self.ca_cert
+            context["CLIENT_CERT"] = grep_after(os.path.join(CLIENT_KEYS_DIR, f"{client_name}.crt"), "BEGIN CERTIFICATE")
+            context["CLIENT_KEY"] = read_stripped(os.path.join(CLIENT_KEYS_DIR, f"{client_name}.key"))
+        except OSError as e:
+            raise RenderError(f"Can't load client keys! {e}")
+        if not (context["CA_CERT"] and context["CLIENT_CERT"] and context["CLIENT_KEY"]):
+            raise RenderError("Can't load client keys!")
+        return self._write(OPENVPN_PROFILES, OPENVPN_TEMPLATES_DIR, context)
+
+    def wireguard(self, interface, client_name, **values):
+        """Профили WireGuard и AmneziaWG клиента для одного интерфейса."""
+        context = self.context(CLIENT_NAME=client_name, FILE_NAME=client_name, **values)
+        return self._write(WIREGUARD_PROFILES[interface], WIREGUARD_TEMPLATES_DIR, context)
+
+    def variables(self):
+        """Имена переменных всех шаблонов профилей."""
+        names = set()
+        for templates_dir, profiles in (
+            (OPENVPN_TEMPLATES_DIR, OPENVPN_PROFILES),
+            *((WIREGUARD_TEMPLATES_DIR, p) for p in WIREGUARD_PROFILES.values()),
+        ):
+            for template, target in profiles:
+                names |= set(VAR_RE.findall(target))
+                try:
+                    names |= self.template(os.path.join(templates_dir, template)).variables
+                except OSError:
+                    pass
+        return sorted(names)
+
+
+def main(argv):
+    command, args = (argv[1], argv[2:]) if len(argv) > 1 else (None, [])
+    renderer = Renderer()
+    client_name = renderer.environ.get("CLIENT_NAME", "")
+    try:
+        if command == "vars" and not args:
+            print(" ".join(renderer.variables()))
+        elif command == "openvpn" and not args:
+            renderer.openvpn(client_name)
+        elif command == "wireguard" and len(args) == 1 and args[0] in WIREGUARD_PROFILES:
+            renderer.wireguard(args[0], client_name)
+        elif command == "file" and len(args) == 1:
+            sys.stdout.buffer.write(renderer.render(args[0], renderer.context()).encode("utf-8", "surrogateescape"))
+        else:
+            print(f"Usage: {argv[0]} vars | openvpn | wireguard <interface> | file <template>", file=sys.stderr)
+            return 2
+    except RenderError as e:
+        print(e, file=sys.stderr)
+        return 11
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
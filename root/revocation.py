@@ -0,0 +1,191 @@
+import os
+import asyncio
+import logging
+import subprocess
+
+from wgconf import WG_CONFIGS, wg_index, edit
+from wgpool import WgPool
+from wgsync import remove_peer, request_sync
+
+# Пакетный отзыв клиентов. Каждый сертификат отзывается своим `easyrsa revoke`,
+# но всё дорогое делается один раз на пачку: gen-crl, установка CRL
+# и перезапись конфига каждого интерфейса WireGuard (peer'ы снимаются с интерфейса
+# сразу через `wg set`, полная сверка syncconf — отложенная, см. wgsync.py).
+# Уже подключённые сессии отозванных клиентов OpenVPN отключает колбэк disconnect
+# (management-интерфейс OpenVPN).
+
+EASYRSA_DIR = "/etc/openvpn/easyrsa3"
+EASYRSA = "/usr/share/easy-rsa/easyrsa"
+CRL_SRC = os.path.join(EASYRSA_DIR, "pki", "crl.pem")
+CRL_DST = "/etc/openvpn/server/keys/crl.pem"
+CLIENT_KEYS_DIR = "/etc/openvpn/client/keys"
+SCRIPT_PATH_ENV = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+
+
+def _run(args, **kwargs):
+    env = os.environ.copy()
+    env["PATH"] = SCRIPT_PATH_ENV
+    env.update(kwargs.pop("env", {}))
+    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env, **kwargs)
+
+
+def _last_line(text):
+    lines = [line for line in (text or "").strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+def remove_wg_clients(conf_path, names):
+    """
+    Удаляет из конфига сервера блоки `# Client = <имя>` ... `AllowedIPs` для всех names
+    одной атомарной перезаписью файла. Возвращает множество реально удалённых имён.
+    """
+    if not os.path.exists(conf_path):
+        return set()
+    with edit(conf_path) as config:
+        return {name for name in names if config.remove(name)}
+
+
+def install_crl():
+    """Копирует свежий CRL туда, где его ждёт OpenVPN (атомарно, 0644)."""
+    tmp = f"{CRL_DST}.tmp"
+    with open(CRL_SRC, "rb") as src, open(tmp, "wb") as dst:
+        dst.write(src.read())
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, CRL_DST)
+
+
+def revoke_batch(names):
+    """
+    Отзывает пачку клиентов и возвращает {имя: {"ok", "openvpn", "wireguard", "error"}}.
+    ok — клиент отключён хотя бы в одном из протоколов и ошибок применения нет.
+    """
+    names = list(dict.fromkeys(names))
+    results = {name: {"ok": False, "openvpn": False, "wireguard": False, "error": None} for name in names}
+
+    # 1) OpenVPN: отзыв каждого сертификата
+    revoked = []
+    for name in names:
+        proc = _run([EASYRSA, "--batch", "revoke", name], cwd=EASYRSA_DIR)
+        if proc.returncode == 0:
+            results[name]["openvpn"] = True
+            revoked.append(name)
+            for ext in (".crt", ".key"):
+                try:
+                    os.remove(os.path.join(CLIENT_KEYS_DIR, name + ext))
+                except OSError:
+                    pass
+        else:
+            results[name]["error"] = _last_line(proc.stderr) or _last_line(proc.stdout) or "easyrsa revoke failed"
+
+    # 2) один gen-crl и одна установка CRL на всю пачку (OpenVPN перечитает его сам)
+    crl_error = None
+    if revoked:
+        proc = _run([EASYRSA, "gen-crl"], cwd=EASYRSA_DIR, env={"EASYRSA_CRL_DAYS": "3650"})
+        if proc.returncode != 0:
+            crl_error = f"gen-crl: {_last_line(proc.stderr) or proc.returncode}"
+        else:
+            try:
+                install_crl()
+            except OSError as e:
+                crl_error = f"CRL: {e}"
+        if crl_error is not None:
+            logging.error(f"Revocation batch: {crl_error}")
+
+    # 3) WireGuard: все удаления в одной перезаписи конфига, peer'ы снимаются с интерфейса
+    #    сразу, а syncconf выполняется один раз после серии изменений
+    wg_index.refresh(force=True)
+    peers = {name: wg_index.peers_for(name) for name in names}
+    wg_removed = set()
+    for interface, conf_path in WG_CONFIGS.items():
+        try:
+            removed = remove_wg_clients(conf_path, names)
+        except OSError as e:
+            logging.error(f"Cannot update {conf_path}: {e}")
+            continue
+        if not removed:
+            continue
+        pool = WgPool(interface, conf_path)
+        for name in removed:
+            pool.release(name)
+            keys = [peer.public_key for peer in peers[name] if peer.interface == interface]
+            if all([remove_peer(interface, key) for key in keys]):
+                wg_removed.add(name)
+            else:
+                results[name]["error"] = f"wg set {interface} peer remove failed"
+        request_sync(interface)
+
+    for name, result in results.items():
+        result["wireguard"] = name in wg_removed
+        if result["openvpn"] and crl_error:
+            result["error"] = crl_error
+        elif result["wireguard"] and not result["openvpn"]:
+            result["error"] = None  # клиент был только в WireGuard
+        result["ok"] = (result["openvpn"] or result["wireguard"]) and not result["error"]
+
+    logging.info(
+        f"Revocation batch: {len(names)} requested, {len(revoked)} certificates revoked, "
+        f"{len(wg_removed)} WireGuard clients removed."
+    )
+    return results
+
+
+class RevocationQueue:
+    """
+    Очередь отзыва: revoke() копит запросы window секунд и отдаёт их одной пачкой,
+    revoke_many() — явный пакетный запрос (например, от администратора), выполняется сразу
+    вместе со всем, что уже накопилось. Пачки выполняются по одной, в рабочем потоке.
+    """
+
+    def __init__(self, window=2.0, disconnect=None):
+        self.window = window
+        self.disconnect = disconnect  # корутина (список CN) -> {CN: отключено сессий}
+        self._pending = {}        # имя -> [future, ...]
+        self._timer = None
+        self._lock = None
+
+    async def revoke(self, name):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(name, []).append(future)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def revoke_many(self, names):
+        return await self._run_batch(names)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        # запросы, пришедшие, пока пачка выполняется, заводят новый таймер
+        self._timer = None
+        await self._run_batch()
+
+    async def _run_batch(self, extra=()):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            waiting, self._pending = self._pending, {}
+            names = list(dict.fromkeys([*waiting, *extra]))
+            if not names:
+                return {}
+            try:
+                results = await asyncio.to_thread(revoke_batch, names)
+            except Exception as e:
+                logging.error(f"Revocation batch failed: {e}")
+                results = {
+                    name: {"ok": False, "openvpn": False, "wireguard": False, "error": str(e)}
+                    for name in names
+                }
+            revoked = [name for name, r in results.items() if r["ok"] and r["openvpn"]]
+            if revoked and self.disconnect is not None:
+                try:
+                    killed = await self.disconnect(revoked)
+                    for name in revoked:
+                        results[name]["sessions_killed"] = killed.get(name, 0)
+                except Exception as e:
+                    logging.error(f"Disconnecting revoked clients failed: {e}")
+            for name, futures in waiting.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(results[name])
+            return {name: results[name] for name in extra} if extra else results
@@ -0,0 +1,167 @@
+import heapq
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from db import get_db
+
+# Напоминания за 5..1 день и отзыв в момент notAfter.
+# «Осталось d дней» — это (notAfter - now).days == d, то есть интервал
+# (notAfter - (d+1) дней, notAfter - d дней]; напоминание d ставится на его начало.
+REMINDER_DAYS = (5, 4, 3, 2, 1)
+
+SQL_SENT_REMINDERS = "SELECT cn, not_after, days FROM expiry_reminders"
+SQL_MARK_REMINDER = (
+    "INSERT OR IGNORE INTO expiry_reminders (cn, not_after, days, sent_at) VALUES (?, ?, ?, ?)"
+)
+SQL_PRUNE_REMINDERS = "DELETE FROM expiry_reminders WHERE cn = ? AND not_after != ?"
+
+KIND_REMIND = "remind"
+KIND_EXPIRE = "expire"
+
+
+class ExpiryScheduler:
+    """
+    Мин-куча ближайших событий по сертификатам: напоминания и отзыв по истечении.
+    Спит до ближайшего срока (или до reschedule()), а не сканирует всех раз в 12 часов.
+
+    source()      -> {CN: notAfter} действующих сертификатов;
+    on_remind(cn, days) и on_expire(cn) — корутины бота. on_remind возвращает True,
+    если напоминание отправлено: тогда оно отмечается в таблице expiry_reminders
+    и после перезапуска не повторяется. Продление даёт новый notAfter — и новые напоминания.
+    on_expire возвращает True, если отзыв выполнен; иначе (или при исключении) отзыв
+    повторяется через retry_delay, с удвоением до max_retry_delay.
+    """
+
+    def __init__(self, source, on_remind, on_expire, reminder_days=REMINDER_DAYS, max_sleep=3600.0,
+                 retry_delay=60.0, max_retry_delay=3600.0):
+        self.source = source
+        self.on_remind = on_remind
+        self.on_expire = on_expire
+        self.reminder_days = tuple(sorted(reminder_days, reverse=True))
+        self.max_sleep = max_sleep
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._heap = []           # (due, seq, cn, not_after, kind, days)
+        self._seq = 0
+        self._known = {}          # CN -> notAfter, под который построены события в куче
+        self._sent = set()        # (cn, not_after iso, days) — уже отправленные напоминания
+        self._expired = set()     # (cn, not_after) — отзыв выполнен
+        self._retries = {}        # (cn, not_after) -> число неудачных попыток отзыва
+        self._wakeup = None
+
+    # ---------- планирование ----------
+
+    def load_sent(self):
+        db = get_db()
+        self._sent = {(row[0], row[1], row[2]) for row in db.fetch_all(SQL_SENT_REMINDERS)}
+
+    def reschedule(self):
+        """Сертификат выпущен/продлён/отозван: пересобрать события при следующем пробуждении."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _push(self, due, cn, not_after, kind, days=0):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, cn, not_after, kind, days))
+
+    def _schedule(self, cn, not_after, now):
+        key = not_after.isoformat()
+        for days in self.reminder_days:
+            if (cn, key, days) in self._sent:
+                continue
+            if now >= not_after - timedelta(days=days):
+                continue  # окно этого напоминания уже прошло
+            self._push(not_after - timedelta(days=days + 1), cn, not_after, KIND_REMIND, days)
+        self._push(not_after, cn, not_after, KIND_EXPIRE)
+
+    def sync(self, now=None):
+        """Сверяет сроки с source() и добавляет события для новых/изменившихся CN."""
+        now = now or datetime.now(timezone.utc)
+        current = self.source()
+        changed = [cn for cn, not_after in current.items() if self._known.get(cn) != not_after]
+        for cn in changed:
+            self._schedule(cn, current[cn], now)
+        self._known = dict(current)
+        # события удалённых/продлённых CN выбрасываются лениво, при извлечении из кучи
+        if len(self._heap) > 4 * (len(current) * (len(self.reminder_days) + 1) + 1):
+            self._heap = [e for e in self._heap if self._known.get(e[2]) == e[3]]
+            heapq.heapify(self._heap)
+        return changed
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._known.get(entry[2]) == entry[3]:
+                due.append(entry)
+        return due
+
+    def _retry_expire(self, cn, not_after):
+        attempts = self._retries.get((cn, not_after), 0) + 1
+        self._retries[(cn, not_after)] = attempts
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        self._push(datetime.now(timezone.utc) + timedelta(seconds=delay), cn, not_after, KIND_EXPIRE)
+        logging.warning(f"Revocation of expired {cn} failed (attempt {attempts}), retry in {delay:.0f}s")
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    # ---------- выполнение ----------
+
+    async def _fire(self, entry):
+        _, _, cn, not_after, kind, days = entry
+        if kind == KIND_EXPIRE:
+            if (cn, not_after) in self._expired:
+                return
+            done = False
+            try:
+                done = await self.on_expire(cn)
+            finally:
+                if done:
+                    self._expired.add((cn, not_after))
+                    self._retries.pop((cn, not_after), None)
+                else:
+                    self._retry_expire(cn, not_after)
+            return
+
+        key = (cn, not_after.isoformat(), days)
+        if key in self._sent:
+            return
+        if not await self.on_remind(cn, days):
+            return
+        self._sent.add(key)
+        try:
+            db = get_db()
+            await db.execute_async(SQL_MARK_REMINDER, (cn, key[1], days, datetime.now(timezone.utc).isoformat()))
+            await db.execute_async(SQL_PRUNE_REMINDERS, (cn, key[1]))
+        except sqlite3.Error as e:
+            logging.error(f"Error saving reminder state for {cn}: {e}")
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.load_sent)
+        while True:
+            try:
+                self._wakeup.clear()
+                now = datetime.now(timezone.utc)
+                await asyncio.to_thread(self.sync, now)
+                # все наступившие события сразу: одновременные отзывы попадут в одну пачку
+                due = self._pop_due(now)
+                results = await asyncio.gather(*(self._fire(entry) for entry in due), return_exceptions=True)
+                for entry, result in zip(due, results):
+                    if isinstance(result, Exception):
+                        logging.error(f"Expiry event {entry[4]} for {entry[2]} failed: {result}")
+            except Exception as e:
+                logging.error(f"Expiry scheduler error: {e}")
+
+            next_due = self.next_due()
+            timeout = self.max_sleep
+            if next_due is not None:
+                timeout = min(timeout, max((next_due - datetime.now(timezone.utc)).total_seconds(), 0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
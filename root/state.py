@@ -0,0 +1,497 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from db import get_db
+
+
+# Таблицы состояния и их ключевые колонки
+STATE_TABLES = ("approved_users", "pending_users", "known_users", "user_emojis", "last_menus")
+
+# Файлы, которые бот продолжает выгружать для ручной правки, и их таблицы
+MIRRORED_FILES = {"approved": "approved_users", "pending": "pending_users"}
+
+
+class StateStore:
+    """
+    Состояние бота в памяти: одобренные пользователи, заявки, users.txt,
+    смайлы и последние меню. Все проверки идут по словарям/множествам в памяти,
+    а изменения копятся и пачкой (write-behind) пишутся в vpn.db одной транзакцией.
+    """
+
+    def __init__(self, db=None, flush_interval=2.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.legacy_files = {}
+
+        self.approved = set()   # user_id
+        self.pending = {}       # user_id -> {"username": ..., "fullname": ...}
+        self.users = set()      # user_id всех, кто работал с ботом
+        self.emojis = {}        # user_id -> emoji
+        self.menus = {}         # chat_id -> [message_id, ...]
+
+        self._dirty = {table: set() for table in STATE_TABLES}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = None
+
+        self.auth_listeners = []  # вызываются с user_id (или None) при смене одобрения/заявки
+        self._file_sigs = {}      # kind -> (mtime_ns, size) последней известной версии файла
+
+    # ---------- загрузка ----------
+
+    def load(self, legacy_files=None):
+        """Один раз импортирует старые файлы и читает всё в память (таблицы создают миграции db.py)."""
+        if self.db is None:
+            self.db = get_db()
+        self.legacy_files = dict(legacy_files or {})
+        if legacy_files and not self._legacy_imported():
+            self.import_legacy_files(legacy_files)
+
+        db = self.db
+        self.approved = {row[0] for row in db.fetch_all("SELECT user_id FROM approved_users")}
+        self.pending = {
+            row[0]: {"username": row[1], "fullname": row[2]}
+            for row in db.fetch_all("SELECT user_id, username, fullname FROM pending_users")
+        }
+        self.users = {row[0] for row in db.fetch_all("SELECT user_id FROM known_users")}
+        self.emojis = dict(db.fetch_all("SELECT user_id, emoji FROM user_emojis"))
+        self.menus = {
+            row[0]: json.loads(row[1])
+            for row in db.fetch_all("SELECT chat_id, message_ids FROM last_menus")
+        }
+        for kind in MIRRORED_FILES:
+            self._file_sigs[kind] = _file_sig(self.legacy_files.get(kind))
+        logging.info(
+            f"State loaded: {len(self.approved)} approved, {len(self.pending)} pending, "
+            f"{len(self.users)} users, {len(self.emojis)} emojis, {len(self.menus)} menus."
+        )
+
+    def _legacy_imported(self):
+        row = self.db.fetch_one("SELECT value FROM state_meta WHERE key = 'legacy_imported'")
+        return row is not None
+
+    def import_legacy_files(self, files):
+        """
+        Переносит approved_users.txt, pending_users.json, users.txt,
+        user_emojis.json и last_menus.json в vpn.db. Выполняется один раз.
+        """
+        approved = _read_id_lines(files.get("approved"))
+        users = _read_id_lines(files.get("users"))
+        pending = _read_json(files.get("pending"))
+        emojis = _read_json(files.get("emojis"))
+        menus = _read_json(files.get("menus"))
+
+        with self.db.transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO approved_users (user_id) VALUES (?)",
+                [(uid,) for uid in approved]
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO known_users (user_id) VALUES (?)",
+                [(uid,) for uid in users]
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO pending_users (user_id, username, fullname) VALUES (?, ?, ?)",
+                [
+                    (int(uid), (info or {}).get("username"), (info or {}).get("fullname"))
+                    for uid, info in pending.items() if _is_int(uid)
+                ]
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO user_emojis (user_id, emoji) VALUES (?, ?)",
+                [(int(uid), emoji) for uid, emoji in emojis.items() if _is_int(uid) and emoji]
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO last_menus (chat_id, message_ids) VALUES (?, ?)",
+                [(int(cid), json.dumps(ids)) for cid, ids in menus.items() if _is_int(cid) and ids]
+            )
+            # все, кого знали старые файлы, — и в users; username берём из заявок
+            usernames = {
+                int(uid): (info or {}).get("username") or None for uid, info in pending.items() if _is_int(uid)
+            }
+            db.upsert_users([
+                (uid, usernames.get(uid), None)
+                for uid in sorted(set(approved) | set(users) | set(usernames))
+            ])
+            db.execute("INSERT OR REPLACE INTO state_meta (key, value) VALUES ('legacy_imported', '1')")
+        logging.info(
+            f"Legacy files imported: {len(approved)} approved, {len(pending)} pending, "
+            f"{len(users)} users, {len(emojis)} emojis, {len(menus)} menus."
+        )
+
+    # ---------- одобренные ----------
+
+    def is_approved(self, user_id):
+        return int(user_id) in self.approved
+
+    def approve(self, user_id):
+        user_id = int(user_id)
+        if user_id not in self.approved:
+            self.approved.add(user_id)
+            self._mark("approved_users", user_id)
+            self._auth_changed(user_id)
+
+    def disapprove(self, user_id):
+        user_id = int(user_id)
+        if user_id in self.approved:
+            self.approved.discard(user_id)
+            self._mark("approved_users", user_id)
+            self._auth_changed(user_id)
+
+    # ---------- заявки ----------
+
+    def is_pending(self, user_id):
+        return int(user_id) in self.pending
+
+    def add_pending(self, user_id, username, fullname):
+        user_id = int(user_id)
+        self.pending[user_id] = {"username": username, "fullname": fullname}
+        self._mark("pending_users", user_id)
+        self._auth_changed(user_id)
+
+    def remove_pending(self, user_id):
+        user_id = int(user_id)
+        if self.pending.pop(user_id, None) is not None:
+            self._mark("pending_users", user_id)
+            self._auth_changed(user_id)
+
+    # ---------- users.txt ----------
+
+    def add_user(self, user_id):
+        user_id = int(user_id)
+        if user_id not in self.users:
+            self.users.add(user_id)
+            self._mark("known_users", user_id)
+
+    def remove_user(self, user_id):
+        user_id = int(user_id)
+        if user_id in self.users:
+            self.users.discard(user_id)
+            self._mark("known_users", user_id)
+
+    # ---------- смайлы ----------
+
+    def get_emoji(self, user_id):
+        return self.emojis.get(int(user_id), "")
+
+    def set_emoji(self, user_id, emoji):
+        user_id = int(user_id)
+        if emoji:
+            self.emojis[user_id] = emoji
+        else:
+            self.emojis.pop(user_id, None)
+        self._mark("user_emojis", user_id)
+
+    # ---------- меню ----------
+
+    def get_menus(self, chat_id):
+        return list(self.menus.get(int(chat_id), []))
+
+    def set_menus(self, chat_id, message_ids):
+        chat_id = int(chat_id)
+        if message_ids:
+            self.menus[chat_id] = list(message_ids)
+        else:
+            self.menus.pop(chat_id, None)
+        self._mark("last_menus", chat_id)
+
+    def pop_menus(self, chat_id):
+        chat_id = int(chat_id)
+        ids = self.menus.pop(chat_id, [])
+        if ids:
+            self._mark("last_menus", chat_id)
+        return ids
+
+    # ---------- правка файлов на диске ----------
+
+    def _auth_changed(self, user_id):
+        for listener in self.auth_listeners:
+            listener(user_id)
+
+    def check_legacy_files(self):
+        """
+        Проверяет, не правили ли approved_users.txt / pending_users.json вручную.
+        Изменённый файл считается главным: его содержимое заменяет данные в памяти.
+        Возвращает True, если что-то перечитано.
+        """
+        # пока идёт своя выгрузка файлов, подпись ещё не обновлена — проверим в следующий раз
+        if not self._write_lock.acquire(blocking=False):
+            return False
+        try:
+            reloaded = self._reload_changed_files()
+        finally:
+            self._write_lock.release()
+        if reloaded:
+            self._auth_changed(None)
+        return reloaded
+
+    def _reload_changed_files(self):
+        reloaded = False
+        for kind in MIRRORED_FILES:
+            path = self.legacy_files.get(kind)
+            sig = _file_sig(path)
+            if sig is None or sig == self._file_sigs.get(kind):
+                continue
+            self._file_sigs[kind] = sig
+            if kind == "approved":
+                new = set(_read_id_lines(path))
+                for user_id in new ^ self.approved:
+                    self._mark("approved_users", user_id)
+                self.approved = new
+            else:
+                new = {
+                    int(uid): {"username": (info or {}).get("username"), "fullname": (info or {}).get("fullname")}
+                    for uid, info in _read_json(path).items() if _is_int(uid)
+                }
+                for user_id in set(new) | set(self.pending):
+                    self._mark("pending_users", user_id)
+                self.pending = new
+            logging.info(f"{path} changed on disk, reloaded.")
+            reloaded = True
+        return reloaded
+
+    def _export_files(self, export):
+        """Выгружает approved_users.txt / pending_users.json атомарно (temp + rename)."""
+        for kind, data in export.items():
+            path = self.legacy_files.get(kind)
+            if not path:
+                continue
+            tmp = f"{path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    if kind == "approved":
+                        f.writelines(f"{uid}\n" for uid in data)
+                    else:
+                        json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, path)
+                self._file_sigs[kind] = _file_sig(path)
+            except OSError as e:
+                logging.error(f"Can't write {path}: {e}")
+
+    # ---------- запись в БД ----------
+
+    def _mark(self, table, key):
+        with self._lock:
+            self._dirty[table].add(key)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _collect(self):
+        """Забирает грязные ключи и снимает с памяти строки для записи."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {table: set() for table in STATE_TABLES}
+
+        changes = {}
+        for table, keys in dirty.items():
+            if not keys:
+                continue
+            upserts, deletes = [], []
+            for key in keys:
+                row = self._row(table, key)
+                if row is None:
+                    deletes.append((key,))
+                else:
+                    upserts.append(row)
+            changes[table] = (upserts, deletes)
+
+        export = {}
+        if "approved_users" in changes:
+            export["approved"] = sorted(self.approved)
+        if "pending_users" in changes:
+            export["pending"] = {str(uid): dict(info) for uid, info in self.pending.items()}
+        return changes, export
+
+    def _row(self, table, key):
+        if table == "approved_users":
+            return (key,) if key in self.approved else None
+        if table == "pending_users":
+            info = self.pending.get(key)
+            return (key, info["username"], info["fullname"]) if info is not None else None
+        if table == "known_users":
+            return (key,) if key in self.users else None
+        if table == "user_emojis":
+            emoji = self.emojis.get(key)
+            return (key, emoji) if emoji else None
+        if table == "last_menus":
+            ids = self.menus.get(key)
+            return (key, json.dumps(ids)) if ids else None
+        return None
+
+    def _write(self, changes, export):
+        """Пишет пачку изменений одной транзакцией: либо всё, либо ничего."""
+        with self._write_lock:
+            with self.db.transaction() as db:
+                for table, (upserts, deletes) in changes.items():
+                    key_column = "chat_id" if table == "last_menus" else "user_id"
+                    if deletes:
+                        db.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", deletes)
+                    if upserts:
+                        placeholders = ", ".join("?" * len(upserts[0]))
+                        db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", upserts)
+            self._export_files(export)
+
+    def _requeue(self, changes):
+        with self._lock:
+            for table, (upserts, deletes) in changes.items():
+                self._dirty[table].update(row[0] for row in upserts)
+                self._dirty[table].update(row[0] for row in deletes)
+
+    def flush(self):
+        """Синхронно сбрасывает накопленные изменения (используется при остановке)."""
+        if self.db is None:
+            return
+        changes, export = self._collect()
+        if not changes:
+            return
+        try:
+            self._write(changes, export)
+        except sqlite3.Error as e:
+            logging.error(f"State flush error: {e}")
+            self._requeue(changes)
+
+    async def run(self):
+        """Фоновая задача: ждёт изменений и раз в flush_interval пишет их пачкой."""
+        self._wakeup = asyncio.Event()
+        if any(self._dirty.values()):
+            self._wakeup.set()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            changes, export = self._collect()
+            if not changes:
+                continue
+            try:
+                await asyncio.to_thread(self._write, changes, export)
+            except sqlite3.Error as e:
+                logging.error(f"State flush error: {e}")
+                self._requeue(changes)
+                self._wakeup.set()
+
+    def close(self):
+        self.flush()
+
+
+class MenuTracker:
+    """
+    Последние меню бота в каждом чате — чтобы при показе нового экрана удалить старые.
+    Хранит не больше max_per_chat id на чат (самые старые вытесняются), данные живут
+    в StateStore: изменения одного чата помечаются грязными и пишутся пачкой при flush.
+    """
+
+    def __init__(self, store, max_per_chat=3):
+        self.store = store
+        self.max_per_chat = max_per_chat
+
+    def get(self, chat_id):
+        return self.store.get_menus(chat_id)
+
+    def track(self, chat_id, message_id):
+        """Запоминает новое меню в чате."""
+        ids = self.store.get_menus(chat_id)
+        if ids and ids[-1] == message_id:
+            return
+        if message_id in ids:
+            ids.remove(message_id)
+        ids.append(message_id)
+        self.store.set_menus(chat_id, ids[-self.max_per_chat:])
+
+    def pop(self, chat_id):
+        """Забывает все меню чата и возвращает их id (для удаления сообщений)."""
+        return self.store.pop_menus(chat_id)
+
+    def trim(self):
+        """Обрезает чаты, накопившие больше max_per_chat id (например, после импорта)."""
+        for chat_id, ids in list(self.store.menus.items()):
+            if len(ids) > self.max_per_chat:
+                self.store.set_menus(chat_id, ids[-self.max_per_chat:])
+
+
+class AuthCache:
+    """
+    Кэш решения «пускать ли пользователя к кнопкам»: одобрен или ждёт одобрения.
+    Поиск — O(1) по словарю; запись сбрасывается при approve/remove/add_pending/remove_pending,
+    а весь кэш — при ручной правке файлов на диске (проверка не чаще раза в check_interval).
+    Кэшируются только разрешения: отказ посторонним — та же проверка по множествам, а запись
+    о каждом написавшем боту незнакомце копилась бы без ограничений.
+    """
+
+    def __init__(self, store, check_interval=5.0):
+        self.store = store
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._allowed = {}
+        self._next_check = 0.0
+        store.auth_listeners.append(self.invalidate)
+
+    def is_allowed(self, user_id):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self.store.check_legacy_files()
+
+        allowed = self._allowed.get(user_id)
+        if allowed is not None:
+            self.hits += 1
+            return allowed
+        self.misses += 1
+        allowed = user_id in self.store.approved or user_id in self.store.pending
+        if allowed:
+            self._allowed[user_id] = True
+        return allowed
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self._allowed.clear()
+        else:
+            self._allowed.pop(int(user_id), None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._allowed), "hit_ratio": round(ratio, 3)}
+
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _is_int(value):
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _read_id_lines(path):
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r") as f:
+            return [int(line.strip()) for line in f if line.strip().isdigit()]
+    except OSError as e:
+        logging.error(f"Can't read {path}: {e}")
+        return []
+
+
+def _read_json(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Can't read {path}: {e}")
+        return {}
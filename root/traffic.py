@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime
+
+from db import get_db
+from wgconf import wg_index
+from wgstats import wg_telemetry
+
+# Учёт трафика по клиентам. Раз в interval секунд снимаются счётчики:
+#   OpenVPN — из таблицы сессий presence (без I/O); байты сессии после её последнего
+#   опроса presence и до отключения в учёт не попадают;
+#   WireGuard/AmneziaWG — из общего снимка `wg show all dump` (wgstats).
+# Считаются приращения к прошлому снимку; если счётчик стал меньше (переподключение,
+# перезапуск сервера или интерфейса), приращением считается всё текущее значение.
+# Приращения складываются в свёртки по часам, дням, месяцам и за всё время,
+# так что экран статистики читает несколько строк по первичному ключу.
+
+HOURLY_RETENTION_DAYS = 7
+DAILY_RETENTION_DAYS = 400
+
+ROLLUPS = (
+    ("traffic_hourly", "%Y-%m-%d %H"),
+    ("traffic_daily", "%Y-%m-%d"),
+    ("traffic_monthly", "%Y-%m"),
+)
+SQL_ADD_TOTAL = (
+    "INSERT INTO traffic_total (cn, rx, tx) VALUES (?, ?, ?) "
+    "ON CONFLICT(cn) DO UPDATE SET rx = rx + excluded.rx, tx = tx + excluded.tx"
+)
+SQL_SAVE_COUNTER = "INSERT OR REPLACE INTO traffic_counters (key, rx, tx) VALUES (?, ?, ?)"
+SQL_DELETE_COUNTER = "DELETE FROM traffic_counters WHERE key = ?"
+
+
+def _sql_add_rollup(table):
+    return (
+        f"INSERT INTO {table} (cn, period, rx, tx) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(cn, period) DO UPDATE SET rx = rx + excluded.rx, tx = tx + excluded.tx"
+    )
+
+
+def counter_delta(previous, current):
+    """Приращение счётчика с учётом сброса: меньше прошлого значения — значит, начал с нуля."""
+    if previous is None or current < previous:
+        return current
+    return current - previous
+
+
+def human_bytes(value):
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "Б" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.2f} ТБ"
+
+
+class TrafficCollector:
+    """
+    Снимает счётчики, считает приращения и пишет их в свёртки одной транзакцией.
+    rx — байты, принятые сервером от клиента (отдача клиента), tx — отправленные клиенту.
+    Последние значения счётчиков хранятся в traffic_counters, чтобы перезапуск бота
+    не засчитывал уже учтённое повторно.
+    """
+
+    def __init__(self, presence=None, interval=60.0, peer_names=wg_index.names):
+        self.presence = presence
+        self.interval = interval
+        self.peer_names = peer_names  # () -> {pubkey: имя клиента}
+        self.listeners = []       # вызываются с {CN: (rx, tx)} после каждой записи
+        self._last = {}           # key -> (rx, tx)
+        self._pending = {}        # CN -> [rx, tx] — приращения, которые не удалось записать
+
+    def load(self):
+        self._last = {row[0]: (row[1], row[2]) for row in get_db().fetch_all("SELECT key, rx, tx FROM traffic_counters")}
+
+    @staticmethod
+    def _ovpn_key(instance, session):
+        sid = session["client_id"] or session["real_address"]
+        return f"ovpn|{instance}|{session['cn']}|{sid}|{session['connected_since']}"
+
+    async def sample(self):
+        """Один снимок: {CN: (rx, tx)} приращений и новые значения счётчиков."""
+        counters = {}   # key -> (cn, rx, tx)
+        read = []       # префиксы ключей источников, которые в этом снимке удалось прочитать
+        present = set() # ключи, которые есть в снимке, но не считаются
+        if self.presence is not None:
+            for instance, table in self.presence.sessions.items():
+                if self.presence.sources.get(instance):
+                    read.append(f"ovpn|{instance}|")
+                for session in table.values():
+                    if session["cn"]:
+                        key = self._ovpn_key(instance, session)
+                        counters[key] = (session["cn"], session["bytes_received"], session["bytes_sent"])
+        wg_peers = await wg_telemetry.sample()
+        if wg_peers is not None:
+            read.append("wg|")
+        if wg_peers:
+            names = await asyncio.to_thread(self.peer_names)
+            for peer in wg_peers:
+                key = f"wg|{peer.interface}|{peer.public_key}"
+                cn = names.get(peer.public_key)
+                if cn:
+                    counters[key] = (cn, peer.rx, peer.tx)
+                else:
+                    present.add(key)  # peer жив, но имя не найдено — базу не трогаем
+
+        deltas, self._pending = self._pending, {}
+        for key, (cn, rx, tx) in counters.items():
+            last_rx, last_tx = self._last.get(key, (None, None))
+            acc = deltas.setdefault(cn, [0, 0])
+            acc[0] += counter_delta(last_rx, rx)
+            acc[1] += counter_delta(last_tx, tx)
+        # ключ пропал из снимка — сессия закрыта; но только если его источник прочитан,
+        # иначе сбой чтения обнулил бы базу и следующий снимок засчитал бы счётчики заново
+        read = tuple(read)
+        gone = [key for key in self._last if key not in counters and key not in present and key.startswith(read)]
+        return {cn: (rx, tx) for cn, (rx, tx) in deltas.items() if rx or tx}, counters, gone
+
+    def _write(self, deltas, counters, gone, now):
+        db = get_db()
+        with db.transaction():
+            for table, fmt in ROLLUPS:
+                period = now.strftime(fmt)
+                db.executemany(_sql_add_rollup(table), [(cn, period, rx, tx) for cn, (rx, tx) in deltas.items()])
+            db.executemany(SQL_ADD_TOTAL, [(cn, rx, tx) for cn, (rx, tx) in deltas.items()])
+            db.executemany(SQL_SAVE_COUNTER, [(key, rx, tx) for key, (_, rx, tx) in counters.items()])
+            db.executemany(SQL_DELETE_COUNTER, [(key,) for key in gone])
+
+    def prune(self, now=None):
+        now = now or datetime.now()
+        hour_cutoff = datetime.fromtimestamp(now.timestamp() - HOURLY_RETENTION_DAYS * 86400).strftime("%Y-%m-%d %H")
+        day_cutoff = datetime.fromtimestamp(now.timestamp() - DAILY_RETENTION_DAYS * 86400).strftime("%Y-%m-%d")
+        db = get_db()
+        with db.transaction():
+            db.execute("DELETE FROM traffic_hourly WHERE period < ?", (hour_cutoff,))
+            db.execute("DELETE FROM traffic_daily WHERE period < ?", (day_cutoff,))
+
+    async def collect(self):
+        deltas, counters, gone = await self.sample()
+        now = datetime.now()
+        try:
+            await get_db().run(self._write, deltas, counters, gone, now)
+        except sqlite3.Error as e:
+            logging.error(f"Traffic: cannot save sample: {e}")
+            # не теряем приращения: вернём их в следующий снимок
+            for cn, (rx, tx) in deltas.items():
+                acc = self._pending.setdefault(cn, [0, 0])
+                acc[0] += rx
+                acc[1] += tx
+            deltas = {}  # слушатели получат их вместе со следующей записью
+        for key in gone:
+            self._last.pop(key, None)
+        self._last.update({key: (rx, tx) for key, (_, rx, tx) in counters.items()})
+        for listener in self.listeners:
+            try:
+                await listener(deltas)
+            except Exception as e:
+                logging.error(f"Traffic listener failed: {e}")
+        return deltas
+
+    async def run(self):
+        await asyncio.to_thread(self.load)
+        last_prune = None
+        while True:
+            try:
+                await self.collect()
+                today = datetime.now().date()
+                if last_prune != today:
+                    await asyncio.to_thread(self.prune)
+                    last_prune = today
+            except Exception as e:
+                logging.error(f"Traffic collector error: {e}")
+            await asyncio.sleep(self.interval)
+
+
+async def get_usage(cn, now=None):
+    """
+    {"today", "month", "total"} -> (rx, tx) для клиента:
+    три чтения по первичному ключу, независимо от длины истории.
+    """
+    now = now or datetime.now()
+    db = get_db()
+
+    def read():
+        usage = {}
+        for name, table, fmt in (("today", "traffic_daily", "%Y-%m-%d"), ("month", "traffic_monthly", "%Y-%m")):
+            row = db.fetch_one(f"SELECT rx, tx FROM {table} WHERE cn = ? AND period = ?", (cn, now.strftime(fmt)))
+            usage[name] = tuple(row) if row else (0, 0)
+        row = db.fetch_one("SELECT rx, tx FROM traffic_total WHERE cn = ?", (cn,))
+        usage["total"] = tuple(row) if row else (0, 0)
+        return usage
+
+    try:
+        return await db.run(read)
+    except sqlite3.Error as e:
+        logging.error(f"Traffic: cannot read usage for {cn}: {e}")
+        return {"today": (0, 0), "month": (0, 0), "total": (0, 0)}
@@ -0,0 +1,312 @@
+import os
+import sys
+import time
+import fcntl
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Серверные конфиги WireGuard/AmneziaWG. client.sh дописывает в них клиента блоком
+#   # Client = <имя>
+#   [Peer]
+#   PublicKey = ...
+#   PresharedKey = ...
+#   AllowedIPs = 10.29.8.2/32
+# Блок заканчивается строкой AllowedIPs. По этим блокам строится индекс
+# pubkey -> клиент, интерфейс и адрес, который перечитывается только при смене файлов.
+#
+# WgServerConfig — модель такого конфига: секция [Interface] как есть и таблица
+# блоков клиентов по имени. Добавление, замена и удаление — в памяти, запись — одна
+# на пачку правок, через временный файл и rename, под flock на <конфиг>.lock,
+# так что бот и client.sh не портят файл друг другу.
+#
+# Из client.sh:
+#   eval "$(python3 /root/wgconf.py get <клиент>)"      — ключи существующего клиента
+#   CLIENT_PRIVATE_KEY=... CLIENT_PUBLIC_KEY=... CLIENT_PRESHARED_KEY=... \
+#       python3 /root/wgconf.py add <интерфейс> <клиент> <allowed-ips>
+#   python3 /root/wgconf.py remove <клиент> [интерфейс ...]
+
+WG_CONFIGS = {
+    "antizapret": "/etc/wireguard/antizapret.conf",
+    "vpn": "/etc/wireguard/vpn.conf",
+}
+
+WgPeer = namedtuple("WgPeer", "client interface public_key allowed_ips")
+
+
+def _value(line):
+    return line.split("=", 1)[1].strip()
+
+
+def parse_peers(lines, interface):
+    """[WgPeer] по блокам `# Client = <имя>` серверного конфига."""
+    peers = []
+    client = public_key = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith("# Client ="):
+            client, public_key = _value(line), None
+        elif client is None:
+            continue
+        elif line.startswith("PublicKey"):
+            public_key = _value(line)
+        elif line.startswith("AllowedIPs"):
+            if public_key:
+                peers.append(WgPeer(client, interface, public_key, _value(line)))
+            client = public_key = None
+    return peers
+
+
+WgClient = namedtuple("WgClient", "name private_key public_key preshared_key allowed_ips lines")
+
+
+def _client_from_lines(name, lines):
+    fields = {}
+    for line in lines:
+        stripped = line.strip().lstrip("# ")
+        for key in ("PrivateKey", "PublicKey", "PresharedKey", "AllowedIPs"):
+            if stripped.startswith(key) and "=" in stripped:
+                fields.setdefault(key, _value(stripped))
+    return WgClient(
+        name, fields.get("PrivateKey"), fields.get("PublicKey"),
+        fields.get("PresharedKey"), fields.get("AllowedIPs"), lines,
+    )
+
+
+def client_block(name, private_key, public_key, preshared_key, allowed_ips):
+    """Блок клиента в том виде, в каком его пишет client.sh."""
+    lines = [f"# Client = {name}\n"]
+    if private_key:
+        lines.append(f"# PrivateKey = {private_key}\n")
+    lines += ["[Peer]\n", f"PublicKey = {public_key}\n"]
+    if preshared_key:
+        lines.append(f"PresharedKey = {preshared_key}\n")
+    lines.append(f"AllowedIPs = {allowed_ips}\n")
+    return _client_from_lines(name, lines)
+
+
+class WgServerConfig:
+    """
+    Серверный конфиг: header — строки до первого блока клиента ([Interface] и всё,
+    что не относится к клиентам), clients — {имя: WgClient} в порядке файла.
+    Строки между блоками, не входящие в них, остаются после предыдущего блока.
+    Пустые строки между блоками схлопываются до одной, как делает client.sh.
+    """
+
+    def __init__(self, path, header=None, clients=None, extra=None):
+        self.path = path
+        self.header = header or []
+        self.clients = clients or {}
+        self.extra = extra or {}  # имя -> строки после блока клиента
+        self.modified = False
+
+    @classmethod
+    def parse(cls, path, lines):
+        header, clients, extra = [], {}, {}
+        current = None        # имя блока, который сейчас собирается
+        block = []
+        last = None           # имя последнего законченного блока
+        for line in lines:
+            if not line.endswith("\n"):
+                line += "\n"
+            if line.startswith("# Client ="):
+                current, block = _value(line), [line]
+                continue
+            if current is not None:
+                block.append(line)
+                if line.startswith("AllowedIPs"):
+                    clients[current] = _client_from_lines(current, block)
+                    extra.pop(current, None)
+                    last, current = current, None
+                continue
+            if last is None:
+                header.append(line)
+            elif line.strip():
+                extra.setdefault(last, []).append(line)
+        if current is not None:
+            # незаконченный блок (нет AllowedIPs) — сохраняем как есть
+            (extra.setdefault(last, []) if last else header).extend(block)
+        return cls(path, header, clients, extra)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.parse(path, f)
+
+    def get(self, name):
+        return self.clients.get(name)
+
+    def set(self, client):
+        """Добавляет клиента или заменяет его блок на том же месте."""
+        if self.clients.get(client.name) != client:
+            self.clients[client.name] = client
+            self.modified = True
+
+    def add(self, name, private_key, public_key, preshared_key, allowed_ips):
+        client = client_block(name, private_key, public_key, preshared_key, allowed_ips)
+        self.set(client)
+        return client
+
+    def remove(self, name):
+        """Удаляет блок клиента. True, если он был."""
+        if self.clients.pop(name, None) is None:
+            return False
+        self.extra.pop(name, None)
+        self.modified = True
+        return True
+
+    def render(self):
+        lines = list(self.header)
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if lines:
+            lines.append("\n")
+        for name, client in self.clients.items():
+            lines.extend(client.lines)
+            lines.extend(self.extra.get(name, ()))
+            lines.append("\n")
+        return "".join(lines)
+
+    def save(self):
+        """Атомарная запись: временный файл рядом, fsync и rename; права файла сохраняются."""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp, os.stat(self.path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
+        self.modified = False
+
+
+@contextmanager
+def edit(path):
+    """Загружает конфиг под блокировкой и записывает его один раз, если что-то изменилось."""
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        config = WgServerConfig.load(path)
+        yield config
+        if config.modified:
+            config.save()
+
+
+class WgPeerIndex:
+    """
+    Все клиенты серверных конфигов WireGuard: поиск по pubkey и по имени за O(1).
+    Файл разбирается заново только при смене (inode, mtime, size), проверка —
+    не чаще раза в check_interval; остальные обращения читают готовые словари.
+    """
+
+    def __init__(self, paths=None, check_interval=1.0):
+        self.paths = dict(WG_CONFIGS if paths is None else paths)
+        self.check_interval = check_interval
+        self.by_pubkey = {}     # pubkey -> WgPeer
+        self.by_client = {}     # имя -> [WgPeer] (по одному на интерфейс)
+        self._files = {}        # interface -> (sig, [WgPeer])
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Перечитывает изменившиеся конфиги. Возвращает True, если индекс поменялся."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            changed = False
+            for interface, path in self.paths.items():
+                try:
+                    st = os.stat(path)
+                    sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+                except OSError:
+                    sig = None
+                cached = self._files.get(interface)
+                if cached is not None and cached[0] == sig:
+                    continue
+                peers = []
+                if sig is not None:
+                    try:
+                        with open(path, encoding="utf-8", errors="replace") as f:
+                            peers = parse_peers(f, interface)
+                    except OSError as e:
+                        logging.warning(f"Cannot read {path}: {e}")
+                        continue
+                self._files[interface] = (sig, peers)
+                changed = True
+            if changed:
+                by_pubkey, by_client = {}, {}
+                for _, peers in self._files.values():
+                    for peer in peers:
+                        by_pubkey[peer.public_key] = peer
+                        by_client.setdefault(peer.client, []).append(peer)
+                self.by_pubkey, self.by_client = by_pubkey, by_client
+            return changed
+
+    def get(self, public_key):
+        """WgPeer по публичному ключу или None."""
+        self.refresh()
+        return self.by_pubkey.get(public_key)
+
+    def peers_for(self, client):
+        """[WgPeer] клиента на всех интерфейсах."""
+        self.refresh()
+        return list(self.by_client.get(client, ()))
+
+    def pubkeys_for(self, client):
+        return [peer.public_key for peer in self.peers_for(client)]
+
+    def names(self):
+        """{pubkey: имя клиента}."""
+        self.refresh()
+        return {key: peer.client for key, peer in self.by_pubkey.items()}
+
+
+wg_index = WgPeerIndex()
+
+
+def main(argv):
+    command, args = (argv[1], argv[2:]) if len(argv) > 1 else (None, [])
+    if command == "get" and len(args) == 1:
+        # ключи клиента из первого конфига, где он есть (в обоих они одинаковые)
+        for path in WG_CONFIGS.values():
+            try:
+                client = WgServerConfig.load(path).get(args[0])
+            except OSError:
+                continue
+            if client:
+                print(f"CLIENT_PRIVATE_KEY='{client.private_key or ''}'")
+                print(f"CLIENT_PUBLIC_KEY='{client.public_key or ''}'")
+                print(f"CLIENT_PRESHARED_KEY='{client.preshared_key or ''}'")
+                return 0
+        return 1
+    if command == "add" and len(args) == 3 and args[0] in WG_CONFIGS:
+        public_key = os.environ.get("CLIENT_PUBLIC_KEY")
+        if not public_key:
+            print("add: CLIENT_PUBLIC_KEY is not set", file=sys.stderr)
+            return 2
+        with edit(WG_CONFIGS[args[0]]) as config:
+            config.add(
+                args[1], os.environ.get("CLIENT_PRIVATE_KEY"), public_key,
+                os.environ.get("CLIENT_PRESHARED_KEY"), args[2],
+            )
+        return 0
+    if command == "remove" and args and all(arg in WG_CONFIGS for arg in args[1:]):
+        removed = False
+        for interface in args[1:] or WG_CONFIGS:
+            try:
+                with edit(WG_CONFIGS[interface]) as config:
+                    removed = config.remove(args[0]) or removed
+            except OSError as e:
+                print(f"{WG_CONFIGS[interface]}: {e}", file=sys.stderr)
+        return 0 if removed else 1
+    print(f"Usage: {argv[0]} get <client> | add <interface> <client> <allowed-ips> | remove <client> [interface ...]",
+          file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,247 @@
+import sys
+import ipaddress
+
+from db import init_db, get_db, DEFAULT_DB_PATH
+from wgconf import WG_CONFIGS, parse_peers, edit
+
+# Выдача адресов клиентам WireGuard. Пул интерфейса — все IPv4-подсети из строк Address
+# серверного конфига (`Address = 10.29.8.1/24, 10.29.9.1/24` или один префикс крупнее /24),
+# подсети идут в пуле друг за другом. Занятые адреса — битовая карта в vpn.db
+# (бит n — n-й адрес пула) вместе с выданными адресами. Свободный адрес — младший
+# нулевой бит: ((bits+1) & ~bits), без перебора адресов и без чтения конфига.
+# Клиент, которому адрес уже выдан, получает тот же адрес (пересоздание профилей его не меняет).
+# Карта строится из блоков `# Client =` конфига один раз — при первом обращении
+# или если подсети интерфейса сменились; `rebuild` пересобирает её принудительно.
+# Уже выданные адреса при этом сохраняются, так что пул можно расширять на ходу.
+#
+# Из client.sh:
+#   python3 /root/wgpool.py allocate <интерфейс> <клиент>   -> печатает адрес
+#   python3 /root/wgpool.py release <клиент> [интерфейс ...]
+#   python3 /root/wgpool.py rebuild [интерфейс ...]
+# Вручную:
+#   python3 /root/wgpool.py extend <интерфейс> <подсеть>    -> добавляет подсеть в Address
+
+SQL_GET_POOL = "SELECT network, used FROM wg_pools WHERE interface = ?"
+SQL_SAVE_POOL = "INSERT OR REPLACE INTO wg_pools (interface, network, used) VALUES (?, ?, ?)"
+SQL_GET_LEASE = "SELECT host FROM wg_leases WHERE interface = ? AND client = ?"
+SQL_ADD_LEASE = "INSERT OR REPLACE INTO wg_leases (interface, client, host) VALUES (?, ?, ?)"
+SQL_DELETE_LEASE = "DELETE FROM wg_leases WHERE interface = ? AND client = ?"
+SQL_DELETE_LEASES = "DELETE FROM wg_leases WHERE interface = ?"
+
+
+class PoolError(Exception):
+    pass
+
+
+def lowest_free(bits):
+    """Номер младшего нулевого бита."""
+    return ((bits + 1) & ~bits).bit_length() - 1
+
+
+def _to_blob(bits, size):
+    return bits.to_bytes((size + 7) // 8, "little")
+
+
+def server_addresses(conf_path):
+    """IPv4-адреса сервера с префиксами из строк Address секции [Interface]."""
+    addresses = []
+    try:
+        with open(conf_path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("[Peer]") or line.startswith("# Client ="):
+                    break
+                if line.startswith("Address") and "=" in line:
+                    for value in line.split("=", 1)[1].split(","):
+                        address = ipaddress.ip_interface(value.strip())
+                        if address.version == 4:
+                            addresses.append(address)
+    except (OSError, ValueError) as e:
+        raise PoolError(f"{conf_path}: {e}")
+    if not addresses:
+        raise PoolError(f"{conf_path}: no IPv4 Address")
+    return addresses
+
+
+class Ranges:
+    """Подсети пула подряд: n-й адрес пула <-> IP."""
+
+    def __init__(self, networks):
+        self.networks = [ipaddress.ip_network(n) for n in networks]
+        self.offsets = []
+        offset = 0
+        for network in self.networks:
+            self.offsets.append(offset)
+            offset += network.num_addresses
+        self.size = offset
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text.split(","))
+
+    def __str__(self):
+        return ",".join(str(n) for n in self.networks)
+
+    def ip(self, index):
+        for network, offset in zip(reversed(self.networks), reversed(self.offsets)):
+            if index >= offset:
+                return network.network_address + (index - offset)
+        raise IndexError(index)
+
+    def index(self, ip):
+        """Номер адреса в пуле или None, если ip вне пула."""
+        for network, offset in zip(self.networks, self.offsets):
+            if ip in network:
+                return offset + int(ip) - int(network.network_address)
+        return None
+
+
+def _reserved(servers, ranges):
+    """Биты адресов сети, сервера и широковещательных адресов каждой подсети."""
+    bits = 0
+    for server, offset in zip(servers, ranges.offsets):
+        network = server.network
+        bits |= 1 << offset
+        bits |= 1 << (offset + network.num_addresses - 1)
+        bits |= 1 << (offset + int(server.ip) - int(network.network_address))
+    return bits
+
+
+class WgPool:
+    """Адреса одного интерфейса WireGuard."""
+
+    def __init__(self, interface, conf_path=None):
+        self.interface = interface
+        self.conf_path = conf_path or WG_CONFIGS[interface]
+
+    def rebuild(self):
+        """
+        Пересобирает карту и адреса клиентов по серверному конфигу.
+        Клиенты сохраняют свои адреса; клиенты вне подсетей пула получат новый адрес
+        при следующем allocate.
+        """
+        db = get_db()
+        servers = server_addresses(self.conf_path)
+        ranges = Ranges(server.network for server in servers)
+        bits = _reserved(servers, ranges)
+        leases = {}
+        with open(self.conf_path, encoding="utf-8", errors="replace") as f:
+            peers = parse_peers(f, self.interface)
+        for peer in peers:
+            try:
+                ip = ipaddress.ip_interface(peer.allowed_ips.split(",")[0].strip()).ip
+            except ValueError:
+                continue
+            index = ranges.index(ip)
+            if index is None or peer.client in leases or bits >> index & 1:
+                continue
+            leases[peer.client] = index
+            bits |= 1 << index
+        with db.transaction():
+            db.execute(SQL_DELETE_LEASES, (self.interface,))
+            db.executemany(SQL_ADD_LEASE, [(self.interface, client, index) for client, index in leases.items()])
+            db.execute(SQL_SAVE_POOL, (self.interface, str(ranges), _to_blob(bits, ranges.size)))
+        return ranges, bits
+
+    def _load(self):
+        row = get_db().fetch_one(SQL_GET_POOL, (self.interface,))
+        ranges = Ranges(server.network for server in server_addresses(self.conf_path))
+        if row is None or row[0] != str(ranges):
+            return self.rebuild()
+        return ranges, int.from_bytes(row[1], "little")
+
+    def allocate(self, client):
+        """Адрес клиента: уже выданный или младший свободный. PoolError, если пул заполнен."""
+        db = get_db()
+        with db.transaction():
+            ranges, bits = self._load()
+            row = db.fetch_one(SQL_GET_LEASE, (self.interface, client))
+            if row is not None:
+                return str(ranges.ip(row[0]))
+            index = lowest_free(bits)
+            if index >= ranges.size:
+                raise PoolError(f"{self.interface}: no free addresses in {ranges}")
+            bits |= 1 << index
+            db.execute(SQL_SAVE_POOL, (self.interface, str(ranges), _to_blob(bits, ranges.size)))
+            db.execute(SQL_ADD_LEASE, (self.interface, client, index))
+            return str(ranges.ip(index))
+
+    def release(self, client):
+        """Освобождает адрес клиента. Возвращает его или None, если адреса не было."""
+        db = get_db()
+        with db.transaction():
+            lease = db.fetch_one(SQL_GET_LEASE, (self.interface, client))
+            pool = db.fetch_one(SQL_GET_POOL, (self.interface,))
+            if lease is None or pool is None:
+                return None
+            ranges = Ranges.parse(pool[0])
+            bits = int.from_bytes(pool[1], "little") & ~(1 << lease[0])
+            db.execute(SQL_SAVE_POOL, (self.interface, pool[0], _to_blob(bits, ranges.size)))
+            db.execute(SQL_DELETE_LEASE, (self.interface, client))
+            return str(ranges.ip(lease[0]))
+
+    def extend(self, prefix):
+        """
+        Добавляет подсеть в Address серверного конфига (адрес сервера — первый в подсети)
+        и пересобирает карту. Новый адрес интерфейс получит после перезапуска wg-quick.
+        """
+        network = ipaddress.ip_network(prefix)
+        if network.version != 4 or network.num_addresses < 4:
+            raise PoolError(f"{prefix}: expected an IPv4 subnet of /30 or larger")
+        servers = server_addresses(self.conf_path)
+        if any(network.overlaps(server.network) for server in servers):
+            raise PoolError(f"{prefix} overlaps {self.interface} subnets")
+        server = f"{network.network_address + 1}/{network.prefixlen}"
+        with edit(self.conf_path) as config:
+            # server_addresses() уже проверил, что строка Address в [Interface] есть
+            i = next(i for i, line in enumerate(config.header) if line.startswith("Address"))
+            config.header[i] = f"{config.header[i].rstrip()}, {server}\n"
+            config.modified = True
+        return self.rebuild()
+
+
+def release_clients(names, interfaces=None):
+    """Освобождает адреса клиентов на всех (или перечисленных) интерфейсах."""
+    for interface in interfaces or WG_CONFIGS:
+        pool = WgPool(interface)
+        for name in names:
+            pool.release(name)
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ("allocate", "release", "rebuild", "extend"):
+        print(f"Usage: {argv[0]} allocate <interface> <client> | release <client> [interface ...] | "
+              f"rebuild [interface ...] | extend <interface> <subnet>", file=sys.stderr)
+        return 2
+    init_db(DEFAULT_DB_PATH)
+    command, args = argv[1], argv[2:]
+    try:
+        if command == "allocate":
+            if len(args) != 2 or args[0] not in WG_CONFIGS:
+                print("allocate: expected <interface> <client>", file=sys.stderr)
+                return 2
+            print(WgPool(args[0]).allocate(args[1]))
+        elif command == "release":
+            if not args:
+                print("release: expected <client>", file=sys.stderr)
+                return 2
+            release_clients(args[:1], args[1:])
+        elif command == "extend":
+            if len(args) != 2 or args[0] not in WG_CONFIGS:
+                print("extend: expected <interface> <subnet>", file=sys.stderr)
+                return 2
+            ranges, bits = WgPool(args[0]).extend(args[1])
+            print(f"{args[0]}: {ranges}, {ranges.size - bin(bits).count('1')} addresses free")
+            print(f"Restart wg-quick@{args[0]} to assign the new address to the interface")
+        else:
+            for interface in args or WG_CONFIGS:
+                ranges, bits = WgPool(interface).rebuild()
+                print(f"{interface}: {ranges}, {ranges.size - bin(bits).count('1')} addresses free")
+    except (PoolError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,101 @@
+import time
+import asyncio
+import logging
+from collections import namedtuple
+
+from wgconf import wg_index
+
+# Телеметрия WireGuard одним вызовом `wg show all dump`. Формат — поля через TAB:
+#   интерфейс: имя, private-key, public-key, listen-port, fwmark
+#   peer:      имя, public-key, preshared-key, endpoint, allowed-ips,
+#              latest-handshake, transfer-rx, transfer-tx, persistent-keepalive
+# Снимок кэшируется на interval секунд: экраны «кто онлайн», список пользователей
+# и учёт трафика, открытые одновременно, получают один и тот же снимок.
+# Онлайн — peer, чьё последнее рукопожатие не старше online_window: при живом трафике
+# WireGuard обновляет ключи каждые 2 минуты, через 3 минуты без рукопожатия сессия мертва.
+# Неудачный вызов `wg` даёт снимок None, а не пустой список: учёт трафика не должен
+# принимать сбой чтения за то, что все peer'ы пропали.
+
+ONLINE_WINDOW = 180
+
+WgPeerStats = namedtuple("WgPeerStats", "interface public_key endpoint allowed_ips latest_handshake rx tx")
+
+
+def parse_dump(text):
+    """[WgPeerStats] по выводу `wg show all dump`; строки интерфейсов пропускаются."""
+    peers = []
+    for line in text.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 9:
+            continue
+        try:
+            handshake, rx, tx = int(fields[5]), int(fields[6]), int(fields[7])
+        except ValueError:
+            continue
+        endpoint = fields[3] if fields[3] != "(none)" else None
+        peers.append(WgPeerStats(fields[0], fields[1], endpoint, fields[4], handshake, rx, tx))
+    return peers
+
+
+async def wg_dump():
+    """[WgPeerStats] или None, если `wg show all dump` не удалось выполнить."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "wg", "show", "all", "dump",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate()
+    except OSError as e:
+        logging.warning(f"wg show all dump: {e}")
+        return None
+    if proc.returncode != 0:
+        logging.warning(f"wg show all dump: exit {proc.returncode}: {err.decode(errors='replace').strip()}")
+        return None
+    return parse_dump(out.decode(errors="replace"))
+
+
+class WgTelemetry:
+    """Последний снимок `wg show all dump`, не старше interval секунд."""
+
+    def __init__(self, interval=30.0, online_window=ONLINE_WINDOW, dump=wg_dump):
+        self.interval = interval
+        self.online_window = online_window
+        self.dump = dump
+        self.peers = None         # None — последний вызов `wg` не удался
+        self.sampled_at = None    # time.monotonic() последнего снимка
+        self._lock = None
+
+    async def sample(self, max_age=None):
+        """Снимок peer'ов (None при сбое `wg`); параллельные вызовы ждут один и тот же `wg show`."""
+        max_age = self.interval if max_age is None else max_age
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.sampled_at is None or time.monotonic() - self.sampled_at >= max_age:
+                self.peers = await self.dump()
+                self.sampled_at = time.monotonic()
+            return self.peers
+
+    def is_online(self, peer, now=None):
+        now = time.time() if now is None else now
+        return peer.latest_handshake > 0 and now - peer.latest_handshake <= self.online_window
+
+    async def online(self):
+        """{имя клиента: "WG"} для peer'ов со свежим рукопожатием."""
+        peers = await self.sample()
+        now = time.time()
+        clients = {}
+        for peer in peers or ():
+            if self.is_online(peer, now):
+                known = wg_index.get(peer.public_key)
+                if known:
+                    clients[known.client] = "WG"
+        return clients
+
+    async def peers_for(self, client):
+        """Снимки peer'ов клиента на всех интерфейсах."""
+        keys = set(wg_index.pubkeys_for(client))
+        return [peer for peer in await self.sample() or () if peer.public_key in keys]
+
+
+wg_telemetry = WgTelemetry()
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import fcntl
+import logging
+import subprocess
+
+from wgconf import WG_CONFIGS, wg_index
+
+# Применение изменений peer'ов к работающим интерфейсам WireGuard.
+# Добавление и удаление клиента сразу применяются точечным `wg set ... peer`,
+# а полная сверка `wg syncconf` с конфигом откладывается и выполняется один раз
+# после серии изменений: каждый запрос лишь обновляет файл-метку
+# /run/wgsync/<интерфейс>.pending, а единственный фоновый процесс (держит flock
+# на <интерфейс>.lock) ждёт, пока метка DEBOUNCE секунд не менялась, и делает syncconf.
+# Метки общие для бота и client.sh: пересоздание 200 клиентов — один syncconf.
+#
+# Из client.sh (после правки серверного конфига):
+#   echo "$PSK" | python3 /root/wgsync.py add <интерфейс> <pubkey> <allowed-ips>
+#   python3 /root/wgsync.py remove <клиент>     — до удаления блоков из конфигов
+#   python3 /root/wgsync.py sync [интерфейс ...] — после удаления
+
+STATE_DIR = "/run/wgsync"
+DEBOUNCE = 2.0
+MAX_DELAY = 30.0
+SCRIPT_PATH_ENV = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+
+
+def _run(args, **kwargs):
+    env = os.environ.copy()
+    env["PATH"] = SCRIPT_PATH_ENV
+    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env, **kwargs)
+
+
+def _last_line(text):
+    lines = [line for line in (text or "").strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+def is_up(interface):
+    return os.path.exists(f"/sys/class/net/{interface}")
+
+
+def set_peer(interface, public_key, allowed_ips, preshared_key=None):
+    """Добавляет/обновляет peer на работающем интерфейсе."""
+    if not is_up(interface):
+        return True
+    args = ["wg", "set", interface, "peer", public_key, "allowed-ips", allowed_ips]
+    if preshared_key:
+        args[5:5] = ["preshared-key", "/dev/stdin"]
+    result = _run(args, input=preshared_key or "")
+    if result.returncode != 0:
+        logging.error(f"wg set {interface} peer: {_last_line(result.stderr)}")
+        return False
+    return True
+
+
+def remove_peer(interface, public_key):
+    """Убирает peer с работающего интерфейса (активная сессия рвётся сразу)."""
+    if not is_up(interface):
+        return True
+    result = _run(["wg", "set", interface, "peer", public_key, "remove"])
+    if result.returncode != 0:
+        logging.error(f"wg set {interface} peer remove: {_last_line(result.stderr)}")
+        return False
+    return True
+
+
+def remove_client(name):
+    """Точечно убирает все peer'ы клиента по серверным конфигам (до их правки)."""
+    wg_index.refresh(force=True)
+    ok = True
+    for peer in wg_index.peers_for(name):
+        ok = remove_peer(peer.interface, peer.public_key) and ok
+    return ok
+
+
+def sync_wireguard(interface):
+    """Применяет конфиг к работающему интерфейсу одним `wg syncconf`."""
+    if _run(["systemctl", "is-active", "--quiet", f"wg-quick@{interface}"]).returncode != 0:
+        return True
+    result = _run(["bash", "-c", f"wg syncconf {interface} <(wg-quick strip {interface} 2>/dev/null)"])
+    if result.returncode != 0:
+        logging.error(f"wg syncconf {interface} failed: {_last_line(result.stderr)}")
+        return False
+    return True
+
+
+def _paths(interface):
+    return os.path.join(STATE_DIR, f"{interface}.pending"), os.path.join(STATE_DIR, f"{interface}.lock")
+
+
+def request_sync(interface):
+    """Отмечает, что конфиг интерфейса изменился, и при необходимости запускает фоновый syncconf."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    pending, lock_path = _paths(interface)
+    with open(pending, "a"):
+        os.utime(pending)
+    with open(lock_path, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # фоновый процесс уже ждёт и увидит свежую метку
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "worker", interface],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _drain(interface, pending):
+    """Пока есть метка: ждать затишья и делать syncconf."""
+    first_seen = time.monotonic()
+    while True:
+        try:
+            age = time.time() - os.stat(pending).st_mtime
+        except FileNotFoundError:
+            return
+        if age < DEBOUNCE and time.monotonic() - first_seen < MAX_DELAY:
+            time.sleep(DEBOUNCE - age)
+            continue
+        os.unlink(pending)  # изменения после этой точки заведут новую метку
+        sync_wireguard(interface)
+        first_seen = time.monotonic()
+
+
+def worker(interface):
+    pending, lock_path = _paths(interface)
+    os.makedirs(STATE_DIR, exist_ok=True)
+    while True:
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            _drain(interface, pending)
+        # метка могла появиться между последней проверкой и снятием блокировки,
+        # а её автор видел блокировку занятой и процесс не запускал
+        if not os.path.exists(pending):
+            return
+
+
+def main(argv):
+    command, args = (argv[1], argv[2:]) if len(argv) > 1 else (None, [])
+    if command == "add" and len(args) == 3 and args[0] in WG_CONFIGS:
+        preshared_key = sys.stdin.read().strip() if not sys.stdin.isatty() else None
+        ok = set_peer(args[0], args[1], args[2], preshared_key)
+        request_sync(args[0])
+        return 0 if ok else 1
+    if command == "remove" and len(args) == 1:
+        return 0 if remove_client(args[0]) else 1
+    if command == "sync" and all(arg in WG_CONFIGS for arg in args):
+        for interface in args or WG_CONFIGS:
+            request_sync(interface)
+        return 0
+    if command == "worker" and len(args) == 1 and args[0] in WG_CONFIGS:
+        worker(args[0])
+        return 0
+    print(f"Usage: {argv[0]} add <interface> <pubkey> <allowed-ips> | remove <client> | sync [interface ...]",
+          file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,112 @@
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "root"))
+
+from ovpn_mgmt import ManagementPool
+
+BANNER = b">INFO:OpenVPN Management Interface Version 5 -- type 'help' for more info\r\n"
+
+
+class FakeManagement:
+    """management-интерфейс OpenVPN на unix-сокете: баннер, `kill <CN>`, обрыв по команде."""
+
+    def __init__(self, path, clients):
+        self.path = path
+        self.clients = clients    # CN -> число сессий
+        self.connections = 0
+        self.writers = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def stop(self):
+        self.drop()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def drop(self):
+        """Закрывает подключения, как перезапуск OpenVPN."""
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        writer.write(BANNER)
+        await writer.drain()
+        while line := (await reader.readline()).decode().strip():
+            if line.startswith("kill "):
+                cn = line[5:]
+                count = self.clients.pop(cn, 0)
+                if count:
+                    writer.write(f"SUCCESS: common name '{cn}' found, {count} client(s) killed\r\n".encode())
+                else:
+                    writer.write(f"ERROR: common name '{cn}' not found\r\n".encode())
+            else:
+                writer.write(b"ERROR: unknown command, enter 'help' for more options\r\n")
+            await writer.drain()
+        writer.close()
+
+
+class ManagementPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = FakeManagement(os.path.join(self.tmp.name, "vpn-udp.sock"), {"anna": 2})
+        await self.server.start()
+        self.pool = ManagementPool({
+            "vpn-udp": self.server.path,
+            "vpn-tcp": os.path.join(self.tmp.name, "missing.sock"),
+        }, timeout=1.0)
+        self.events = []
+        self.pool.add_listener(lambda name, line: self.events.append((name, line)))
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_banner_is_notification(self):
+        await self.pool.sessions["vpn-udp"].connect()
+        for _ in range(100):
+            if self.events:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.events[0][0], "vpn-udp")
+        self.assertTrue(self.events[0][1].startswith("INFO:OpenVPN Management Interface"))
+
+    async def test_kill(self):
+        killed, unreachable = await self.pool.kill(["anna", "boris"])
+        self.assertEqual(killed, {"anna": 2, "boris": 0})
+        self.assertEqual(unreachable, ["vpn-tcp"])
+
+    async def test_reconnect_after_drop(self):
+        session = self.pool.sessions["vpn-udp"]
+        connects = []
+
+        async def on_connect(s):
+            connects.append(s.name)
+
+        self.pool.add_on_connect(on_connect)
+        self.assertEqual(await session.kill("anna"), 2)
+        self.server.drop()
+        for _ in range(100):
+            if not session.connected:
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(session.connected)
+
+        self.server.clients["anna"] = 1
+        self.assertEqual(await session.kill("anna"), 1)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(connects, ["vpn-udp", "vpn-udp"])
+
+
+if __name__ == "__main__":
+    unittest.main()